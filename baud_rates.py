@@ -0,0 +1,134 @@
+"""Per-device UART baud rates: saved settings, probing and a round-trip benchmark.
+
+uart0 (pump) and uart1 (valve) open at the rate saved in BAUD_FILE, or
+DEFAULT_BAUD. The pump and valve take their rate from their own
+configuration, so the firmware cannot change it and must use the same
+one. BAUD:<device> <rate> sets it by hand.
+
+probe() finds it. At each of RATES, fastest first, it sends the status
+query ROUND_TRIPS times and times each complete answer frame. The device
+answers only at its own rate; at any other rate it sees framing errors
+and stays silent, or the bytes that come back do not make a frame. The
+fastest rate that answers at least half the queries is kept. Each line of
+the result also gives the wire time of the longest command (the pump
+stroke) at that rate, which is where a faster rate saves time.
+"""
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from time import ticks_us, ticks_diff
+
+from checkpoint import atomic_write
+from rs232_frame import FrameDecoder
+
+BAUD_FILE = "uart_baud.json"
+DEFAULT_BAUD = 9600
+RATES = (115200, 57600, 38400, 19200, 9600)
+DEVICES = ("pump", "valve")
+QUERY = {"pump": "/1QR", "valve": "/2QR"}
+ROUND_TRIPS = 5
+PROBE_TIMEOUT_MS = 200
+LONGEST_COMMAND = 40  # bytes in "/1J0S15A0A7640M2000J1M2000S14A0M2000J0R\r"
+MASTER_ADDRESS = 0x30  # '0': every answer frame is addressed to the master
+
+
+def wire_ms(nbytes, rate):
+    """Time nbytes take on the wire at rate (8N1: 10 bits per byte)."""
+    return nbytes * 10000 / rate
+
+
+class BaudSettings:
+    def __init__(self, path=BAUD_FILE):
+        self.path = path
+        self.rates = {device: DEFAULT_BAUD for device in DEVICES}
+        self.results = {}  # device -> probe() results, until the next reset
+        self._load()
+
+    # --- persistence ---------------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.loads(f.read())
+            for device in DEVICES:
+                if state.get(device) in RATES:
+                    self.rates[device] = state[device]
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        try:
+            atomic_write(self.path, json.dumps(self.rates))
+        except OSError as e:
+            print("Failed to save baud rates: {}".format(e))
+
+    def get(self, device):
+        return self.rates[device]
+
+    def check(self, device, rate):
+        """Raise ValueError for an unknown device or rate."""
+        if device not in DEVICES:
+            raise ValueError("device must be one of " + ", ".join(DEVICES))
+        if rate not in RATES:
+            raise ValueError("rate must be one of " + ", ".join(str(r) for r in RATES))
+
+    def set(self, device, rate):
+        """Save rate for device. Raises ValueError for an unknown device or rate."""
+        self.check(device, rate)
+        self.rates[device] = rate
+        self._save()
+
+    # --- reporting -----------------------------------------------------------
+    def lines(self):
+        out = ["{} {} baud".format(device, self.rates[device]) for device in DEVICES]
+        for device in DEVICES:
+            for rate, answers, median_ms, max_ms in self.results.get(device, ()):
+                stroke = "stroke on the wire {:.1f} ms".format(wire_ms(LONGEST_COMMAND, rate))
+                if answers * 2 >= ROUND_TRIPS:
+                    out.append("{} {}: {}/{} answers, round trip median {:.1f} ms, max {:.1f} ms, {}".format(
+                        device, rate, answers, ROUND_TRIPS, median_ms, max_ms, stroke))
+                else:
+                    out.append("{} {}: {}/{} answers, {}".format(device, rate, answers, ROUND_TRIPS, stroke))
+        return out
+
+
+def _round_trip_ms(uart, decoder, query):
+    """One query; the round trip in ms, or None without a frame from the device."""
+    while uart.any():
+        uart.read()
+    start = ticks_us()
+    uart.write(query + "\r")
+    frame = decoder.read(uart, PROBE_TIMEOUT_MS)
+    if frame is None or frame.address != MASTER_ADDRESS:
+        return None
+    return ticks_diff(ticks_us(), start) / 1000
+
+
+def probe(uart, device, rates=RATES, tick=None):
+    """Try each rate on uart; leaves it at the fastest that answered.
+
+    Returns (best rate or None, results), where results holds
+    (rate, answers, median ms, max ms) per rate. Without an answer the
+    uart is left at the last rate tried; the caller restores it.
+    tick() is called after every query (feed the watchdog there).
+    """
+    decoder = FrameDecoder()
+    results = []
+    best = None
+    for rate in rates:
+        uart.init(baudrate=rate)
+        times = []
+        for _ in range(ROUND_TRIPS):
+            ms = _round_trip_ms(uart, decoder, QUERY[device])
+            if ms is not None:
+                times.append(ms)
+            if tick:
+                tick()
+        times.sort()
+        results.append((rate, len(times), times[len(times) // 2] if times else 0, times[-1] if times else 0))
+        if best is None and len(times) * 2 >= ROUND_TRIPS:
+            best = rate
+    if best is not None:
+        uart.init(baudrate=best)
+    return best, results
@@ -0,0 +1,168 @@
+// Decodes BLE notifications from the Pico for index.html.
+//
+// In a Web Worker, this file receives {bytes, t} messages, where bytes is
+// the notification's ArrayBuffer and t is the arrival time (Date.now()).
+// It posts back one batch per burst. Lines are grouped as the page always
+// did: a burst ends after BURST_IDLE_MS without a notification, and also
+// after BURST_MAX_MS or BURST_MAX_LINES, so a long GETLOG streams in
+// pieces. Loaded with a <script> tag instead, it only defines
+// createBleDecoder() and the page decodes on its own thread.
+//
+// A batch holds:
+//   rows            console lines, oldest first
+//   status          fields for the status box, or null
+//   acks            schedule-upload ACK fields seen
+//   sequenceConfig  {rinses, pumps} or null
+//   fileLines       READ_SCHEDULE entries; resetSchedule when a fresh dump began
+//   log             [LOG] bodies in order, with markers: {from, gen} starts an
+//                   incremental GETLOG, {end: true, next} ends it (next is
+//                   undefined after a plain GETLOG), {cleared: true}
+
+const BURST_IDLE_MS = 100;
+const BURST_MAX_MS = 250;
+const BURST_MAX_LINES = 500;
+
+const TIMESTAMP_RE = /\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}/;
+
+function isStatusLine(line) {
+  return line.includes('Start Time') ||
+    line.includes('Current Time') ||
+    line.includes('Scheduled End Time') ||
+    line.includes('Scheduled Runtime') ||
+    line.includes('⏰ Current:') ||
+    line.includes('⏭️ Next') ||
+    line.includes('📊 Remaining:');
+}
+
+function decodeStatus(lines) {
+  const status = {};
+  let lastLine = '';
+  for (const line of lines) {
+    let m;
+    if (line.includes('Scheduled Runtime:')) {
+      if ((m = line.match(/Scheduled Runtime: (.*)/))) status.runtime = m[1];
+    } else if (line.includes('⏰ Current:')) {
+      if ((m = line.match(/⏰ Current:\s*(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})/))) status.currentTime = m[1];
+    } else if (line.includes('⏭️ Next')) {
+      if ((m = line.match(/⏭️ Next.*?(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})/))) status.endTime = m[1];
+    } else if (line.includes('📊 Remaining:')) {
+      if ((m = line.match(/📊 Remaining:\s*(\d+\/\d+\s+samples?)/))) status.remaining = m[1];
+    } else if (TIMESTAMP_RE.test(line)) {
+      // A bare timestamp belongs to the label on the line before it
+      if (lastLine.includes('Start Time')) status.startTime = line.trim();
+      else if (lastLine.includes('Current Time')) status.currentTime = line.trim();
+      else if (lastLine.includes('Scheduled End Time')) status.endTime = line.trim();
+    }
+    lastLine = line;
+  }
+  return status;
+}
+
+function decodeLines(lines, t) {
+  const batch = {
+    rows: [], status: null, acks: {}, sequenceConfig: null,
+    fileLines: [], resetSchedule: false, log: []
+  };
+  // As before: a burst with any status line only updates the status box
+  if (lines.some(isStatusLine)) {
+    batch.status = decodeStatus(lines);
+    return batch;
+  }
+  const clock = new Date(t).toLocaleTimeString();
+  for (const text of lines) {
+    let m;
+    if (text.startsWith('ACK:SCHEDULE_RELOADED')) {
+      if ((m = text.match(/ACK:SCHEDULE_RELOADED\s+(\d+)/))) batch.acks.reloaded = parseInt(m[1], 10);
+    } else if (text.startsWith('ACK:SCHEDULE_SAVED')) {
+      if ((m = text.match(/ACK:SCHEDULE_SAVED\s+(\d+)/))) batch.acks.saved = parseInt(m[1], 10);
+    } else if (text.startsWith('ACK:SCHEDULE_COMPLETE')) {
+      batch.acks.complete = true;
+    } else if (text.startsWith('ACK:ENTRY_BUILT')) {
+      if ((m = text.match(/ACK:ENTRY_BUILT\s+(\d+)/))) batch.acks.lastEntryBuilt = parseInt(m[1], 10);
+    } else if ((m = text.match(/^ACK:PATCH ([0-9a-f]{8}) (\d+)/))) {
+      batch.acks.patch = { hash: m[1], count: parseInt(m[2], 10) };
+    } else if ((m = text.match(/^PATCH:MISMATCH ([0-9a-f]{8}) (\d+)/))) {
+      batch.acks.patchMismatch = { hash: m[1], count: parseInt(m[2], 10) };
+    } else if ((m = text.match(/^SCHEDULE_DIGEST (RULE )?(\d+) ([0-9a-f]{8})/))) {
+      batch.acks.digest = { rule: !!m[1], count: parseInt(m[2], 10), hash: m[3] };
+    } else if (text.startsWith('❌ PATCH:')) {
+      batch.acks.patchError = text.slice('❌ PATCH:'.length).trim();
+    }
+
+    if (text.startsWith('SEQUENCE_CONFIG:')) {
+      if ((m = text.match(/SEQUENCE_CONFIG:\s*RINSE\s+(\d+).*PUMP_CYCLES\s+(\d+)/))) {
+        batch.sequenceConfig = { rinses: m[1], pumps: m[2] };
+        batch.rows.push(`⚙️ Sequence Config: ${m[1]} rinses, ${m[2]} pump cycles`);
+      }
+    } else if (text.startsWith('[FILE]')) {
+      // Older firmware wraps the line in a dict-like string: {'raw': '/202R at ...', ...}
+      let human = text.replace('[FILE]', '').trim();
+      if ((m = human.match(/'raw':\s*'([^']+)'/))) human = m[1];
+      batch.rows.push(`📁 Schedule: ${human}`);
+      batch.fileLines.push(human);
+    } else if (text.includes('📅 Current Schedule')) {
+      batch.resetSchedule = true;
+    } else if (text.startsWith('NEXTTRIGGER')) {
+      batch.rows.push(`⏳ Next Trigger: ${text.replace('NEXTTRIGGER', '').trim()}`);
+    } else if (text.startsWith('[LOG]')) {
+      const body = text.replace('[LOG]', '').trim();
+      batch.log.push(body);
+      batch.rows.push(`📄 Log: ${body}`);
+    } else if (text === 'LOG_CLEARED') {
+      batch.log.push({ cleared: true });
+      batch.rows.push('🧹 Log cleared on device');
+    } else if (text.startsWith('LOG_FROM:')) {
+      const [from, gen] = text.slice(9).split(':').map(Number);
+      batch.log.push({ from, gen });
+    } else if (text === 'LOG_END' || text.startsWith('LOG_END:')) {
+      batch.log.push({ end: true, next: text === 'LOG_END' ? undefined : Number(text.slice(8)) });
+    } else if (!TIMESTAMP_RE.test(text)) {
+      // A timestamp on its own line is only shown as part of the status box
+      batch.rows.push(`[${clock}] ${text}`);
+    }
+  }
+  return batch;
+}
+
+// emit(batch) is called once per burst
+function createBleDecoder(emit) {
+  const textDecoder = new TextDecoder();
+  let pending = [];
+  let firstAt = 0;
+  let lastT = 0;
+  let idleTimer = null;
+
+  function flush() {
+    if (idleTimer) {
+      clearTimeout(idleTimer);
+      idleTimer = null;
+    }
+    if (!pending.length) return;
+    const lines = pending;
+    pending = [];
+    emit(decodeLines(lines, lastT));
+  }
+
+  function push(bytes, t) {
+    const text = typeof bytes === 'string' ? bytes : textDecoder.decode(bytes);
+    if (!pending.length) firstAt = Date.now();
+    lastT = t || Date.now();
+    for (const line of text.split('\n')) {
+      const trimmed = line.trim();
+      if (trimmed) pending.push(trimmed);
+    }
+    if (pending.length >= BURST_MAX_LINES || Date.now() - firstAt >= BURST_MAX_MS) {
+      flush();
+      return;
+    }
+    if (idleTimer) clearTimeout(idleTimer);
+    idleTimer = setTimeout(flush, BURST_IDLE_MS);
+  }
+
+  return { push, flush };
+}
+
+if (typeof WorkerGlobalScope !== 'undefined' && self instanceof WorkerGlobalScope) {
+  const decoder = createBleDecoder(batch => self.postMessage(batch));
+  self.onmessage = event => decoder.push(event.data.bytes, event.data.t);
+}
@@ -0,0 +1,119 @@
+"""Crash-safe progress journal and atomic config writes for the MKR sampler."""
+import os
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+# Order of the stages recorded inside execute_step()
+STAGES = ("start", "init", "rinse", "command", "pump", "reset", "done")
+
+_written = 0  # bytes written to flash since boot, by every writer that reports it
+
+
+def count_written(n):
+    """Add n bytes to the flash write tally (see bytes_written)."""
+    global _written
+    _written += n
+
+
+def bytes_written():
+    return _written
+
+
+def atomic_write(path, data):
+    """Write data to a temp file and rename it over path.
+
+    A reader (or a reboot half way through) only ever sees the old file or
+    the complete new one, never a truncated file.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    count_written(len(data))
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # FAT does not allow renaming over an existing file
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        os.rename(tmp, path)
+
+
+def atomic_write_lines(path, lines):
+    """Atomically replace path with the given lines (newline terminated)."""
+    atomic_write(path, "".join(line if line.endswith("\n") else line + "\n" for line in lines))
+
+
+class Journal:
+    """Small on-flash record of where the running campaign has got to.
+
+    The state is a flat dict:
+        step     index of the entry in the in-memory schedule
+        command  valve command of that entry
+        start    scheduled start time of that entry (YYYY-MM-DD HH:MM:SS)
+        stage    one of STAGES
+        item     index of the sequence item being executed
+        cycle    rinse/pump cycles completed within that item
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.state = None
+
+    def load(self):
+        """Return the saved state dict, or None if there is no usable checkpoint."""
+        try:
+            with open(self.path, "r") as f:
+                state = json.loads(f.read())
+        except (OSError, ValueError):
+            self.state = None
+            return None
+        if not isinstance(state, dict) or state.get("stage") not in STAGES:
+            self.state = None
+            return None
+        self.state = state
+        return state
+
+    def _save(self):
+        try:
+            atomic_write(self.path, json.dumps(self.state))
+        except OSError as e:
+            print(f"Checkpoint write failed: {e}")
+
+    def begin_step(self, step, command, start):
+        self.state = {
+            "step": step,
+            "command": command,
+            "start": start,
+            "stage": "start",
+            "item": 0,
+            "cycle": 0,
+        }
+        self._save()
+
+    def stage(self, stage, item=None, cycle=0):
+        """Record entry into a new stage; unchanged states are not rewritten."""
+        if self.state is None:
+            return
+        if item is None:
+            item = self.state.get("item", 0)
+        if (self.state.get("stage") == stage and self.state.get("item") == item
+                and self.state.get("cycle") == cycle):
+            return
+        self.state["stage"] = stage
+        self.state["item"] = item
+        self.state["cycle"] = cycle
+        self._save()
+
+    def clear(self):
+        self.state = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
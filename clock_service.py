@@ -0,0 +1,239 @@
+"""Wall-clock time from ticks_ms, checked against the RTC now and then.
+
+Reading the RTC goes over I2C and returns a string to parse. The main
+loops ask for the time many times per step, so ClockService reads the
+RTC once and extrapolates from ticks_ms. It reads the RTC again every
+resync_ms.
+
+The RTC only resolves whole seconds, so one reading says the true time is
+in [rtc, rtc + 1). A resync keeps the extrapolation when it falls in that
+window and otherwise moves it the smallest amount that brings it back in.
+Time served never jumps by more than the real disagreement between the
+clocks. drift_ppm() compares the RTC with the Pico crystal over every
+resync since the last step: the RTC being set, or the two clocks
+disagreeing by more than STEP_MS (ticks_ms stopping in a lightsleep).
+
+discipline() applies an offset measured against a reference clock (the
+TSYNC handshake). From then on the crystal, corrected by rate_ppm, is
+trusted to better than the RTC's one second. The RTC is only used to
+catch a step. Each later sync updates rate_ppm from the offset that
+built up since the previous one. rate_ppm is kept in RATE_FILE, because
+it is a property of the crystal and outlives a reset.
+"""
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from time import ticks_ms, ticks_diff, sleep_ms
+
+from checkpoint import atomic_write
+from timeutil import to_epoch, from_epoch
+
+RESYNC_MS = 600000  # 10 minutes
+STEP_MS = 2000      # larger disagreements are a clock step, not drift
+DRIFT_SPAN_MS = 10000000  # baseline before drift is reported: 1 s reading error = 100 ppm
+RATE_FILE = "clock_rate.json"
+RATE_SPAN_MS = 1800000     # shortest gap between syncs used to update rate_ppm
+UNKNOWN_RATE_PPM = 50      # assumed crystal error until rate_ppm is measured
+
+
+def parse_rtc_text(text):
+    """'YYYY-MM-DD HH:MM:SS' -> (y, m, d, h, mi, s)."""
+    return tuple(int(v) for v in text.replace("-", " ").replace(":", " ").split()[:6])
+
+
+class ClockService:
+    def __init__(self, read_rtc, write_rtc=None, resync_ms=RESYNC_MS, rate_path=RATE_FILE):
+        self.read_rtc = read_rtc    # returns 'YYYY-MM-DD HH:MM:SS'
+        self.write_rtc = write_rtc  # takes (y, m, d, h, mi, s)
+        self.resync_ms = resync_ms
+        self.rate_path = rate_path
+        self.reads = 0
+        self.served = 0
+        self.corrections = 0
+        self.steps = 0
+        self.max_correction_ms = 0
+        self.rate_ppm = 0.0        # crystal runs fast by this much; taken off elapsed time
+        self.rate_error_ppm = None
+        self.sync_error_ms = None  # offset error at the last discipline(); None = RTC only
+        self.rtc_disagreement_ms = 0
+        self._since_sync_ms = 0    # crystal time since discipline(), summed at each resync
+        self._base_ms = 0          # epoch milliseconds at _base_ticks
+        self._base_ticks = 0
+        self._last_sync = 0
+        self._span_ms = 0          # crystal time covered by the drift baseline
+        self._first_rtc_ms = 0     # RTC reading that started the baseline
+        self._last_rtc_ms = 0
+        self._load_rate()
+        self.sync(reset_drift=True)
+
+    # --- persistence ---------------------------------------------------------
+    def _load_rate(self):
+        try:
+            with open(self.rate_path, "r") as f:
+                state = json.loads(f.read())
+            self.rate_ppm = state.get("ppm", 0.0)
+            self.rate_error_ppm = state.get("error_ppm")
+        except (OSError, ValueError):
+            pass
+
+    def _save_rate(self):
+        try:
+            atomic_write(self.rate_path, json.dumps({"ppm": self.rate_ppm, "error_ppm": self.rate_error_ppm}))
+        except OSError as e:
+            print("Failed to save clock rate: {}".format(e))
+
+    # --- time ----------------------------------------------------------------
+    def _served(self, now):
+        elapsed = ticks_diff(now, self._base_ticks)
+        return self._base_ms + elapsed - int(elapsed * self.rate_ppm / 1000000)
+
+    def _rebase(self, now, epoch_ms):
+        self._base_ms = epoch_ms
+        self._base_ticks = now
+
+    def _account(self, now):
+        """Add the crystal time since the last sync to both baselines."""
+        elapsed = ticks_diff(now, self._last_sync)
+        self._span_ms += elapsed
+        self._since_sync_ms += elapsed
+        self._last_sync = now
+
+    def sync(self, reset_drift=False):
+        """Read the RTC and check the served time against it.
+
+        Call with reset_drift=True after the RTC is set by hand: the served
+        time jumps to the RTC and any discipline is dropped.
+        """
+        now = ticks_ms()
+        rtc_ms = to_epoch(parse_rtc_text(self.read_rtc())) * 1000
+        self.reads += 1
+        if reset_drift:
+            self._rebase(now, rtc_ms + 500)  # middle of the window
+            self._first_rtc_ms = rtc_ms
+            self._span_ms = 0
+            self.sync_error_ms = None
+        else:
+            self._account(now)
+            predicted = self._served(now)
+            if predicted < rtc_ms:
+                correction = rtc_ms - predicted
+            elif predicted >= rtc_ms + 1000:
+                correction = rtc_ms + 999 - predicted
+            else:
+                correction = 0
+            self.rtc_disagreement_ms = correction
+            if abs(correction) > STEP_MS:
+                self.steps += 1
+                self._first_rtc_ms = rtc_ms
+                self._span_ms = 0
+                self.sync_error_ms = None
+            elif self.sync_error_ms is not None:
+                correction = 0  # disciplined: the corrected crystal beats the RTC
+            elif correction:
+                self.corrections += 1
+                if abs(correction) > abs(self.max_correction_ms):
+                    self.max_correction_ms = correction
+            self._rebase(now, predicted + correction)
+        self._last_rtc_ms = rtc_ms
+        self._last_sync = now
+
+    def epoch_ms(self):
+        now = ticks_ms()
+        if ticks_diff(now, self._last_sync) >= self.resync_ms:
+            self.sync()
+        self.served += 1
+        return self._served(now)
+
+    def epoch(self):
+        """Seconds since 2000-01-01 (local time, as kept in the RTC)."""
+        return self.epoch_ms() // 1000
+
+    def now(self):
+        """(y, m, d, h, mi, s)"""
+        return from_epoch(self.epoch())
+
+    def text(self):
+        """'YYYY-MM-DD HH:MM:SS', the format CommManager.get_formatted_time() returns."""
+        return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(*self.now())
+
+    # --- reference sync ------------------------------------------------------
+    def since_sync_ms(self):
+        return self._since_sync_ms + ticks_diff(ticks_ms(), self._last_sync)
+
+    def error_ms(self):
+        """Bound on the served time's error since the last discipline(), or None."""
+        if self.sync_error_ms is None:
+            return None
+        rate_error = UNKNOWN_RATE_PPM if self.rate_error_ppm is None else self.rate_error_ppm
+        return self.sync_error_ms + int(self.since_sync_ms() * rate_error / 1000000)
+
+    def discipline(self, offset_ms, error_ms):
+        """Take offset_ms (served minus reference, +/- error_ms) off the served time.
+
+        Does nothing and returns False unless error_ms beats error_ms().
+        """
+        current = self.error_ms()
+        if current is not None and error_ms >= current:
+            return False
+        now = ticks_ms()
+        self._account(now)
+        served = self._served(now)  # at the old rate, as the host measured it
+        if self.sync_error_ms is not None and self._since_sync_ms >= RATE_SPAN_MS:
+            # The offset built up since the last sync is the residual rate error
+            self.rate_ppm += offset_ms * 1000000 / self._since_sync_ms
+            self.rate_error_ppm = (error_ms + self.sync_error_ms) * 1000000 / self._since_sync_ms
+            self._save_rate()
+        self._rebase(now, served - offset_ms)
+        self.sync_error_ms = error_ms
+        self._since_sync_ms = 0
+        self._write_rtc_aligned()
+        return True
+
+    def _write_rtc_aligned(self):
+        """Set the RTC on a second boundary so its window lines up with the served time."""
+        if self.write_rtc is None:
+            return
+        served = self.epoch_ms()
+        sleep_ms(1000 - served % 1000)
+        second = served // 1000 + 1
+        self.write_rtc(from_epoch(second))
+        now = ticks_ms()
+        self._since_sync_ms += ticks_diff(now, self._last_sync)
+        self._last_sync = now
+        self._first_rtc_ms = self._last_rtc_ms = second * 1000
+        self._span_ms = 0
+
+    # --- reporting -----------------------------------------------------------
+    def drift_ppm(self):
+        """RTC rate relative to ticks_ms in ppm (positive: RTC runs fast).
+
+        None until the baseline is long enough for one second of reading
+        error to stay under 100 ppm (about 3 hours).
+        """
+        if self._span_ms < DRIFT_SPAN_MS:
+            return None
+        rtc_span = self._last_rtc_ms - self._first_rtc_ms
+        return (rtc_span - self._span_ms) * 1000000 // self._span_ms
+
+    def lines(self):
+        drift = self.drift_ppm()
+        span_s = self._span_ms // 1000
+        out = ["now {}, RTC read {} times for {} time requests".format(self.text(), self.reads, self.served)]
+        error = self.error_ms()
+        if error is None:
+            out.append("sync: RTC only (+/- 1 s)")
+        else:
+            out.append("sync: +/- {} ms, {} s since the last TSYNC, RTC differs by {:+d} ms".format(
+                error, self.since_sync_ms() // 1000, self.rtc_disagreement_ms))
+        out.append("crystal rate correction: {:+.2f} ppm{}".format(
+            self.rate_ppm, "" if self.rate_error_ppm is None else " (+/- {:.2f})".format(self.rate_error_ppm)))
+        if drift is None:
+            out.append("drift: measuring ({} s of {} s baseline)".format(span_s, DRIFT_SPAN_MS // 1000))
+        else:
+            out.append("drift: RTC {:+d} ppm vs crystal (+/- {} ppm) over {} h".format(
+                drift, 1000000000 // self._span_ms, span_s // 3600))
+        out.append("resync every {} s, {} corrections, largest {:+d} ms, {} steps".format(
+            self.resync_ms // 1000, self.corrections, self.max_correction_ms, self.steps))
+        return out
@@ -0,0 +1,93 @@
+"""Preemptive emergency stop.
+
+trigger() runs from the BLE callback. MicroPython runs scheduled callbacks
+even while the main code is inside time.sleep() or a UART poll, so the
+hardware is made safe at once. The pump gets a terminate command and the
+valve a reset, without waiting for either reply. The relay is switched off
+by a one-shot timer once the valve has had time to reach home, whatever
+the main loop is doing.
+
+The main code then unwinds. Every wait in the step path goes through
+sleep() or check(), which raise EmergencyStop within SLICE_MS of the
+request.
+"""
+from machine import Pin, Timer
+from time import ticks_ms, ticks_diff, sleep_ms
+
+PUMP_TERMINATE = "/1TR"
+VALVE_RESET = "/2wR"
+RELAY_PIN = 13
+VALVE_SETTLE_MS = 4000  # same wait execute_step() gives the valve before relay off
+SLICE_MS = 20
+
+
+class EmergencyStop(Exception):
+    pass
+
+
+class StopController:
+    def __init__(self, pump_uart, valve_uart, relay_pin=RELAY_PIN, valve_settle_ms=VALVE_SETTLE_MS):
+        self.pump_uart = pump_uart
+        self.valve_uart = valve_uart
+        self.relay_pin = relay_pin
+        self.valve_settle_ms = valve_settle_ms
+        self.active = False
+        self.requested_at = None
+        self.safed_ms = None      # trigger() -> pump and valve commands written
+        self.relay_off_ms = None  # trigger() -> relay de-energized
+        self._timer = None
+
+    def trigger(self):
+        """Make the hardware safe now. Safe to call again while already stopped."""
+        start = ticks_ms()
+        self.active = True
+        self.requested_at = start
+        self.relay_off_ms = None
+        for uart, cmd in ((self.pump_uart, PUMP_TERMINATE), (self.valve_uart, VALVE_RESET)):
+            try:
+                uart.write(cmd + "\r")
+            except Exception as e:
+                print("Emergency stop: {} failed: {}".format(cmd, e))
+        self.safed_ms = ticks_diff(ticks_ms(), start)
+        try:
+            if self._timer is not None:
+                self._timer.deinit()
+            self._timer = Timer(mode=Timer.ONE_SHOT, period=self.valve_settle_ms, callback=self._relay_off)
+        except Exception as e:
+            print("Emergency stop: relay timer failed ({}), switching relay off now".format(e))
+            self._relay_off()
+        return self.safed_ms
+
+    def _relay_off(self, _timer=None):
+        Pin(self.relay_pin, Pin.OUT, value=1)  # active-low: 1 = OFF
+        if self.requested_at is not None:
+            self.relay_off_ms = ticks_diff(ticks_ms(), self.requested_at)
+        self._timer = None
+
+    def requested(self):
+        return self.active
+
+    def check(self):
+        if self.active:
+            raise EmergencyStop()
+
+    def sleep(self, seconds):
+        """time.sleep() that raises EmergencyStop within SLICE_MS of a stop."""
+        remaining = int(seconds * 1000)
+        while remaining > 0:
+            self.check()
+            step = SLICE_MS if remaining > SLICE_MS else remaining
+            sleep_ms(step)
+            remaining -= step
+        self.check()
+
+    def clear(self):
+        """Re-arm for the next step.
+
+        A relay-off still pending happens now, so the timer cannot switch
+        the relay off in the middle of that step.
+        """
+        if self._timer is not None:
+            self._timer.deinit()
+            self._relay_off()
+        self.active = False
@@ -0,0 +1,125 @@
+"""Predict whether a schedule can be run on time with the active sequence.
+
+Step durations are built from the fixed waits in execute_step() plus an
+estimate per rinse/pump cycle. wait_for_pump_ready() polls every 5 s, so the
+default cycle estimate is rounded up to a whole number of polls. A cycle
+time measured on the device already includes that rounding and is used
+as it is.
+"""
+from timeutil import to_epoch, from_epoch
+from pump_volume import cycles_for
+
+# Fixed parts of execute_step(), seconds
+RELAY_ON_S = 2          # relay settle after switching on
+UART_TXN_S = 0.3        # one send_rs232_command() round trip
+VALVE_RESET_S = 1       # after /2wR at the start
+PUMP_INIT_S = 8         # /1ZWR until ready (polled every 2 s)
+RINSE_VALVE_S = 4       # after /2O01R
+COMMAND_VALVE_S = 4     # after the sample valve command
+FINAL_RESET_S = 4 + 1   # valve reset wait + relay off
+PUMP_CYCLE_S = 20       # one /1J0S15A0A7640...R stroke incl. M2000 dwells
+POLL_S = 5              # wait_for_pump_ready() poll interval during cycles
+MAX_PUMP_CYCLES = 15
+
+MAX_REPORTED_LATE = 5   # keep memory bounded for long schedules
+
+
+def _cycle_cost(cycle_s):
+    polls = -(-cycle_s // POLL_S)  # ceil
+    return polls * POLL_S + UART_TXN_S * 2  # status query + stroke command
+
+
+def estimate_step_seconds(sequence, cycle_s=None, ml_per_cycle=5.0):
+    """Seconds one execute_step() takes for the given sequence items.
+
+    cycle_s is a measured cycle time (stroke sent until the pump reports
+    ready); without one, PUMP_CYCLE_S is rounded up to whole polls.
+    """
+    cycle = _cycle_cost(PUMP_CYCLE_S) if cycle_s is None else cycle_s
+    total = RELAY_ON_S + UART_TXN_S + VALVE_RESET_S + UART_TXN_S + PUMP_INIT_S
+    total += UART_TXN_S + RINSE_VALVE_S
+    for item in sequence:
+        if item.startswith("RINSE "):
+            total += int(item.split()[1]) * cycle
+        elif item == "COMMAND":
+            total += UART_TXN_S + COMMAND_VALVE_S
+        elif "PUMP" in item:
+            n = min(int(item.split()[-1]), MAX_PUMP_CYCLES)
+            total += n * cycle
+        elif item.startswith("VOLUME "):
+            total += cycles_for(float(item.split()[1]), ml_per_cycle) * cycle
+    total += UART_TXN_S + FINAL_RESET_S
+    return int(total + 0.999)
+
+
+def analyze(entries, step_s):
+    """Walk the entries in order and predict start delays.
+
+    entries yields dicts with a "startTime" tuple (a list or a
+    ScheduleRule generator both work; nothing is kept per entry).
+    Returns a dict:
+        count        number of entries
+        late         entries that would start after their scheduled time
+        first_late   up to MAX_REPORTED_LATE (index, scheduled, delay_s) tuples
+        max_delay_s  worst predicted delay
+        end          predicted finish time of the last entry (tuple) or None
+        min_gap_s    smallest gap between consecutive scheduled starts
+        step_s       estimated duration of one step
+    """
+    count = 0
+    late = 0
+    first_late = []
+    max_delay = 0
+    min_gap = None
+    prev_start = None
+    free_at = None
+    for entry in entries:
+        start = to_epoch(entry["startTime"])
+        if prev_start is not None:
+            gap = start - prev_start
+            if min_gap is None or gap < min_gap:
+                min_gap = gap
+        actual = start if free_at is None or free_at <= start else free_at
+        delay = actual - start
+        if delay > 0:
+            late += 1
+            if delay > max_delay:
+                max_delay = delay
+            if len(first_late) < MAX_REPORTED_LATE:
+                first_late.append((count, entry["startTime"], delay))
+        free_at = actual + step_s
+        prev_start = start
+        count += 1
+    return {
+        "count": count,
+        "late": late,
+        "first_late": first_late,
+        "max_delay_s": max_delay,
+        "end": from_epoch(free_at) if free_at is not None else None,
+        "min_gap_s": min_gap,
+        "step_s": step_s,
+    }
+
+
+def analyze_periodic(start, interval_s, count, step_s):
+    """analyze() for count entries interval_s apart from epoch start, without walking them.
+
+    With steps longer than the interval, entry k starts k * step_s after
+    start, so its delay is k * (step_s - interval_s).
+    """
+    if count <= 0:
+        return analyze((), step_s)
+    slip = step_s - interval_s
+    late = count - 1 if slip > 0 else 0
+    first_late = [(k, from_epoch(start + k * interval_s), k * slip)
+                  for k in range(1, min(late, MAX_REPORTED_LATE) + 1)]
+    last = start + (count - 1) * (step_s if slip > 0 else interval_s)
+    return {
+        "count": count,
+        "late": late,
+        "first_late": first_late,
+        "max_delay_s": late * slip if late else 0,
+        "end": from_epoch(last + step_s),
+        "min_gap_s": interval_s if count > 1 else None,
+        "step_s": step_s,
+    }
@@ -1,27 +1,116 @@
 from machine import Pin, UART, I2C, ADC
 import time
+
+# === Boot profiling ===
+# time.ticks_ms() counts from power-on/reset, so each mark is the absolute
+# time at which that boot phase finished.
+_boot_marks = [("main_start", time.ticks_ms())]
+
+def boot_mark(phase):
+    """Record the end of a boot phase (read back with BOOT_PROFILE)."""
+    _boot_marks.append((phase, time.ticks_ms()))
+
 import bluetooth
 import machine
 import _thread
+import os
+# Helper modules may be plain .py, precompiled .mpy or frozen into the
+# firmware (see tools/build_mpy.py); the import is the same either way.
 from ble_simple_peripheral import BLESimplePeripheral
 from comm_manager import CommManager
-from ina219 import INA219
-from wifi_toggle import PicoPiFileServer
+from checkpoint import Journal, atomic_write_lines, count_written
+from power_manager import PowerManager, MODES, MODE_OFF, MODE_LIGHT, MODE_DEEP
+from vsys_monitor import VsysMonitor
+from schedule_rule import ScheduleRule, load_rule, RULE_FILE
+from timeutil import to_epoch, parse_compact
+from feasibility import estimate_step_seconds, analyze, analyze_periodic
+from schedule_parser import parse_line, parse_stream, ScheduleBuilder, format_entry
+from schedule_patch import ScheduleStore, PatchError, HashMismatch, SCHEDULE_FILE, fnv1a
+from sample_registry import SampleRegistry, SampleLedger
+from rs232_frame import FrameDecoder, error_text
+from rs232_link import Link
+from baud_rates import BaudSettings, probe as probe_baud
+from stall_monitor import StallMonitor, STALL_MS
+from clock_service import ClockService
+from estop import StopController, EmergencyStop
+from pump_volume import PumpGovernor, cycles_for, OVERLOAD_ERROR
+from trace_recorder import TraceRecorder, TracedUART, TracedPeripheral, TRACE_FLAG_FILE
+from metrics import Metrics, MetricsServer, CountedPeripheral, METRICS_PORT
+from segment_log import SegmentLog
 from _thread import allocate_lock
+boot_mark("imports")
+
+BOOT_PROFILE_FILE = "boot_profile.txt"
+LOG_GEN_FILE = "log_gen.txt"  # changes whenever the sample log is cleared
 
 # Power management settings
 MIN_BLE_VOLTAGE = 3.6  # Minimum voltage for stable BLE operation 
+ble_tx_power_dbm = 8  # Lowered by apply_voltage_policy() as the battery drains
+heartbeat_interval_ms = 5000  # Status notification period, stretched on low battery
+POWER_LOG_FILE = "power_log.txt"
+PUMP_CYCLE_EST_MS = 30000  # Load duration used for brownout prediction
+PUMP_DEFER_MAX_MS = 120000  # Give up on a cycle if the battery has not recovered by then
 
 # Create instance
 manager = CommManager()
-timestamp = manager.get_formatted_time()
-print("Current RTC time:", timestamp)
 
-# Initialize I2C bus
-i2c = I2C(1, scl=Pin(7), sda=Pin(6), freq=100000)
+def write_rtc(dt):
+    """Set the RTC from (y, m, d, h, mi, s); weekday is left at 0 as in T:."""
+    manager.set_rtc_time((dt[0], dt[1], dt[2], 0, dt[3], dt[4], dt[5]))
 
-# Create INA219 instance
-ina219 = INA219(i2c_bus=i2c, addr=0x43)
+clock = ClockService(manager.get_formatted_time, write_rtc)  # reads the RTC once; "now" comes from ticks_ms
+timestamp = clock.text()
+print("Current RTC time:", timestamp)
+
+# Watchdog and loop-stall monitor; loops call monitor.progress() (read back with STALLS)
+STALL_LOCATIONS = ("scheduler", "wait_for_start", "main_loop", "execute_step", "uart",
+                   "pump_wait", "power_wait", "heartbeat_wait", "ble_rx", "sleep", "baud_probe")
+monitor = StallMonitor(STALL_LOCATIONS, clock.text)
+monitor.check_reset()
+boot_mark("rtc")
+
+# Counters and latency histograms (METRICS over BLE, port 9100 while Wi-Fi is on)
+metrics = Metrics()
+metrics_server = None
+
+def service_metrics():
+    """Called from the wait loops: sample the heap, answer a pending scrape, write out trace records."""
+    metrics.heap()
+    tracer.poll()
+    if metrics_server:
+        metrics_server.poll()
+
+def start_metrics_server():
+    """Listen for scrapes on METRICS_PORT (with Wi-Fi on). Returns True if listening."""
+    global metrics_server
+    if metrics_server is None:
+        server = MetricsServer(metrics)
+        try:
+            server.start()
+        except Exception as e:
+            print(f"Metrics server not started: {e}")
+            return False
+        metrics_server = server
+    return True
+
+def stop_metrics_server():
+    global metrics_server
+    if metrics_server:
+        metrics_server.stop()
+        metrics_server = None
+
+# INA219 on I2C1 is only brought up the first time it is needed
+i2c = None
+ina219 = None
+
+def get_ina219():
+    """Return the INA219 instance, initializing I2C and the sensor on first use."""
+    global i2c, ina219
+    if ina219 is None:
+        from ina219 import INA219
+        i2c = I2C(1, scl=Pin(7), sda=Pin(6), freq=100000)
+        ina219 = INA219(i2c_bus=i2c, addr=0x43)
+    return ina219
 
 # Global flag to track relay state
 relay_manual_control = False
@@ -32,10 +121,35 @@ last_ok_time = 0
 # === Relay Setup ===
 relay = Pin(13, Pin.OUT) # off
 
+# === Traffic trace (TRACE:ON) ===
+# UART and BLE traffic goes through these wrappers; they only record while
+# tracing is on. Replay a trace on the host with tools/replay_trace.py.
+tracer = TraceRecorder()
+
 # === RS232 Setup ===
-# Setup UART and RS232 direction control pin
-uart0 = UART(0, baudrate=9600, tx=Pin(0), rx=Pin(1))
-uart1 = UART(1, baudrate=9600, tx=Pin(4), rx=Pin(5))
+# Setup UART and RS232 direction control pin; rates per device from uart_baud.json (BAUD)
+bauds = BaudSettings()
+uart0 = TracedUART(UART(0, baudrate=bauds.get("pump"), tx=Pin(0), rx=Pin(1)), 0, tracer)
+uart1 = TracedUART(UART(1, baudrate=bauds.get("valve"), tx=Pin(4), rx=Pin(5)), 1, tracer)
+rs232_decoder = FrameDecoder()  # Answer-frame buffer for the main loop
+ble_cmd_decoder = FrameDecoder()  # Separate buffer for queued SEND_CMD commands
+stopper = StopController(uart0, uart1)  # EMERGENCY_STOP safes pump, valve and relay from the BLE callback
+# Retries, stale-input flushing and error rates per UART (LINK)
+pump_link = Link(uart0, "pump", rs232_decoder, observe=metrics.uart)
+valve_link = Link(uart1, "valve", rs232_decoder, observe=metrics.uart)
+BLE_CMD_RETRIES = 1  # A manual SEND_CMD is retried once; the user sees the answer and can resend
+UART_BUDGET_MS = STALL_MS - 1000  # one RS232 transaction, retries and resync included
+
+def uart_sleep(seconds):
+    """Backoff between RS232 attempts on the step path; reports progress to the watchdog."""
+    monitor.progress("uart")
+    stopper.sleep(seconds)
+try:
+    os.stat(TRACE_FLAG_FILE)
+    tracer.start(append=True)  # Tracing was on before this reset; keep going
+except OSError:
+    pass
+boot_mark("uart")
 
 
 # === LED Setup ===
@@ -57,86 +171,220 @@ def _wifi_server_thread():
     finally:
         wifi_thread_running = False
 
-def send_rs232_command(command, uart):
-    """Send RS232 command and read response - no direction control needed"""
+baud_probe_pending = False  # BAUD:PROBE waits for an idle loop; it must not interleave with a step
+# SEND_CMD and BAUD:PUMP|VALVE <rate> from the BLE callback wait for
+# run_uart_requests() between steps: run from the callback, an exchange would
+# drain the answer a step is polling for, and a rate change would garble it
+uart_requests = []
+MAX_UART_REQUESTS = 8
+
+def queue_uart_request(request):
+    """Queue ("cmd", command) or ("baud", device, rate). Returns False (and says so) when full."""
+    if len(uart_requests) >= MAX_UART_REQUESTS:
+        sp.send(f"❌ Error: {MAX_UART_REQUESTS} RS232 requests already queued")
+        return False
+    uart_requests.append(request)
+    return True
+
+def run_uart_requests():
+    """Send queued commands and apply queued rates; only called while no step is running."""
+    while uart_requests:
+        request = uart_requests.pop(0)
+        monitor.progress("uart")
+        if request[0] == "baud":
+            _, device, rate = request
+            bauds.set(device, rate)
+            (uart0 if device == "pump" else uart1).init(baudrate=rate)
+            sp.send(f"✅ {device}: {rate} baud")
+            continue
+        cmd = request[1]
+        # Determine which UART based on command (pump=uart0, valve=uart1)
+        target_uart = uart0 if cmd.startswith('/1') else uart1
+        try:
+            send_rs232_command(cmd, target_uart, ble_cmd_decoder)
+            sp.send(f"✅ Sent command: {cmd}")
+        except Exception as e:
+            print(f"SEND_CMD {cmd} failed: {e}")
+            sp.send(f"⚠️ Command {cmd} failed: {e}")
+
+def run_baud_probe():
+    """Find and save the fastest rate each device answers at, and report the round trips."""
+    global baud_probe_pending
+    baud_probe_pending = False
+    sp.send("🔍 Probing baud rates...")
+    for device, uart in (("pump", uart0), ("valve", uart1)):
+        best, results = probe_baud(uart, device, tick=lambda: monitor.progress("baud_probe"))
+        bauds.results[device] = results
+        if best is None:
+            uart.init(baudrate=bauds.get(device))
+            sp.send(f"⚠️ {device} did not answer at any rate; keeping {bauds.get(device)} baud")
+        else:
+            bauds.set(device, best)
+            sp.send(f"✅ {device}: {best} baud")
+    for line in bauds.lines():
+        sp.send(f"[BAUD]{line}")
+    sp.send("BAUD_END")
+
+def link_for(uart):
+    return pump_link if uart is uart0 else valve_link
+
+def check_link(link):
+    """Warn once when a UART's rolling error rate gets high."""
+    if link.alarm():
+        msg = f"⚠️ RS232 {link.name}: {100 * link.error_rate():.0f}% of recent exchanges failed - check the cable"
+        print(msg)
+        sp.send(msg)
+        test_log(msg)
+
+def send_rs232_command(command, uart, decoder=None):
+    """Send RS232 command and read the answer frame. Returns the raw bytes received.
+
+    The link drains stale input first and retries a lost or rejected
+    exchange (see rs232_link). Without a decoder this is the step path: it
+    raises EmergencyStop rather than send a command after a stop, or once
+    a stop cuts the exchange short.
+    """
+    step_path = decoder is None
+    decoder = decoder or rs232_decoder
+    if step_path:
+        stopper.check()
     print(f"Command Sent on UART: {command}")
     
-    # RS232 is full-duplex, so just write directly
-    uart.write(command + '\r')
-    time.sleep(0.05)  # Brief delay for device to process
-    
-    # Read response
-    start_time = time.ticks_ms()
-    response = b""
-    while time.ticks_diff(time.ticks_ms(), start_time) < 2000:
-        if uart.any():
-            response += uart.read()
-            if b'\n' in response:
-                break
-    
-    print("Raw Hex Response:", [hex(b) for b in response])
-    try:
-        print("Parsed Response:", response.decode('utf-8'))
-    except UnicodeError:
-        print("Received non-UTF8 data")
+    monitor.progress("uart")
+    link = link_for(uart)
+    if step_path:
+        frame = link.transact(command, 2000, decoder, abort=stopper.requested, sleep=uart_sleep,
+                              budget_ms=UART_BUDGET_MS)
+        stopper.check()
+    else:
+        frame = link.transact(command, 2000, decoder, retries=BLE_CMD_RETRIES, budget_ms=UART_BUDGET_MS)
+    check_link(link)
+    print("Raw Hex Response:", decoder.hex())
+    if frame:
+        print(f"Parsed Response: addr {chr(frame.address)} status 0x{frame.status:02X} "
+              f"({'READY' if frame.ready else 'BUSY'}, {error_text(frame.error_code)})")
+    elif decoder.n:
+        print("⚠️ Incomplete response frame")
     
-    return response
+    return decoder.raw()
 
 # --- File Transfer State ---
 receiving_file = False
-file_lines = []
 schedule = []
 startNow = False  # Manual start flag
 emergency_stop = False  # Emergency stop flag
 ble_lock = allocate_lock()  # Lock for BLE operations
+journal = Journal()  # Progress checkpoint so a reset can resume mid-campaign
+samples = SampleRegistry.load()  # Valve port -> sample id
+ledger = SampleLedger(samples.ml_per_cycle).load()  # Per-sample cumulative counters
+governor = PumpGovernor()  # Stroke speed for VOLUME items, set by INA219 motor load
+
+def sample_log_key(line):
+    """'<sample> <status>' of a log_command() line, for the per-day summaries."""
+    fields = {}
+    for part in line.split(" | ")[1:]:
+        name, _, value = part.partition(": ")
+        fields[name] = value.strip()
+    if "Status" not in fields:
+        return None
+    return "{} {}".format(fields.get("Sample", "-"), fields["Status"])
+
+def pump_log_key(line):
+    """Outcome class of a test_log() line, for the per-day summaries."""
+    text = line[22:]
+    if text.startswith("Status check"):
+        return "status"
+    for word in ("completed", "aborted", "abandoned", "timeout", "error", "Step"):
+        if word in text:
+            return word.lower()
+    return "other"
+
+# Sample log (log_command) and pump status log (test_log), as size-capped
+# segments under logs/. Files from before segmenting become the first segment.
+sample_log = SegmentLog("ME", clock.epoch, key=sample_log_key)
+sample_log.adopt("log_ME.txt")
+pump_log = SegmentLog("pump_status", clock.epoch, key=pump_log_key)
+pump_log.adopt("pump_status_log.txt")
 
 # --- File Operations ---
-def read_log_file():
-    """Read the log file and return its contents as a list of lines."""
-    try:
-        with open("log_ME.txt", "r") as f:
-            return f.readlines()
-    except OSError as e:
-        print(f"Failed to read log file: {e}")
-        return ["No log entries found or log file not created yet."]
-
 def clear_log_file():
-    """Truncate the log file. Return True on success."""
+    """Delete the sample log and start a new log generation. Return True on success."""
     try:
-        with open("log_ME.txt", "w") as f:
-            f.write("")
+        sample_log.clear()
+        atomic_write_lines(LOG_GEN_FILE, [str(clock.epoch())])
         return True
     except OSError as e:
         print(f"Failed to clear log file: {e}")
         return False
 
-def read_schedule_file():
+def log_generation():
+    """Id of the current log contents; 0 until the log is first cleared."""
     try:
-        with open("schedule.txt", "r") as f:
-            schedule = []
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                entry = parse_schedule_line(line)
-                if entry:
-                    schedule.append(entry)
-                else:
-                    print(f"Skipping invalid schedule entry on line {line_num}: {line}")
-                    
-            # Sort schedule by timestamp
-            schedule.sort(key=lambda x: x['time'])
-            print(f"Loaded {len(schedule)} valid schedule entries")
-            return schedule
-    except Exception as e:
+        with open(LOG_GEN_FILE, "r") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+def send_log_from(offset, gen):
+    """Stream log lines after byte offset for an incremental GETLOG.
+
+    Sends LOG_FROM:<start>:<generation>, the [LOG] lines, then
+    LOG_END:<next offset>. Offsets count from the start of the log and
+    survive retention. Starts from the oldest line still on flash when the
+    client's copy is of an older generation, offset is not the start of a
+    line, or the lines after it have been compacted. A start above the
+    client's offset tells it lines were dropped in between. Only complete
+    lines are sent, so a line being appended is picked up next time.
+    """
+    current = log_generation()
+    if gen != current or offset > sample_log.end_offset() or not sample_log.is_line_start(offset):
+        offset = sample_log.start_offset()
+    ble_send(f"LOG_FROM:{offset}:{current}")
+    for line, offset in sample_log.read_from(offset):
+        monitor.mark("ble_rx")  # runs in the BLE callback; keep the watchdog fed
+        ble_send("[LOG]" + line.decode("utf-8", "ignore").strip())
+    ble_send(f"LOG_END:{offset}")
+
+def send_log_range(since, until):
+    """[LOG] lines stamped in [since, until) epoch seconds, skipping segments outside it."""
+    for line in sample_log.lines_between(since, until):
+        monitor.mark("ble_rx")
+        ble_send("[LOG]" + line)
+    ble_send("LOG_END")
+
+def send_log_days():
+    """Per-day summaries of compacted sample log segments, then the log's status."""
+    days = sample_log.days()
+    for day in sorted(days):
+        monitor.mark("ble_rx")
+        rec = days[day]
+        counts = ", ".join("{} {}".format(k, v) for k, v in sorted(rec["keys"].items()))
+        ble_send(f"[DAY]{day} {rec['first']}-{rec['last']} {rec['n']} lines: {counts or '-'}")
+    for log in (sample_log, pump_log):
+        for line in log.lines():
+            ble_send(f"[DAY]{line}")
+    ble_send("DAYS_END")
+
+def read_schedule_file(on_entry):
+    """Load the stored schedule (schedule.txt plus patches), calling on_entry(entry) per entry.
+
+    Returns the number of entries, or -1 if the file cannot be opened.
+    """
+    try:
+        entries = schedule_store.load(print_reject)
+    except OSError as e:
         print(f"Error reading schedule file: {e}")
-        return []
+        return -1
+    if entries is None:
+        print("Error reading schedule file: no schedule.txt")
+        return -1
+    for entry in entries:
+        on_entry(entry)
+    return len(entries)
 
 # --- BLE Receive Callback ---
 # Global variables for BLE message handling
 receiving_file = False
-file_lines = []
 partial_line = ""
 last_packet_time = 0
 ble_lock = _thread.allocate_lock()
@@ -150,11 +398,68 @@ current_cmd = None
 current_date = None
 current_time = None
 
+# Schedule upload in progress: entries are parsed as they arrive
+upload_builder = None
+upload_line_no = 0
+
+def print_reject(line_no, line, reason):
+    print(f"Skipping invalid schedule entry on line {line_no}: {line} ({reason})")
+
+def start_upload():
+    global upload_builder, upload_line_no
+    upload_builder = ScheduleBuilder(MAX_SCHEDULE_ENTRIES)
+    upload_line_no = 0
+
+def add_upload_line(line):
+    """Parse one received schedule line into the pending upload. Returns True if accepted."""
+    global upload_line_no
+    if upload_builder is None:
+        start_upload()
+    upload_line_no += 1
+
+    def reject(line_no, text, reason):
+        print_reject(line_no, text, reason)
+        ble_send(f"REJECT:{line_no} {reason}")
+
+    accepted, _ = parse_stream((line,), upload_builder.add, reject, upload_line_no)
+    return accepted == 1
+
+def finish_upload():
+    """Sort (if needed), persist and install the uploaded entries. Returns them."""
+    global schedule, upload_builder
+    entries = upload_builder.finish() if upload_builder else []
+    upload_builder = None
+    clear_schedule_rule()
+    schedule_store.replace(entries)
+    schedule = schedule_store.copy()
+    return entries
+
 def on_ble_rx(data):
-    global receiving_file, file_lines, startNow, schedule, partial_line, last_packet_time
+    """BLE write callback; times the handler so a blocking command shows up in STALLS."""
+    if data[:6] == b"TSYNC:":
+        # Time-sync probe: stamp and answer before anything else runs (see TSET)
+        rx_ms = clock.epoch_ms()
+        sp.send(f"TSYNC:{data[6:].decode().strip()}:{rx_ms}:{clock.epoch_ms()}")
+        return
+    start = time.ticks_ms()
+    metrics.inc("ble_rx_packets")
+    metrics.inc("ble_rx_bytes", len(data))
+    outer = monitor.where
+    monitor.mark("ble_rx")
+    try:
+        handle_ble_message(data)
+    finally:
+        monitor.timed("ble_rx", start)
+        metrics.since("ble_command_ms", start)
+        monitor.mark(outer)
+
+def handle_ble_message(data):
+    global receiving_file, startNow, schedule, partial_line, last_packet_time
+    global upload_builder
     global current_cmd, current_date, current_time
     global custom_cmd_parts, custom_cmd_total_parts
     global wifi_server, wifi_thread_running
+    global baud_probe_pending
     
     last_packet_time = time.ticks_ms()  # Update last packet time
     
@@ -184,12 +489,39 @@ def on_ble_rx(data):
                 
                 if msg == 'GETLOG':
                     print("📄 Sending log file contents...")
-                    log_lines = read_log_file()
-                    # Send log in chunks to avoid BLE MTU limitations
-                    for line in log_lines:
-                        ble_send(f"[LOG]{line.strip()}")
+                    # One line per notification to stay within the BLE MTU
+                    for line, _ in sample_log.read_from(0):
+                        monitor.mark("ble_rx")  # a full log takes longer than the watchdog
+                        ble_send("[LOG]" + line.decode("utf-8", "ignore").strip())
                     ble_send("LOG_END")
                     return
+                elif msg.startswith('GETLOGRANGE:'):
+                    # GETLOGRANGE:<from YYYYMMDDHHMMSS>[:<to>] - lines in a time range
+                    try:
+                        parts = msg[12:].split(':')
+                        since = to_epoch(parse_compact(parts[0]))
+                        until = to_epoch(parse_compact(parts[1])) if len(parts) > 1 and parts[1] else None
+                    except ValueError:
+                        ble_send("❌ Usage: GETLOGRANGE:<YYYYMMDDHHMMSS>[:<YYYYMMDDHHMMSS>]")
+                        return
+                    print(f"📄 Sending log lines from {parts[0]}...")
+                    send_log_range(since, until)
+                    return
+                elif msg == 'LOGDAYS':
+                    send_log_days()
+                    return
+                elif msg.startswith('GETLOG:'):
+                    # GETLOG:<offset>:<generation> - only what the client has not cached
+                    try:
+                        parts = msg[7:].split(':')
+                        offset = int(parts[0])
+                        gen = int(parts[1]) if len(parts) > 1 else log_generation()
+                    except ValueError:
+                        ble_send("❌ Usage: GETLOG:<offset>:<generation>")
+                        return
+                    print(f"📄 Sending log from byte {offset}...")
+                    send_log_from(offset, gen)
+                    return
                 elif msg == 'CLEARLOG':
                     print("🧹 Clearing log file...")
                     ok = clear_log_file()
@@ -202,7 +534,7 @@ def on_ble_rx(data):
                 elif msg == 'CMD:SCHEDULE_FILE':
                     print("📂 Starting to receive schedule file...")
                     receiving_file = True
-                    file_lines = []
+                    start_upload()
                     current_cmd = None
                     current_date = None
                     current_time = None
@@ -216,44 +548,25 @@ def on_ble_rx(data):
                     # Save the last entry if complete
                     if current_cmd and current_date and current_time:
                         entry = f"{current_cmd} at {current_date} {current_time}"
-                        file_lines.append(entry)
+                        add_upload_line(entry)
                         print(f"💾 Saved final entry: {entry}")
                     
                     # Send acknowledgment before processing
                     ble_send("ACK:SCHEDULE_COMPLETE")
-                    print("📋 Received schedule entries:")
-                    for i, line in enumerate(file_lines, 1):
-                        print(f"  {i}. {line}")
                     
-                    # Process all received lines
-                    if file_lines:
-                        schedule = []
-                        for line in file_lines:
-                            entry = parse_schedule_line(line)
-                            if entry:
-                                schedule.append(entry)
-                        
-                        schedule.sort(key=lambda x: x['time'])
-                        
-                        # Save to file
+                    # Entries were parsed as they arrived; install them directly
+                    if upload_builder and upload_builder.entries:
                         try:
-                            with open('schedule.txt', 'w') as f:
-                                for entry in schedule:
-                                    f.write(f"{entry['command']} at {entry['time']}\n")
-                            print(f"✅ Saved {len(schedule)} schedule entries to file")
-                            ble_send(f"ACK:SCHEDULE_SAVED {len(schedule)}")
-                            
-                            # Reload schedule into in-memory structure expected by the scheduler
-                            try:
-                                loaded = load_schedule()
-                                print(f"📥 Schedule reloaded. Entries: {len(loaded)}")
-                                ble_send(f"ACK:SCHEDULE_RELOADED {len(loaded)}")
-                            except Exception as e:
-                                print(f"Error reloading schedule: {e}")
+                            entries = finish_upload()
+                            print(f"✅ Saved {len(entries)} schedule entries to file")
+                            ble_send(f"ACK:SCHEDULE_SAVED {len(entries)}")
+                            print(f"📥 Schedule reloaded. Entries: {len(schedule)}")
+                            ble_send(f"ACK:SCHEDULE_RELOADED {len(schedule)}")
+                            report_feasibility()
                         except Exception as e:
                             print(f"Error saving schedule: {e}")
                     
-                    file_lines = []
+                    upload_builder = None
                     current_cmd = None
                     current_date = None
                     current_time = None
@@ -269,7 +582,7 @@ def on_ble_rx(data):
                         if current_cmd and current_date and current_time:
                             # Save previous complete entry
                             entry = f"{current_cmd} at {current_date} {current_time}"
-                            file_lines.append(entry)
+                            add_upload_line(entry)
                             print(f"💾 Saved complete entry: {entry}")
                         
                         current_cmd = data_part
@@ -290,9 +603,9 @@ def on_ble_rx(data):
                     # If we have all three parts, add to entries
                     if current_cmd and current_date and current_time:
                         entry = f"{current_cmd} at {current_date} {current_time}"
-                        file_lines.append(entry)
-                        print("Added entry:", entry)
-                        ble_send(f"ACK:ENTRY_BUILT {len(file_lines)}")
+                        if add_upload_line(entry):
+                            print("Added entry:", entry)
+                            ble_send(f"ACK:ENTRY_BUILT {len(upload_builder.entries)}")
                         
                         # Reset for next entry
                         current_cmd = None
@@ -317,7 +630,8 @@ def on_ble_rx(data):
             elif msg.strip().upper() == 'EMERGENCY_STOP':
                 global emergency_stop
                 emergency_stop = True
-                sp.send('🛑 Emergency stop activated - schedule halted')
+                safed_ms = stopper.trigger()  # pump terminate + valve reset now, relay off after settle
+                sp.send(f'🛑 Emergency stop activated - pump and valve stopped in {safed_ms} ms, relay off in {stopper.valve_settle_ms // 1000} s')
                 print('🛑 Emergency stop flag set')
                 return
 
@@ -328,15 +642,24 @@ def on_ble_rx(data):
                 except Exception as _e:
                     print('BLE ACK send failed before reboot:', _e)
                 time.sleep(0.2)  # allow BLE stack to flush
+                tracer.mark("reset")
+                monitor.expect_reset()
                 machine.reset()
                 return
 
             elif msg.strip().upper() == 'SHUTDOWN':
+                if monitor.wdt:
+                    # The watchdog cannot be stopped and keeps counting in deepsleep,
+                    # so a shutdown would only be a reboot 8 s later
+                    sp.send('❌ SHUTDOWN unavailable while the watchdog runs; use RESET or cut power')
+                    return
                 try:
                     sp.send('🛑 Shutting down (deep sleep)...')
                 except Exception as _e:
                     print('BLE ACK send failed before shutdown:', _e)
                 time.sleep(0.2)
+                tracer.stop()
+                monitor.expect_reset()
                 try:
                     machine.deepsleep()
                 except Exception as e:
@@ -344,6 +667,26 @@ def on_ble_rx(data):
                     machine.reset()
                 return
                 
+            elif msg.startswith('TSET:'):
+                # End of a TSYNC handshake: offset (device minus phone) and round trip
+                # of the exchange with the shortest round trip, both in ms
+                try:
+                    offset_ms, delay_ms = (int(v) for v in msg[5:].split(':'))
+                except ValueError:
+                    sp.send('❌ Use TSET:<offset_ms>:<delay_ms>')
+                    sp.send('TSYNC_END')
+                    return
+                before = clock.error_ms()
+                error_ms = max(delay_ms, 0) // 2 + 1
+                if clock.discipline(offset_ms, error_ms):
+                    sp.send(f'[TSYNC]🕒 Clock corrected by {-offset_ms:+d} ms (+/- {error_ms} ms)')
+                else:
+                    sp.send(f'[TSYNC]Kept current time: +/- {before} ms beats +/- {error_ms} ms')
+                for line in clock.lines()[1:3]:
+                    sp.send(f'[TSYNC]{line}')
+                sp.send('TSYNC_END')
+                return
+
             elif msg.strip().startswith('T:'):
                 # Set RTC time from compact format: T:YYYYMMDDHHMMSS
                 time_str = msg.strip()[2:]  # Remove 'T:' prefix
@@ -366,6 +709,7 @@ def on_ble_rx(data):
                     # Set the RTC using the manager
                     datetime_tuple = (year, month, day, 0, hour, minute, second)  # weekday=0 (Monday)
                     manager.set_rtc_time(datetime_tuple)
+                    clock.sync(reset_drift=True)
                     
                     sp.send(f'🕒 RTC time set to: {year}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}')
                     print(f"RTC time set to: {year}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}")
@@ -413,63 +757,8 @@ def on_ble_rx(data):
                     print(f'Error getting relay status: {e}')
                 return
                 
-            # Check for schedule file start
-            if msg == 'CMD:SCHEDULE_FILE':
-                receiving_file = True
-                file_lines = []
-                partial_line = b''
-                print("Starting to receive schedule file...")
-                sp.send("📝 Receiving schedule file...")
-                return
+            # CMD:SCHEDULE_FILE / CMD:END_SCHEDULE are handled above for both protocols
 
-                
-            # Check for schedule file end
-            if msg == 'CMD:END_SCHEDULE':
-                if receiving_file:
-                    receiving_file = False
-                    print("Finished receiving schedule file")
-                    
-                    # Process all received lines
-                    valid_lines = []
-                    for line in file_lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-                            
-                        # Parse and validate the line
-                        entry = parse_schedule_line(line)
-                        if entry:
-                            valid_lines.append(f"{entry['command']} at {entry['time']}")
-                    
-                    # Save the valid lines
-                    try:
-                        with open("schedule.txt", "w") as f:
-                            f.write("\n".join(valid_lines) + "\n")
-                        
-                        # Reload the schedule
-                        load_schedule()
-                        if schedule:
-                            sp.send(f"✅ Schedule saved with {len(schedule)} entries")
-                            print(f"Schedule saved with {len(schedule)} entries")
-                            
-                            # Send first 3 entries as preview
-                            for i, entry in enumerate(schedule[:3]):
-                                sp.send(f"{i+1}. {entry['command']} at {entry['time']}")
-                                time.sleep(0.1)
-                            
-                            if len(schedule) > 3:
-                                sp.send(f"... and {len(schedule)-3} more entries")
-                        else:
-                            sp.send("⚠️ No valid schedule entries to save")
-                            
-                    except Exception as e:
-                        sp.send(f"⚠️ Failed to process schedule: {e}")
-                        import sys
-                        sys.print_exception(e)
-                    finally:
-                        file_lines = []
-                return
-                
             # Handle data lines (both old and new protocol)
             elif receiving_file:
                 try:
@@ -493,8 +782,7 @@ def on_ble_rx(data):
                     # Process each complete line
                     for part in parts[:-1]:  # All but the last part should be complete lines
                         part = part.strip()
-                        if part:  # Skip empty lines
-                            file_lines.append(part)
+                        if part and add_upload_line(part):  # Skip empty lines
                             sp.send(f"📝 Added: {part}")
                     
                     # Handle the last part (might be incomplete)
@@ -502,8 +790,8 @@ def on_ble_rx(data):
                     if last_part:
                         # Check if it's a complete line (contains 'at' with enough characters after)
                         if ' at ' in last_part and len(last_part.split(' at ')) == 2:
-                            file_lines.append(last_part)
-                            sp.send(f"📝 Added: {last_part}")
+                            if add_upload_line(last_part):
+                                sp.send(f"📝 Added: {last_part}")
                         else:
                             # Save as partial for next time
                             partial_line = last_part
@@ -517,21 +805,266 @@ def on_ble_rx(data):
             # Handle other commands
             if msg == "BEGINFILE":
                 receiving_file = True
-                file_lines = []
+                start_upload()
                 time.sleep(0.1)  # Small delay before sending response
                 sp.send("📥 Ready to receive schedule file")
                 return
                 
+            elif msg.startswith("POWER:"):
+                # POWER:OFF|LIGHT|DEEP sets the mode between samples, POWER:STATUS reports it
+                arg = msg[6:].strip().upper()
+                if arg in MODES:
+                    power.mode = arg
+                    atomic_write_lines(POWER_MODE_FILE, [arg])
+                    sp.send(f"🔋 Power mode set to {arg}")
+                elif arg == "STATUS":
+                    update_measured_current()
+                    apply_voltage_policy()
+                    for line in power.status_lines(vsys.estimate()):
+                        sp.send(f"[POWER]{line}")
+                    sp.send(f"[POWER]level {voltage_level}, trend {vsys.trend_v_per_h:+.3f} V/h, pump sag {vsys.pump_sag_v:.2f} V")
+                    sp.send(f"[POWER]tx power {ble_tx_power_dbm} dBm, heartbeat {heartbeat_interval_ms // 1000} s")
+                    sp.send("POWER_END")
+                else:
+                    sp.send("❌ Use POWER:OFF, POWER:LIGHT, POWER:DEEP or POWER:STATUS")
+                return
+
+            elif msg == "BOOT_PROFILE":
+                for line in boot_profile_lines():
+                    sp.send(f"[BOOT]{line}")
+                sp.send("BOOT_END")
+                return
+
+            elif msg.startswith("TRACE:"):
+                # TRACE:ON starts a new trace (kept across resets), TRACE:OFF stops it
+                arg = msg[6:].strip().upper()
+                if arg == "ON":
+                    try:
+                        with open(TRACE_FLAG_FILE, "w") as f:
+                            f.write("1")
+                    except OSError as e:
+                        print(f"Failed to save trace flag: {e}")
+                    if tracer.start():
+                        sp.send("🎙️ Trace recording started")
+                    else:
+                        sp.send("❌ Could not start trace")
+                elif arg == "OFF":
+                    try:
+                        os.remove(TRACE_FLAG_FILE)
+                    except OSError:
+                        pass
+                    tracer.stop()
+                    sp.send("🎙️ Trace recording stopped")
+                elif arg != "STATUS":
+                    sp.send("❌ Use TRACE:ON, TRACE:OFF or TRACE:STATUS")
+                    return
+                sp.send(f"[TRACE]{tracer.status_line()}")
+                return
+
+            elif msg == "STALLS" or msg == "STALLS:CLEAR":
+                if msg == "STALLS:CLEAR":
+                    monitor.clear()
+                for line in monitor.lines():
+                    sp.send(f"[STALL]{line}")
+                sp.send("STALLS_END")
+                return
+
+            elif msg == "PUMPGOV" or msg.startswith("PUMPGOV:LIMIT"):
+                # PUMPGOV: VOLUME stroke speed and motor load, PUMPGOV:LIMIT <mA> sets the load limit
+                if msg != "PUMPGOV":
+                    try:
+                        limit = int(msg[13:].strip())
+                    except ValueError:
+                        sp.send("❌ Use PUMPGOV:LIMIT <mA>")
+                        return
+                    if limit <= 0:
+                        sp.send("❌ Use PUMPGOV:LIMIT <mA>")
+                        return
+                    governor.set_limit(limit)
+                for line in governor.lines():
+                    sp.send(f"[PUMPGOV]{line}")
+                sp.send("PUMPGOV_END")
+                return
+
+            elif msg == "METRICS" or msg == "METRICS:CLEAR":
+                if msg == "METRICS:CLEAR":
+                    metrics.clear()
+                metrics.heap()
+                for line in metrics.lines():
+                    sp.send(f"[METRICS]{line}")
+                sp.send("METRICS_END")
+                return
+
+            elif msg == "BAUD" or msg.startswith("BAUD:"):
+                # BAUD: rates in use, BAUD:PUMP <rate> / BAUD:VALVE <rate> set one, BAUD:PROBE find them
+                arg = msg[5:].strip()
+                if arg == "PROBE":
+                    baud_probe_pending = True
+                    sp.send("🔍 Baud probe queued; it runs when no step is active")
+                    return
+                if arg:
+                    parts = arg.split()
+                    try:
+                        device = parts[0].lower()
+                        rate = int(parts[1])
+                        bauds.check(device, rate)
+                    except (IndexError, ValueError) as e:
+                        sp.send(f"❌ Use BAUD:PUMP <rate>, BAUD:VALVE <rate> or BAUD:PROBE ({e})")
+                        return
+                    # Like the probe, never re-clock a UART in the middle of a step's exchange
+                    if queue_uart_request(("baud", device, rate)):
+                        sp.send(f"⏳ {device} {rate} baud queued; it applies when no step is active")
+                for line in bauds.lines():
+                    sp.send(f"[BAUD]{line}")
+                sp.send("BAUD_END")
+                return
+
+            elif msg == "LINK" or msg == "LINK:CLEAR":
+                # RS232 error rates and retries per UART
+                for link in (pump_link, valve_link):
+                    if msg == "LINK:CLEAR":
+                        link.clear()
+                    for line in link.lines():
+                        sp.send(f"[LINK]{line}")
+                sp.send("LINK_END")
+                return
+
+            elif msg == "CLOCK":
+                for line in clock.lines():
+                    sp.send(f"[CLOCK]{line}")
+                sp.send("CLOCK_END")
+                return
+
+            elif msg == "SAMPLES" or msg.startswith("SAMPLES:"):
+                # SAMPLES: whole ledger, SAMPLES:<port> one sample, SAMPLES:CLEAR reset counters
+                arg = msg[8:].strip()
+                if arg == "CLEAR":
+                    ledger.clear()
+                    sp.send("ACK:SAMPLES_CLEARED")
+                    return
+                sample = None
+                if arg:
+                    try:
+                        sample = samples.ports.get(int(arg), str(int(arg)))
+                    except ValueError:
+                        sample = arg
+                lines = ledger.lines(samples, sample)
+                for line in lines:
+                    sp.send(f"[SAMPLE]{line}")
+                if not lines:
+                    sp.send("[SAMPLE]No runs recorded")
+                sp.send("SAMPLES_END")
+                return
+
+            elif msg.startswith("RULE:"):
+                # RULE:YYYYMMDDHHMMSS,<interval s>,<ports>,<repeat>  e.g. RULE:20251019080000,1200,2-16,3
+                # RULE:CLEAR goes back to schedule.txt
+                text = msg[5:].strip()
+                if text.upper() == "CLEAR":
+                    clear_schedule_rule()
+                    loaded = load_schedule()
+                    sp.send(f"ACK:RULE_CLEARED {len(loaded)}")
+                    return
+                try:
+                    rule = ScheduleRule.parse(text)
+                except (ValueError, IndexError) as e:
+                    sp.send(f"❌ Invalid rule: {e}")
+                    return
+                step_s = estimated_step_seconds()
+                if rule.interval_s < step_s and len(rule) > 1:
+                    # Every entry after the first would start late and the delay keeps growing
+                    sp.send(f"FEASIBILITY:REJECTED interval {rule.interval_s}s is shorter than one step (~{step_s}s)")
+                    sp.send(f"FEASIBILITY:MIN_INTERVAL {step_s}s")
+                    return
+                try:
+                    atomic_write_lines(RULE_FILE, [rule.to_text()])
+                except OSError as e:
+                    sp.send(f"❌ Failed to save rule: {e}")
+                    return
+                schedule = rule
+                first = format_time(rule[0]["startTime"])
+                last = format_time(rule[-1]["startTime"])
+                sp.send(f"ACK:RULE_SAVED {len(rule)}")
+                sp.send(f"📅 Rule: {len(rule)} entries, {first} to {last}")
+                report_feasibility()
+                return
+
+            elif msg.startswith("PATCH:"):
+                # PATCH:<base hash> <op>[; <op>...]  e.g. PATCH:65d308a1 DEL #3; INS /2O05R at 2025-10-19 08:20:00
+                # Ops and hashing are described in schedule_patch.py
+                if isinstance(schedule, ScheduleRule):
+                    sp.send("❌ PATCH: a rule is active; send RULE:CLEAR or upload a schedule first")
+                    return
+                try:
+                    schedule_store.load()  # patch what is on flash, whatever wrote it
+                    entries = schedule_store.patch(msg[6:])
+                except HashMismatch:
+                    sp.send(f"PATCH:MISMATCH {schedule_store.hash:08x} {len(schedule_store.entries)}")
+                    return
+                except (PatchError, OSError) as e:
+                    sp.send(f"❌ PATCH: {e}")
+                    return
+                schedule = schedule_store.copy()
+                print(f"🩹 Schedule patched: {len(entries)} entries, hash {schedule_store.hash:08x}")
+                sp.send(f"ACK:PATCH {schedule_store.hash:08x} {len(entries)}")
+                report_feasibility()
+                return
+
+            elif msg == "SCHEDULE_DIGEST":
+                # Entry count and hash of the stored schedule, to verify an upload in one round trip
+                if isinstance(schedule, ScheduleRule):
+                    sp.send(f"SCHEDULE_DIGEST RULE {len(schedule)} {fnv1a(schedule.to_text().encode()):08x}")
+                    return
+                try:
+                    schedule_store.load()
+                except OSError as e:
+                    sp.send(f"❌ Error reading schedule file: {e}")
+                    return
+                sp.send(f"SCHEDULE_DIGEST {len(schedule_store.entries)} {schedule_store.hash:08x}")
+                return
+
+            elif msg == "FEASIBILITY":
+                if not schedule:
+                    load_schedule()
+                report_feasibility()
+                return
+
+            elif msg.startswith("READ_SCHEDULE "):
+                # READ_SCHEDULE <start> [count]: window of upcoming entries, 0 = next (count <= 50)
+                try:
+                    args = msg.split()
+                    start = int(args[1])
+                    count = int(args[2]) if len(args) > 2 else 20
+                except (ValueError, IndexError):
+                    sp.send("❌ Use READ_SCHEDULE <start> [count]")
+                    return
+                if not schedule:
+                    load_schedule()
+                sp.send("📅 Schedule Window:")
+                send_schedule_window(max(start, 0), max(count, 1))
+                return
+
+            elif msg == "READ_SCHEDULE" and isinstance(schedule, ScheduleRule):
+                time.sleep(0.1)  # Small delay before sending response
+                sp.send("📅 Current Schedule:")
+                sp.send(f"[RULE]{schedule.to_text()}")
+                send_schedule_window(0, 20)
+                return
+
             elif msg == "READ_SCHEDULE":
                 time.sleep(0.1)  # Small delay before sending response
-                schedule_lines = read_schedule_file()
-                if schedule_lines:
-                    sp.send("📅 Current Schedule:")
-                    for line in schedule_lines:
-                        # Prefix with [FILE] so the webpage renders schedule lines
-                        sp.send(f"[FILE]{line}")
-                        time.sleep(0.05)  # Small delay between lines
-                else:
+                sent = [0]
+
+                def send_entry(entry):
+                    monitor.mark("ble_rx")
+                    if sent[0] == 0:
+                        sp.send("📅 Current Schedule:")
+                    sent[0] += 1
+                    # Prefix with [FILE] so the webpage renders schedule lines
+                    sp.send(f"[FILE]{format_entry(entry)}")
+                    time.sleep(0.05)  # Small delay between lines
+
+                if read_schedule_file(send_entry) <= 0:
                     sp.send("📭 No schedule entries found")
                 return
             
@@ -578,16 +1111,17 @@ def on_ble_rx(data):
                     except OSError:
                         pass
                     
-                    # Update the file
-                    with open("default_sequence.txt", "w") as f:
-                        for line in lines:
-                            stripped = line.strip()
-                            if stripped.startswith('RINSE '):
-                                f.write(f"RINSE {rinse_count}\n")
-                            elif stripped.startswith('PUMP_CYCLES ') or stripped.startswith('PUMP '):
-                                f.write(f"PUMP_CYCLES {pump_cycles}\n")
-                            else:
-                                f.write(line)
+                    # Update the file (temp + rename so a reset never leaves it half written)
+                    new_lines = []
+                    for line in lines:
+                        stripped = line.strip()
+                        if stripped.startswith('RINSE '):
+                            new_lines.append(f"RINSE {rinse_count}")
+                        elif stripped.startswith('PUMP_CYCLES ') or stripped.startswith('PUMP '):
+                            new_lines.append(f"PUMP_CYCLES {pump_cycles}")
+                        else:
+                            new_lines.append(line)
+                    atomic_write_lines("default_sequence.txt", new_lines)
                     
                     sp.send(f"✅ Sequence updated: {rinse_count} rinses, {pump_cycles} pump cycles")
                 except Exception as e:
@@ -611,6 +1145,8 @@ def on_ble_rx(data):
                         sp.send('{"message":"Connect your PC to the Wi‑Fi network PICO-AP"}')
                         return
 
+                    # Imported on demand: pulls in network/socket, which slows boot
+                    from wifi_toggle import PicoPiFileServer
                     wifi_server = PicoPiFileServer(ssid=ssid, password=password, port=port)
                     try:
                         _thread.start_new_thread(_wifi_server_thread, ())
@@ -619,7 +1155,10 @@ def on_ble_rx(data):
                         time.sleep(1)
                         status = wifi_server.status() if hasattr(wifi_server, 'status') else {}
                         ip = status.get('ip') if isinstance(status, dict) else None
-                        msg = '{"status":"ok","message":"wifi_started","ip":"' + (ip or '') + '","port":' + str(port) + '}'
+                        msg = '{"status":"ok","message":"wifi_started","ip":"' + (ip or '') + '","port":' + str(port)
+                        if start_metrics_server():
+                            msg += ',"metrics_port":' + str(METRICS_PORT)
+                        msg += '}'
                         sp.send(msg)
                         sp.send('{"message":"Connect your PC to the Wi‑Fi network PICO-AP"}')
                     except Exception as e:
@@ -639,6 +1178,7 @@ def on_ble_rx(data):
                             print(f"Wi‑Fi shutdown error: {e}")
                         wifi_server = None
                         wifi_thread_running = False
+                        stop_metrics_server()
                         sp.send('{"status":"ok","message":"wifi_stopped"}')
                     else:
                         sp.send('{"status":"ok","message":"wifi_not_running"}')
@@ -691,10 +1231,8 @@ def on_ble_rx(data):
                         # Sort by part number and assemble
                         custom_cmd_parts.sort(key=lambda x: x[0])
                         full_cmd = "".join([part[1] for part in custom_cmd_parts])
-                        # Determine which UART based on command (pump=uart0, valve=uart1)
-                        target_uart = uart0 if full_cmd.startswith('/1') else uart1
-                        send_rs232_command(full_cmd, target_uart)
-                        sp.send(f"✅ Sent assembled command: {full_cmd}")
+                        if queue_uart_request(("cmd", full_cmd)):
+                            sp.send(f"📥 Command queued: {full_cmd}")
                         # Reset
                         custom_cmd_parts = []
                         custom_cmd_total_parts = 0
@@ -709,10 +1247,9 @@ def on_ble_rx(data):
             elif msg.startswith("SEND_CMD:"):
                 cmd = msg[9:].strip()
                 if cmd:
-                    # Determine which UART based on command (pump=uart0, valve=uart1)
-                    target_uart = uart0 if cmd.startswith('/1') else uart1
-                    send_rs232_command(cmd, target_uart)
-                    sp.send(f"✅ Sent command: {cmd}")
+                    # Sent from the idle loop, never in the middle of a step's exchange
+                    if queue_uart_request(("cmd", cmd)):
+                        sp.send(f"📥 Command queued: {cmd}")
                 else:
                     sp.send("❌ Empty command")
                 return
@@ -724,10 +1261,7 @@ def on_ble_rx(data):
 # --- File Operations ---
 def save_schedule_file(lines):
     try:
-        with open("schedule.txt", "w") as f:
-            for line in lines:
-                if line.strip() and " at " in line:
-                    f.write(line + "\n")
+        atomic_write_lines("schedule.txt", [line for line in lines if line.strip() and " at " in line])
         return True
     except Exception as e:
         print("Save error:", e)
@@ -739,9 +1273,9 @@ def setup_ble():
     try:
         ble = bluetooth.BLE()
         ble.active(True)
-        # Set BLE power level to maximum (8dBm)
+        # Set BLE power level (+8 dBm maximum, reduced on a low battery)
         try:
-            ble.config(power=0x08)  # 0x08 = +8dBm (maximum)
+            ble.config(power=ble_tx_power_dbm)
         except Exception as e:
             print(f"BLE power config not supported: {e}")
 
@@ -752,7 +1286,7 @@ def setup_ble():
         except Exception as e:
             print(f"Using default MTU: {e}")
 
-        sp = BLESimplePeripheral(ble)
+        sp = CountedPeripheral(TracedPeripheral(BLESimplePeripheral(ble), tracer), metrics)
         sp.on_write(on_ble_rx)  # Set up callback for BLE writes
         return True
     except Exception as e:
@@ -761,6 +1295,7 @@ def setup_ble():
 
 # Initialize BLE once
 ble_connected = setup_ble()
+boot_mark("ble_advertising")
 if not ble_connected:
     print("⚠️  Initial BLE setup failed, will retry...")
 
@@ -775,8 +1310,165 @@ CONVERSION_FACTOR = 3 * 3.3 / 65535  # 3x voltage divider on Pico
 def read_vsys():
     return vbat_adc.read_u16() * CONVERSION_FACTOR
 
+vsys = VsysMonitor(read_vsys)
+voltage_level = None
+
 def is_ble_voltage_safe():
-    return read_vsys() >= MIN_BLE_VOLTAGE
+    return vsys.sample() >= MIN_BLE_VOLTAGE
+
+def power_log(msg):
+    """Append a voltage-policy decision to power_log.txt for threshold tuning."""
+    try:
+        t = time.localtime()
+        ts = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(t[0], t[1], t[2], t[3], t[4], t[5])
+    except Exception:
+        ts = str(time.ticks_ms())
+    line = f"{ts} | vsys={vsys.estimate():.3f} V trend={vsys.trend_v_per_h:+.3f} V/h sag={vsys.pump_sag_v:.3f} V | {msg}"
+    print("🔋 " + line)
+    try:
+        with open(POWER_LOG_FILE, "a") as f:
+            f.write(line + "\n")
+        count_written(len(line) + 1)
+    except OSError as e:
+        print(f"power_log failed: {e}")
+
+def apply_voltage_policy():
+    """Scale BLE tx power and notification rate to the filtered VSYS level."""
+    global voltage_level, ble_tx_power_dbm, heartbeat_interval_ms
+    vsys.sample()
+    name, dbm, interval = vsys.level()
+    if name == voltage_level:
+        return
+    voltage_level = name
+    ble_tx_power_dbm = dbm
+    heartbeat_interval_ms = interval
+    try:
+        ble.config(power=dbm)
+    except Exception:
+        pass  # not supported by every firmware; the rate change still applies
+    power_log(f"level {name}: tx power {dbm} dBm, heartbeat every {interval // 1000} s")
+
+def wait_for_pump_power(cycle, command):
+    """Hold a pump cycle back while the battery is predicted to brown out under load.
+
+    The relay is off while the cycle is deferred, so the battery recovers
+    without the pump and valve drawing from it. Before the cycle goes ahead
+    the pump is re-initialized and the valve set back to command's port.
+    """
+    start = time.ticks_ms()
+    deferred = False
+    while True:
+        monitor.progress("power_wait")
+        service_metrics()
+        vsys.sample()
+        predicted = vsys.predict_loaded(PUMP_CYCLE_EST_MS)
+        if not vsys.brownout_predicted(PUMP_CYCLE_EST_MS):
+            if deferred:
+                power_log(f"cycle {cycle} resumed after {time.ticks_diff(time.ticks_ms(), start) // 1000} s, predicted {predicted:.2f} V")
+                return repower_for_pumping(command)
+            return True
+        if not deferred:
+            deferred = True
+            relay.value(1)  # shed the relay, pump and valve load while waiting
+            power_log(f"cycle {cycle} deferred with relay off, predicted {predicted:.2f} V under load")
+            sp.send(f"🔋 Cycle {cycle} deferred - low battery ({predicted:.2f} V predicted)")
+        if time.ticks_diff(time.ticks_ms(), start) > PUMP_DEFER_MAX_MS:
+            power_log(f"cycle {cycle} abandoned, predicted {predicted:.2f} V under load")
+            return False
+        stopper.sleep(5)
+
+def repower_for_pumping(command):
+    """Relay back on after a deferral: home the valve, re-initialize the pump, re-select the port."""
+    sp.send("🔀⚡Relay on")
+    relay.value(0)
+    stopper.sleep(2)
+    send_rs232_command("/2wR", uart1)
+    stopper.sleep(1)
+    send_rs232_command("/1ZWR", uart0)
+    if not wait_for_pump_ready(timeout_sec=15, poll_interval=2) and not resync_pump("Pump re-init"):
+        power_log("pump not ready after the relay came back on")
+        return False
+    send_rs232_command(command, uart1)
+    stopper.sleep(4)
+    return True
+
+def read_vsys_loaded(samples=4):
+    total = 0.0
+    for _ in range(samples):
+        total += read_vsys()
+    return total / samples
+
+# === Power management between samples ===
+POWER_MODE_FILE = "power_mode.txt"
+
+def load_power_mode():
+    try:
+        with open(POWER_MODE_FILE, "r") as f:
+            mode = f.read().strip().upper()
+        return mode if mode in MODES else MODE_OFF
+    except OSError:
+        return MODE_OFF
+
+power = PowerManager(load_power_mode())
+
+def ble_is_connected():
+    try:
+        return sp.is_connected()
+    except Exception:
+        return False
+
+def power_sleep(ms):
+    """Sleep for ms with the radio down, then bring BLE back up."""
+    global ble_connected
+    mode = power.mode
+    if mode == MODE_DEEP and not (journal.state and journal.state.get("stage") == "done"):
+        # Deepsleep resets on wake; without a checkpoint we would lose our place
+        mode = MODE_LIGHT
+    print(f"😴 Sleeping {ms // 1000} s ({mode})")
+    sp.send(f"😴 Sleeping {ms // 1000} s ({mode})")
+    time.sleep(0.2)  # let the notification go out
+    if mode == MODE_DEEP:
+        # Boot resumes from the checkpoint and waits for the next entry
+        tracer.mark(f"deepsleep {ms}")
+        watchdog_safe_sleep(ms, deep_sleep)
+    try:
+        ble.active(False)
+    except Exception as e:
+        print(f"BLE power-down failed: {e}")
+    watchdog_safe_sleep(ms, machine.lightsleep)
+    clock.sync()  # ticks_ms may not have counted the whole sleep
+    monitor.suspend()  # the sleep itself is not a stall
+    power.account("sleep", ms)
+    ble_connected = setup_ble()
+
+def deep_sleep(ms):
+    """machine.deepsleep(ms); the wake is a reset that check_reset() must not count."""
+    monitor.expect_reset()
+    machine.deepsleep(ms)
+
+def watchdog_safe_sleep(ms, sleep):
+    """Sleep ms with sleep(), in lightsleep chunks the running watchdog allows."""
+    chunk = monitor.max_sleep_ms or ms
+    while ms > chunk:
+        monitor.mark("sleep")
+        machine.lightsleep(chunk)
+        ms -= chunk
+    monitor.mark("sleep")
+    sleep(ms)
+
+def read_pump_current_ma():
+    """INA219 current in mA, or None when the sensor is not there."""
+    try:
+        return abs(get_ina219().getCurrent_mA())
+    except Exception:
+        return None
+
+def update_measured_current():
+    """Feed the INA219 reading into the budget while awake (sensor is optional)."""
+    try:
+        power.measured_ma = abs(get_ina219().getCurrent_mA())
+    except Exception:
+        pass
 
 # (BLE is fully initialized in setup_ble())
 
@@ -793,164 +1485,56 @@ def ble_send(message):
             print(f"BLE send error: {e}")
 
 # === Load Schedule ===
-def parse_schedule_line(line):
-    """Parse a single schedule line into command and timestamp"""
-    try:
-        if ' at ' not in line:
-            return None
-            
-        cmd, timestamp = line.split(' at ', 1)
-        cmd = cmd.strip()
-        timestamp = timestamp.strip()
-        
-        # Basic validation
-        if not cmd.startswith('/') or not cmd.endswith('R'):
-            print(f"Invalid command format: {cmd}")
-            return None
-            
-        # Parse timestamp (format: YYYY-MM-DD HH:MM:SS)
-        try:
-            # Just validate the format, don't parse it yet
-            if len(timestamp) < 16:  # At least "YYYY-MM-DD HH:MM"
-                raise ValueError("Timestamp too short")
-                
-            # Check if we have seconds, if not add them
-            if len(timestamp) == 16:  # YYYY-MM-DD HH:MM
-                timestamp += ":00"  # Add seconds
-                
-            return {
-                'command': cmd,
-                'time': timestamp,
-                'raw': line
-            }
-        except Exception as e:
-            print(f"Invalid timestamp '{timestamp}': {e}")
-            return None
-            
-    except Exception as e:
-        print(f"Error parsing line: {line} - {e}")
-        return None
-#                     schedule.append((cmd, (y, m, d, h, mi, s)))
-#     except Exception as e:
-#         print("Error loading schedule:", e)
-#     return schedule
-
-
 MAX_SCHEDULE_ENTRIES = 100
 schedule = []
+schedule_store = ScheduleStore(max_entries=MAX_SCHEDULE_ENTRIES)  # schedule.txt plus patches since
 
 def parse_schedule_line(line):
-    """Parse a single schedule line into command and timestamp"""
+    """Parse a single schedule line into a scheduler entry, or None if it is invalid"""
     try:
-        if not line or not isinstance(line, str):
-            return None
-            
-        line = line.strip()
-        if not line or ' at ' not in line:
-            return None
-            
-        # Split into command and timestamp parts
-        parts = line.split(' at ', 1)
-        if len(parts) != 2:
-            return None
-            
-        cmd = parts[0].strip()
-        timestamp = parts[1].strip()
-        
-        # Basic command validation
-        if not cmd or not cmd.startswith('/') or not cmd.endswith('R'):
-            print(f"Invalid command format: {cmd}")
-            return None
-        
-        # Clean and validate timestamp
-        try:
-            # Remove any non-numeric characters except - : and space
-            clean_timestamp = ''.join(c for c in timestamp if c.isdigit() or c in ' -:')
-            
-            # Split into date and time parts
-            if ' ' in clean_timestamp:
-                date_part, time_part = clean_timestamp.split(' ', 1)
-            else:
-                date_part = clean_timestamp
-                time_part = ''
-                
-            # Ensure we have at least YYYY-MM-DD
-            date_parts = date_part.split('-')
-            if len(date_parts) < 3:
-                raise ValueError("Invalid date format")
-                
-            year = int(date_parts[0])
-            month = int(date_parts[1])
-            day = int(date_parts[2])
-            
-            # Default time to 00:00:00 if not provided
-            hour = 0
-            minute = 0
-            second = 0
-            
-            # Parse time if available
-            if time_part:
-                time_parts = time_part.split(':')
-                if len(time_parts) >= 1:
-                    hour = int(time_parts[0])
-                if len(time_parts) >= 2:
-                    minute = int(time_parts[1])
-                if len(time_parts) >= 3:
-                    second = int(time_parts[2])
-            
-            # Basic validation
-            if not (1 <= month <= 12 and 1 <= day <= 31 and 
-                    0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second <= 59):
-                raise ValueError("Invalid date/time values")
-            
-            # Reconstruct timestamp in consistent format
-            formatted_time = f"{year:04d}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}"
-            
-            return {
-                'command': cmd,
-                'time': formatted_time,
-                'raw': line
-            }
-            
-        except (ValueError, IndexError) as e:
-            print(f"Invalid timestamp '{timestamp}': {e}")
-            return None
-            
-    except Exception as e:
-        print(f"Error parsing line '{line}': {e}")
+        command, dt = parse_line(line.strip())
+    except ValueError as e:
+        print(f"Invalid schedule line '{line}': {e}")
         return None
+    return {"command": command, "startTime": dt}
 
 def load_schedule(filename="schedule.txt"):
     """Load and parse the schedule file, fallback to default_sequence.txt if not found or empty"""
     global schedule
     schedule = []
-    
-    def parse_file(file_path):
-        temp_schedule = []
-        try:
-            with open(file_path, "r") as file:
-                for line in file:
-                    if len(temp_schedule) >= MAX_SCHEDULE_ENTRIES:
-                        break
 
-                    line = line.strip()
-                    if " at " not in line:
-                        continue
+    # A saved recurrence rule takes precedence over the explicit entry list
+    if filename == "schedule.txt":
+        rule = load_rule()
+        if rule:
+            schedule = rule
+            print(f"📥 Schedule rule loaded from {RULE_FILE}. Entries: {len(schedule)}")
+            return schedule
+    
+    def parse_file(file_path, report=True):
+        builder = ScheduleBuilder(MAX_SCHEDULE_ENTRIES)
+        rejects = [0]
 
-                    cmd, datetime_str = line.split(" at ", 1)
+        def reject(line_no, line, reason):
+            rejects[0] += 1
+            if report and rejects[0] <= 10:
+                print_reject(line_no, line, reason)
 
-                    try:
-                        y, m, d, h, min, s = map(int, datetime_str.split()[0].split('-') + datetime_str.split()[1].split(':'))
-                        entry = {
-                            "command": cmd,
-                            "startTime": (y, m, d, h, min, s)
-                        }
-                        temp_schedule.append(entry)
-                    except ValueError:
-                        continue
-            return temp_schedule
+        try:
+            if file_path == SCHEDULE_FILE:
+                # The stored schedule: schedule.txt plus any patches sent since
+                if schedule_store.load(reject) is None:
+                    return None
+                entries = schedule_store.copy()
+            else:
+                with open(file_path, "r") as file:
+                    parse_stream(file, builder.add, reject)
+                entries = builder.finish()
         except OSError:
             return None
+        if report and rejects[0] > 10:
+            print(f"... {rejects[0]} invalid lines in {file_path} in total")
+        return entries
     
     # Try primary file
     schedule = parse_file(filename)
@@ -963,7 +1547,7 @@ def load_schedule(filename="schedule.txt"):
         print(f"{filename} is empty, trying default_sequence.txt")
     
     # Try default file
-    schedule = parse_file("default_sequence.txt")
+    schedule = parse_file("default_sequence.txt", report=False)
     if schedule is not None and schedule:
         print(f"📥 Default Schedule Loaded from default_sequence.txt. Entries: {len(schedule)}")
         return schedule
@@ -976,11 +1560,29 @@ def load_schedule(filename="schedule.txt"):
     return []
 
 
+def clear_schedule_rule():
+    """Drop the saved rule so an uploaded entry list is used instead."""
+    try:
+        os.remove(RULE_FILE)
+    except OSError:
+        pass
+
+SCHEDULE_WINDOW_MAX = 50  # entries per READ_SCHEDULE window; 50 ms each keeps it inside the watchdog
+
+def send_schedule_window(start, count):
+    """Send entries start..start+count-1 of the in-memory schedule as [FILE] lines."""
+    end = min(len(schedule), start + min(count, SCHEDULE_WINDOW_MAX))
+    for i in range(start, end):
+        monitor.mark("ble_rx")  # runs in the BLE callback; keep the watchdog fed
+        entry = schedule[i]
+        sp.send(f"[FILE]{entry['command']} at {format_time(ensure_tuple(entry['startTime']))}")
+        time.sleep(0.05)  # Small delay between lines
+    sp.send(f"SCHEDULE_WINDOW {start}-{end - 1} of {len(schedule)}")
+
 def rebase_schedule_to_now():
     global schedule
 
-    now = manager.get_formatted_time()  # Returns (year, month, day, weekday, hour, minute, second)
-    now_tuple = (now[0], now[1], now[2], now[4], now[5], now[6])  # Strip weekday
+    now_tuple = clock.now()
 
     # 🧮 Find earliest scheduled time
     earliest = schedule[0]["startTime"]
@@ -1022,51 +1624,26 @@ def rebase_schedule_to_now():
 
 def log_command(cmd, timestamp, start_end):
     try:
-        # Map commands to sample positions (handles both 'O' and '0' in commands)
-        sample_map = {
-            # Format with 'O' and '0' for samples 1-9
-            "/2O02R": "smp 1", "/202R": "smp 1",
-            "/2O03R": "smp 2", "/203R": "smp 2",
-            "/2O04R": "smp 3", "/204R": "smp 3",
-            "/2O05R": "smp 4", "/205R": "smp 4",
-            "/2O06R": "smp 5", "/206R": "smp 5",
-            "/2O07R": "smp 6", "/207R": "smp 6",
-            "/2O08R": "smp 7", "/208R": "smp 7",
-            "/2O09R": "smp 8", "/209R": "smp 8",
-            
-            # Format with 'O' and '0' for samples 10-16 (note the different pattern)
-            "/2O10R": "smp 9",  "/210R": "smp 9",
-            "/2O11R": "smp 10", "/211R": "smp 10",
-            "/2O12R": "smp 11", "/212R": "smp 11",
-            "/2O13R": "smp 12", "/213R": "smp 12",
-            "/2O14R": "smp 13", "/214R": "smp 13",
-            "/2O15R": "smp 14", "/215R": "smp 14",
-            "/2O16R": "smp 15", "/216R": "smp 15"
-        }
+        sample = samples.sample_for(cmd)
         
-        # Get sample position or default to "N/A"
-        sample = sample_map.get(cmd.strip(), "N/A")
+        # If timestamp is already a string, use it directly
+        if isinstance(timestamp, str):
+            timestamp_str = timestamp
+        else:
+            # Otherwise, format it as YYYY-MM-DD HH:MM:SS
+            try:
+                timestamp_str = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
+                    int(timestamp[0]), int(timestamp[1]), int(timestamp[2]),
+                    int(timestamp[3]), int(timestamp[4]), int(timestamp[5])
+                )
+            except (IndexError, ValueError, TypeError):
+                # Fallback to current time if timestamp is invalid
+                now = time.localtime()
+                timestamp_str = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
+                    now[0], now[1], now[2], now[3], now[4], now[5]
+                )
         
-        with open("log_ME.txt", "a") as log_file:
-            # If timestamp is already a string, use it directly
-            if isinstance(timestamp, str):
-                timestamp_str = timestamp
-            else:
-                # Otherwise, format it as YYYY-MM-DD HH:MM:SS
-                try:
-                    timestamp_str = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
-                        int(timestamp[0]), int(timestamp[1]), int(timestamp[2]),
-                        int(timestamp[3]), int(timestamp[4]), int(timestamp[5])
-                    )
-                except (IndexError, ValueError, TypeError):
-                    # Fallback to current time if timestamp is invalid
-                    now = time.localtime()
-                    timestamp_str = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
-                        now[0], now[1], now[2], now[3], now[4], now[5]
-                    )
-            
-            log_entry = f"{timestamp_str} | Command: {cmd} | Sample: {sample} | Status: {start_end}\n"
-            log_file.write(log_entry)
+        sample_log.append(f"{timestamp_str} | Command: {cmd} | Sample: {sample} | Status: {start_end}")
     except OSError as e:
         print(f"Failed to write to log file: {e}")
 
@@ -1075,6 +1652,7 @@ def wait_for_start():
     global startNow, schedule, ble_connected
     last_ping = time.ticks_ms()
     last_ble_check = time.ticks_ms()
+    last_status = None
     ble_check_interval = 10000  # 10 seconds
     
     # Load schedule if it's empty
@@ -1088,24 +1666,29 @@ def wait_for_start():
         print(f"📋 Schedule loaded with {len(schedule)} entries")
 
     while True:
+        monitor.progress("wait_for_start")
+        service_metrics()
+        run_uart_requests()
+        if baud_probe_pending:
+            run_baud_probe()
         current_time = time.ticks_ms()
         
         # Periodically check BLE connection
         if time.ticks_diff(current_time, last_ble_check) > ble_check_interval:
-            if not ble_connected and read_vsys() >= MIN_BLE_VOLTAGE:
+            apply_voltage_policy()
+            if not ble_connected and is_ble_voltage_safe():
                 print("🔄 Attempting to reconnect BLE...")
                 ble_connected = setup_ble()
             last_ble_check = current_time
 
-        if time.ticks_diff(current_time, last_ping) > 10000:
+        if time.ticks_diff(current_time, last_ping) > 2 * heartbeat_interval_ms:
             last_ping = current_time
             sp.send("🔄 Waiting for start command or schedule...")
             # sp.send("Press m for manual start")
             print("🔄 Sent BLE ping: Waiting for start...")
 
         # Get current time as a formatted string and convert to tuple
-        current_time_str = manager.get_formatted_time()
-        now_tuple = ensure_tuple(current_time_str)
+        now_tuple = clock.now()
         
         if not schedule:
             print("❌ No schedule entries available")
@@ -1119,15 +1702,22 @@ def wait_for_start():
         print(f"Scheduled Start: {format_time(scheduled_tuple)}")
         print("BLE Ready - Send 'm' for manual start")
 
-        sp.send("Current Time")
-        sp.send(format_time(now_tuple))
-        sp.send("Start Time")
-        sp.send(format_time(scheduled_tuple))
+        # Status notifications follow the voltage-scaled heartbeat rate
+        send_status = last_status is None or time.ticks_diff(current_time, last_status) >= heartbeat_interval_ms
+        if send_status:
+            last_status = current_time
+            sp.send("Current Time")
+            sp.send(format_time(now_tuple))
+            sp.send("Start Time")
+            sp.send(format_time(scheduled_tuple))
 
         print("📋 Scheduled Sequence:")
-        for i, entry in enumerate(schedule):
+        for i in range(min(len(schedule), 10)):
+            entry = schedule[i]
             dt = ensure_tuple(entry["startTime"])
             print(f"  {i + 1}. {format_time(dt)} -> {entry['command']}")
+        if len(schedule) > 10:
+            print(f"  ... and {len(schedule) - 10} more")
 
         if len(schedule) >= 2:
             start_dt = ensure_tuple(schedule[0]["startTime"])
@@ -1141,8 +1731,9 @@ def wait_for_start():
 
             print(msg_runtime)
             print(msg_end)
-            sp.send(msg_runtime)
-            sp.send(msg_end)
+            if send_status:
+                sp.send(msg_runtime)
+                sp.send(msg_end)
 
         now_sec = datetime_to_seconds(now_tuple)
         scheduled_sec = datetime_to_seconds(scheduled_tuple)
@@ -1159,6 +1750,13 @@ def wait_for_start():
             break
             
         elif now_sec > scheduled_sec + 10:
+            if isinstance(schedule, ScheduleRule):
+                # Jump straight to the first entry still inside its grace period
+                skip = schedule.index_at(to_epoch(now_tuple) - 10)
+                if skip:
+                    schedule.first += skip
+                    print(f"⏭️  Skipped {skip} past rule entries")
+                    sp.send(f"⏭️  Skipped {skip} entries")
             # Skip past any schedule entries that have already passed
             while schedule and now_sec > datetime_to_seconds(ensure_tuple(schedule[0]["startTime"])) + 10:
                 skipped = schedule.pop(0)
@@ -1227,12 +1825,12 @@ def get_safe_remaining_millis(current, next_time):
         print(f"⚠️ Timing calc failed: {e}")
         return 0
     
-def print_timing_info(step, remaining_ms, next_switch, now):
+def print_timing_info(step, remaining_ms, next_switch, now, entries):
     # Show current time
     print_current_time(now)
 
-    command = schedule[step]['command']
-    step_count = len(schedule)
+    command = entries[step]['command']
+    step_count = len(entries)
     time_left_min = remaining_ms // 60000
     formatted_next = format_time(next_switch)
 
@@ -1245,74 +1843,70 @@ def print_timing_info(step, remaining_ms, next_switch, now):
     sp.send(f"📍 Next Switch At: {formatted_next}")
 
 
-# RS232 functionsdef send_rs232_command(command_str, uart):
-def read_and_validate_response(rs232, uart):
-    print("Raw Hex Response: ", end='')
-    response = bytearray()
-    start_time = time.ticks_ms()
-
-    while time.ticks_diff(time.ticks_ms(), start_time) < 2000:
-        if rs232.any():
-            byte_in = rs232.read(1)
-            if byte_in:
-                print(f"{byte_in[0]:02X} ", end='')
-                response.append(byte_in[0])
-                if byte_in[0] == 0x0A or len(response) >= 64:
-                    break
-    print()
-
-    print("Parsed Response (Hex): ", end='')
-    for b in response:
-        print(f"{b:02X} ", end='')
-    print()
-
-    expected_frame = bytearray([0xFF, 0x2F, 0x30, 0x40, 0x03, 0x0D, 0x0A])
-    matched = response == expected_frame
+def wait_with_heartbeat(duration_ms, next_index, plan=None):
+    """Wait with heartbeats about plan[next_index] (default: the schedule).
 
-    if matched:
-        print("✅ Response matches expected frame.")
-    else:
-        print("⚠️ Response does NOT match expected frame!")
-        print("Expected: ", end='')
-        for b in expected_frame:
-            print(f"{b:02X} ", end='')
-        print()
-        print("Received: ", end='')
-        for b in response:
-            print(f"{b:02X} ", end='')
-        print()
-
-
-def wait_with_heartbeat(duration_ms, next_index):
+    Returns False as soon as the global schedule is no longer plan, True
+    after the full wait.
+    """
+    entries = schedule if plan is None else plan
     t = 0
     last_heartbeat = time.ticks_ms()
+    awake_since = time.ticks_ms()
 
     while t < duration_ms:
-        time.sleep(0.1)
+        monitor.progress("heartbeat_wait")
+        service_metrics()
+        if plan is not None and schedule is not plan:
+            power.account("awake", time.ticks_diff(time.ticks_ms(), awake_since))
+            return False
+        # Long gap: sleep instead of spinning, keeping a BLE window after each wake
+        nap = power.sleep_duration(duration_ms - t, time.ticks_diff(time.ticks_ms(), awake_since))
+        if nap and not ble_is_connected():
+            power.account("awake", time.ticks_diff(time.ticks_ms(), awake_since))
+            power_sleep(nap)
+            t += nap
+            awake_since = time.ticks_ms()
+            last_heartbeat = awake_since
+            continue
+
+        if uart_requests:
+            # Between samples no step is using the UARTs
+            busy_since = time.ticks_ms()
+            run_uart_requests()
+            t += time.ticks_diff(time.ticks_ms(), busy_since)
+        stopper.sleep(0.1)
         t += 100
         current_time = time.ticks_ms()
 
-        # Heartbeat every 5 seconds
-        if time.ticks_diff(current_time, last_heartbeat) > 5000:
+        # Heartbeat every 5 seconds (longer on a low battery)
+        if time.ticks_diff(current_time, last_heartbeat) > heartbeat_interval_ms:
             last_heartbeat = current_time
+            apply_voltage_policy()
 
-            current_now = parse_time_str(manager.get_formatted_time())
-            next_switch = ensure_tuple(schedule[next_index]["startTime"])
+            current_now = clock.now()
+            next_switch = ensure_tuple(entries[next_index]["startTime"])
             remaining = get_safe_remaining_millis(current_now, next_switch)
             
             # Calculate remaining entries
-            remaining_entries = len(schedule) - next_index
+            remaining_entries = len(entries) - next_index
             
             sp.send("⏰ Current: " + format_time(current_now))
             sp.send("⏭️ Next at: " + format_time(next_switch))
-            sp.send(f"📊 Remaining: {remaining_entries}/{len(schedule)} samples")
+            sp.send(f"📊 Remaining: {remaining_entries}/{len(entries)} samples")
             
 
             print(f"⏰ Current: {format_time(current_now)}")
             print(f"⏭️ Next: {format_time(next_switch)}")
-            print(f"📊 Remaining: {remaining_entries}/{len(schedule)} samples")
+            print(f"📊 Remaining: {remaining_entries}/{len(entries)} samples")
+
+    power.account("awake", time.ticks_diff(time.ticks_ms(), awake_since))
+    return True
 
-def load_sequence(filename="default_sequence.txt"):
+# Used when default_sequence.txt is missing or empty
+DEFAULT_SEQUENCE = ["RINSE 2", "COMMAND", "PUMP 12"]
+
+def load_sequence(filename="default_sequence.txt", quiet=False):
     """Load the execution sequence from file, return list of commands/actions"""
     sequence = []
     try:
@@ -1325,15 +1919,52 @@ def load_sequence(filename="default_sequence.txt"):
                     sequence.append('COMMAND')
                 else:
                     sequence.append(line)
-        if sequence:
+        if sequence and not quiet:
             print(f"📄 Sequence loaded from {filename} with {len(sequence)} steps")
             sp.send(f"📄 Sequence loaded: {len(sequence)} steps")
         return sequence
     except OSError:
-        print(f"❌ Failed to load sequence from {filename}")
-        sp.send(f"❌ Failed to load sequence from {filename}")
+        if not quiet:
+            print(f"❌ Failed to load sequence from {filename}")
+            sp.send(f"❌ Failed to load sequence from {filename}")
         return []
 
+# Pump cycle time measured on this unit (seconds, smoothed); None until the first cycle
+measured_cycle_s = None
+
+def record_cycle_time(ms):
+    global measured_cycle_s
+    sec = ms / 1000
+    measured_cycle_s = sec if measured_cycle_s is None else measured_cycle_s + 0.3 * (sec - measured_cycle_s)
+
+def estimated_step_seconds():
+    sequence = load_sequence("default_sequence.txt", quiet=True) or DEFAULT_SEQUENCE
+    return estimate_step_seconds(sequence, measured_cycle_s, samples.ml_per_cycle)
+
+def report_feasibility():
+    """Predict start delays for the loaded schedule and report them over BLE."""
+    step_s = estimated_step_seconds()
+    if isinstance(schedule, ScheduleRule):
+        # Evenly spaced: worked out from the period, not entry by entry in the BLE callback
+        start = to_epoch(schedule[0]["startTime"]) if schedule else 0
+        result = analyze_periodic(start, schedule.interval_s, len(schedule), step_s)
+    else:
+        result = analyze(schedule, step_s)
+    count = result["count"]
+    end = format_time(result["end"]) if result["end"] else "--"
+    if result["late"] == 0:
+        msg = f"FEASIBILITY:OK {count} entries, step ~{result['step_s']}s, ends {end}"
+    else:
+        msg = (f"FEASIBILITY:LATE {result['late']}/{count} entries start late, "
+               f"max delay {result['max_delay_s']}s, ends {end}")
+    print(msg)
+    sp.send(msg)
+    for index, start, delay in result["first_late"]:
+        sp.send(f"[LATE]#{index + 1} {format_time(start)} +{delay}s")
+    gap = result["min_gap_s"]
+    sp.send(f"FEASIBILITY:MIN_INTERVAL {result['step_s']}s (tightest gap {gap if gap is not None else '--'}s)")
+    return result
+
 def test_log(msg):
     """Log messages to testing log file"""
     try:
@@ -1342,81 +1973,57 @@ def test_log(msg):
     except Exception:
         ts = str(time.ticks_ms())
     try:
-        with open("pump_status_log.txt", "a") as f:
-            f.write(ts + " | " + str(msg) + "\n")
+        pump_log.append(ts + " | " + str(msg))
     except Exception as e:
         print("test_log failed:", e)
 
 def query_pump_status():
     """Query pump status using [Q] command and decode status byte"""
-    uart0.write("/1QR\r")
-    time.sleep(0.1)
-    
-    response = bytearray()
-    start_time = time.ticks_ms()
-    while time.ticks_diff(time.ticks_ms(), start_time) < 1000:
-        if uart0.any():
-            byte_in = uart0.read(1)
-            if byte_in:
-                response.append(byte_in[0])
-                if byte_in[0] == 0x0A or len(response) >= 64:
-                    break
-    
-    if len(response) >= 4:
-        # Status byte is typically the 4th byte (after /1@)
-        status_byte = response[3]
-        
-        # Bit 5: Pump status (1=ready, 0=busy)
-        is_ready = (status_byte & 0x20) != 0
-        
-        # Bits 0-3: Error code
-        error_code = status_byte & 0x0F
-        
-        # Error descriptions
-        errors = {
-            0: "Error Free",
-            1: "Initialization error - check blockages",
-            2: "Invalid Command",
-            3: "Invalid Operand",
-            6: "EEPROM Failure",
-            7: "Device Not Initialized",
-            8: "Internal failure",
-            9: "Piston Overload - reinitialize required",
-            11: "Piston movement not allowed",
-            12: "Internal fault",
-            14: "A/D converter failure"
-        }
-        
+    frame = pump_link.transact("/1QR", 1000, abort=stopper.requested, sleep=uart_sleep,
+                               budget_ms=UART_BUDGET_MS)
+    check_link(pump_link)
+    if frame:
+        # Bit 5: Pump status (1=ready, 0=busy); bits 0-3: error code
+        is_ready = frame.ready
+        error_code = frame.error_code
         status = "READY" if is_ready else "BUSY"
-        error_desc = errors.get(error_code, f"Unknown error {error_code}")
+        error_desc = error_text(error_code)
+        if error_code:
+            metrics.inc("pump_errors", label=str(error_code))
         
         print(f"Status: {status} | Error Code: {error_code} ({error_desc})")
-        print(f"Raw status byte: 0x{status_byte:02X}")
+        print(f"Raw status byte: 0x{frame.status:02X}")
         
         return {
             'ready': is_ready,
             'error_code': error_code,
             'error_desc': error_desc,
-            'status_byte': status_byte,
-            'raw_response': response
+            'status_byte': frame.status,
+            'raw_response': rs232_decoder.raw()
         }
     else:
         print("⚠️ No valid status response received")
         return None
 
-def wait_for_pump_ready(timeout_sec=40, poll_interval=5):
-    """Poll pump status until ready or timeout"""
+def wait_for_pump_ready(timeout_sec=40, poll_interval=5, during=None):
+    """Poll pump status until ready or timeout.
+
+    during(seconds), if given, replaces the sleep between polls (the pump
+    governor samples motor current there).
+    """
     global emergency_stop
     print(f"Waiting for pump to become ready (timeout: {timeout_sec}s, polling every {poll_interval}s)")
     sp.send(f"⏳ Monitoring pump status...")
     start_time = time.ticks_ms()
     
     while time.ticks_diff(time.ticks_ms(), start_time) < (timeout_sec * 1000):
+        monitor.progress("pump_wait")
+        service_metrics()
         # Check for emergency stop
         if emergency_stop:
             print("🛑 Pump monitoring aborted - emergency stop active")
             sp.send("🛑 Pump aborted - emergency stop")
-            return False
+            raise EmergencyStop()
         
         status = query_pump_status()
         
@@ -1425,11 +2032,15 @@ def wait_for_pump_ready(timeout_sec=40, poll_interval=5):
             test_log(f"Status check: {'READY' if status['ready'] else 'BUSY'} | Error: {status['error_code']}")
             
             # Send periodic time update while waiting
-            current_time_str = manager.get_formatted_time()
             sp.send(f"Current Time")
-            sp.send(format_time(ensure_tuple(current_time_str)))
+            sp.send(clock.text())
             
-            # Check for errors
+            # Check for errors; a status byte hit by line noise must not end the cycle
+            if status['error_code'] != 0:
+                confirm = query_pump_status()
+                if confirm and confirm['error_code'] != status['error_code']:
+                    print(f"⚠️ Pump error {status['error_code']} not confirmed by a second query")
+                    status = confirm
             if status['error_code'] != 0:
                 error_msg = f"⚠️ Pump error: {status['error_desc']}"
                 print(error_msg)
@@ -1446,7 +2057,7 @@ def wait_for_pump_ready(timeout_sec=40, poll_interval=5):
         else:
             print("⚠️ Failed to get pump status")
         
-        time.sleep(poll_interval)
+        (during or stopper.sleep)(poll_interval)
     
     timeout_msg = f"⏰ Timeout waiting for pump"
     print(timeout_msg)
@@ -1454,14 +2065,81 @@ def wait_for_pump_ready(timeout_sec=40, poll_interval=5):
     return False
 
 
+FIXED_STROKE = "/1J0S15A0A7640M2000J1M2000S14A0M2000J0R"
+CYCLE_RETRIES = 1  # a failed stroke is repeated this often after resynchronizing
+OVERLOAD_RETRIES = 2
+
+def resync_pump(what):
+    """Terminate whatever the pump is doing and re-initialize it. Returns True once it is ready.
+
+    Used after a stroke fails, so a lost reply or a transient fault costs
+    one stroke rather than the whole sample.
+    """
+    msg = f"🔁 {what}: resynchronizing with the pump"
+    print(msg)
+    sp.send(msg)
+    test_log(msg)
+    send_rs232_command("/1TR", uart0)
+    send_rs232_command("/1ZWR", uart0)
+    return wait_for_pump_ready(timeout_sec=15, poll_interval=2)
+
+def fixed_stroke(what, timeout_sec, record_sag=False):
+    """One FIXED_STROKE; after a failure the pump is resynchronized and the stroke repeated."""
+    for attempt in range(CYCLE_RETRIES + 1):
+        if attempt and not resync_pump(what):
+            return False
+        idle_v = vsys.estimate()
+        send_rs232_command(FIXED_STROKE, uart0)
+        if record_sag:
+            vsys.record_sag(idle_v, read_vsys_loaded())
+        if wait_for_pump_ready(timeout_sec=timeout_sec, poll_interval=5):
+            return True
+    return False
+
+def governed_stroke(cycle):
+    """One VOLUME stroke at the governor's speed. Returns True once it has completed.
+
+    On a piston overload the governor slows down, the pump is
+    re-initialized and the stroke repeated, up to OVERLOAD_RETRIES times.
+    Other failures are repeated CYCLE_RETRIES times, as for fixed strokes.
+    """
+    for attempt in range(OVERLOAD_RETRIES + 1):
+        idle_v = vsys.estimate()
+        governor.begin(read_pump_current_ma())
+        send_rs232_command(governor.command(), uart0)
+        vsys.record_sag(idle_v, read_vsys_loaded())
+        if wait_for_pump_ready(timeout_sec=governor.timeout_s(), poll_interval=5,
+                               during=lambda s: governor.watch(s, read_pump_current_ma, stopper.sleep)):
+            return True
+        if attempt == OVERLOAD_RETRIES:
+            return False
+        status = query_pump_status()
+        if status and status['error_code'] == OVERLOAD_ERROR:
+            governor.overload()
+            msg = f"⚠️ Piston overload on cycle {cycle}, repeating it at S{governor.speed}"
+            print(msg)
+            sp.send(msg)
+            test_log(msg)
+        elif attempt >= CYCLE_RETRIES:
+            return False
+        if not resync_pump(f"Cycle {cycle}"):
+            return False
+    return False
+
 def send_and_validate(cmd, cycle=None):
-    # Transmit
-    uart0.write(cmd + '\r')
-    time.sleep(0.05)
-    # Switch to receive and allow device to respond
-    time.sleep(0.1)
-    # Read and validate the response
-    response, matched = read_and_validate_response(uart0)
+    """Send a pump command (retried by the link) and log whether a clean answer came back."""
+    frame = pump_link.transact(cmd, 2000, abort=stopper.requested, sleep=uart_sleep,
+                               budget_ms=UART_BUDGET_MS)
+    check_link(pump_link)
+    print("Raw Hex Response:", rs232_decoder.hex())
+    response = rs232_decoder.raw()
+    matched = frame is not None and frame.ok
+    if matched:
+        print("✅ Response frame OK.")
+    elif frame:
+        print(f"⚠️ Response frame reports error {frame.error_code}: {error_text(frame.error_code)}")
+    else:
+        print("⚠️ No complete response frame!")
 
     # Prepare a human readable raw hex representation
     if response:
@@ -1483,96 +2161,123 @@ def send_and_validate(cmd, cycle=None):
     print("Logged:", log_msg)
     return response, matched
 
-def execute_step(command):
+def execute_step(command, resume=None):
+    """Run one sample. resume is a checkpoint state to continue an interrupted step from."""
     global relay_manual_control, emergency_stop
     
-    # Check for emergency stop
+    # Check for emergency stop. Once running, every wait below raises
+    # EmergencyStop within estop.SLICE_MS; the BLE callback has already
+    # stopped the pump and valve and will switch the relay off.
     if emergency_stop:
         print("🛑 Execute step aborted - emergency stop active")
         sp.send("🛑 Step aborted - emergency stop active")
         return
+    tracer.mark(f"step {command}")
+    monitor.progress("execute_step")
     
     # Send current status update at start of step
-    current_time_str = manager.get_formatted_time()
     sp.send("Current Time")
-    sp.send(format_time(ensure_tuple(current_time_str)))
+    sp.send(clock.text())
     sp.send(f"🚀 Executing: {command}")
+    sample = samples.sample_for(command)
+
+    # Sequence item / cycle to pick up from after a reset mid-step
+    resume_item = -1
+    resume_cycle = 0
+    if resume and resume.get("stage") in ("rinse", "command", "pump"):
+        resume_item = resume.get("item", 0)
+        resume_cycle = resume.get("cycle", 0)
+        print(f"♻️ Resuming step at sequence item {resume_item + 1}, cycle {resume_cycle}")
+        sp.send(f"♻️ Resuming at item {resume_item + 1}, cycle {resume_cycle}")
     
-    # Clear pump status log at start of new sequence
-    try:
-        with open("pump_status_log.txt", "w") as f:
-            f.write("")
-        print("🧹 Pump status log cleared for new sequence")
-    except Exception as e:
-        print(f"Failed to clear pump status log: {e}")
+    # Mark the start of the sequence in the pump status log (kept across steps)
+    test_log(f"Step {command} started")
     
     sp.send("🔀⚡Relay on")
     print("Testing Relay ON")
     # relay off for testing
     relay = Pin(13, Pin.OUT, value=0)  # Initialize and turn ON (active-low)
-    time.sleep(2)
+    journal.stage("init")
+    stopper.sleep(2)
 
     print("Valves and pump set to start positions")
     send_rs232_command("/2wR", uart1)
-    time.sleep(1)
+    stopper.sleep(1)
     
     # Initialize pump and wait for ready
     print("Initializing pump...")
     sp.send("🔧 Initializing pump")
     send_rs232_command("/1ZWR", uart0) # pump initialization
-    if not wait_for_pump_ready(timeout_sec=15, poll_interval=2):
+    if not wait_for_pump_ready(timeout_sec=15, poll_interval=2) and not resync_pump("Pump init"):
         print("⚠️ Pump initialization failed or timed out")
         sp.send("⚠️ Pump init failed")
         relay.value(1)  # Turn off relay
+        ledger.fail(sample)
         return
     
     # probably need a rinse section in here with "/201R and 2 cycles of the pump
     print("Rinsing system")
     send_rs232_command("/2O01R", uart1)
-    time.sleep(4)
+    stopper.sleep(4)
 
     sequence = load_sequence("default_sequence.txt")
     if not sequence:
         # Default hard-coded sequence
-        sequence = [
-            "RINSE 2",
-            "COMMAND",
-            "PUMP 12"
-        ]
+        sequence = DEFAULT_SEQUENCE
+    tracer.mark("sequence " + "|".join(sequence))
 
-    for item in sequence:
+    for item_index, item in enumerate(sequence):
+        if item_index < resume_item and item != 'COMMAND':
+            # Already done before the reset
+            continue
+        start_cycle = resume_cycle if item_index == resume_item else 0
         if item.startswith('RINSE '):
             n = int(item.split()[1])
-            for i in range(n):
+            for i in range(start_cycle, n):
+                journal.stage("rinse", item_index, i)
                 print(f"💉 Rinse {i+1}/{n}")
                 sp.send(f"💉 Rinse {i+1}/{n}")
-                send_rs232_command("/1J0S15A0A7640M2000J1M2000S14A0M2000J0R", uart0)
-                
-                # Wait for pump to complete rinse cycle
-                if not wait_for_pump_ready(timeout_sec=40, poll_interval=5):
+                # Stroke, and wait for pump to complete rinse cycle
+                if not fixed_stroke(f"Rinse {i+1}", timeout_sec=40):
                     print(f"⚠️ Rinse cycle {i+1} failed")
                     sp.send(f"⚠️ Rinse {i+1} failed")
                     relay.value(1)  # Turn off relay
+                    ledger.fail(sample)
                     return
         elif item == 'COMMAND':
             print(f"🚀 Executing command: {command}")
-            log_command(command, manager.get_formatted_time(), "Start")
+            if item_index < resume_item:
+                # Re-select the sample port before resuming pumping; logged at original start
+                log_command(command, clock.text(), "Resume")
+            else:
+                journal.stage("command", item_index)
+                log_command(command, clock.text(), "Start")
+                ledger.start(sample, clock.text())
             send_rs232_command(command, uart1)
             sp.send("🚀 Executing command: " + command)
             sp.send("🛠️Valves set")
-            time.sleep(4)
-        elif 'PUMP' in item:
+            stopper.sleep(4)
+        elif 'PUMP' in item or item.startswith('VOLUME '):
             parts = item.split()
-            requested_n = int(parts[-1])
-            n = min(requested_n, 15)  # Cap at maximum 15 cycles
-            if requested_n > 15:
-                warning_msg = f"⚠️ Pump cycles capped at 15 (requested {requested_n})"
-                print(warning_msg)
-                sp.send(warning_msg)
-            print(f"💉 Starting pump sequence ({n} repetitions)")
-            sp.send(f"💉 Starting pump sequence ({n}x)")
+            volume = parts[0] == 'VOLUME'
+            if volume:
+                # Stroke count from the target volume; speed from the pump governor
+                ml = float(parts[1])
+                n = cycles_for(ml, samples.ml_per_cycle)
+                print(f"💉 Pumping {ml:g} ml: {n} strokes of ~{samples.ml_per_cycle:g} ml, starting at S{governor.speed}")
+                sp.send(f"💉 Volume {ml:g} ml ({n}x, S{governor.speed})")
+            else:
+                requested_n = int(parts[-1])
+                n = min(requested_n, 15)  # Cap at maximum 15 cycles
+                if requested_n > 15:
+                    warning_msg = f"⚠️ Pump cycles capped at 15 (requested {requested_n})"
+                    print(warning_msg)
+                    sp.send(warning_msg)
+                print(f"💉 Starting pump sequence ({n} repetitions)")
+                sp.send(f"💉 Starting pump sequence ({n}x)")
             
-            for i in range(n):
+            for i in range(start_cycle, n):
+                journal.stage("pump", item_index, i)
                 print(f"💉 Pumping cycle {i+1}/{n}")
                 sp.send(f"💉 Cycle {i+1}/{n}")
                 
@@ -1582,83 +2287,231 @@ def execute_step(command):
                     error_msg = f"⚠️ Pump error before cycle {i+1}: {status['error_desc']}"
                     print(error_msg)
                     sp.send(error_msg)
-                    test_log(f"Cycle {i+1} aborted - pump error: {status['error_desc']}")
+                    if not resync_pump(f"Cycle {i+1}"):
+                        test_log(f"Cycle {i+1} aborted - pump error: {status['error_desc']}")
+                        relay.value(1)  # Turn off relay
+                        ledger.fail(sample)
+                        return
+                
+                # Do not start a stroke the battery cannot carry
+                if not wait_for_pump_power(i + 1, command):
+                    error_msg = f"⚠️ Cycle {i+1} abandoned - battery too low"
+                    print(error_msg)
+                    sp.send(error_msg)
+                    test_log(f"Cycle {i+1} abandoned - predicted brownout")
                     relay.value(1)  # Turn off relay
+                    ledger.fail(sample)
                     return
-                
+
                 # Send pump command
-                send_rs232_command("/1J0S15A0A7640M2000J1M2000S14A0M2000J0R", uart0)
-                
-                # Wait for pump to complete cycle with status monitoring
-                if not wait_for_pump_ready(timeout_sec=45, poll_interval=5):
+                cycle_start = time.ticks_ms()
+                if volume:
+                    completed = governed_stroke(i + 1)
+                else:
+                    # Stroke, then wait for pump to complete cycle with status monitoring
+                    completed = fixed_stroke(f"Cycle {i+1}", timeout_sec=45, record_sag=True)
+                if not completed:
                     error_msg = f"⚠️ Cycle {i+1} failed or timed out"
                     print(error_msg)
                     sp.send(error_msg)
                     test_log(f"Cycle {i+1} - pump timeout or error")
                     relay.value(1)  # Turn off relay
+                    ledger.fail(sample)
                     return
                 
                 print(f"✅ Cycle {i+1} completed successfully")
                 test_log(f"Cycle {i+1} completed OK")
+                record_cycle_time(time.ticks_diff(time.ticks_ms(), cycle_start))
+                ledger.cycle(sample)
+                journal.stage("pump", item_index, i + 1)
+                if volume:
+                    verdict = governor.end()
+                    if verdict == "clogged":
+                        error_msg = (f"⚠️ Filter clogged: {governor.last_load_ma:.0f} mA at the slowest speed "
+                                     f"S{governor.speed} after cycle {i+1}/{n}")
+                        print(error_msg)
+                        sp.send(error_msg)
+                        test_log(error_msg)
+                        if i + 1 < n:  # The volume is in once the last stroke has completed
+                            relay.value(1)  # Turn off relay
+                            ledger.fail(sample)
+                            return
+                    if verdict in ("faster", "slower"):
+                        sp.send(f"⚡ Load {governor.last_load_ma:.0f} mA: next stroke S{governor.speed}")
             
             print("✅ Completed all pump cycles")
             sp.send("✅ Pumping completed")
-            log_command(command, manager.get_formatted_time(), "End")
+            log_command(command, clock.text(), "End")
 
+    journal.stage("reset")
     print("♻️ Resetting valves post-operation")
     sp.send("♻️Reset valves")
     send_rs232_command("/2wR", uart1)
-    time.sleep(4) 
+    stopper.sleep(4) 
 
     print("Relay OFF")
     sp.send("🔀⚡Relay off")
     relay.value(1)  # Set relay to OFF state (active-low logic: 1 = OFF, 0 = ON)
-    time.sleep(1) 
+    stopper.sleep(1) 
+    tracer.mark("end")
 
 # Load initial schedule
 schedule = load_schedule("schedule.txt")
-
-def main_loop():
+boot_mark("schedule")
+
+def next_entry_after(entries, epoch):
+    """Index of the first entry of entries starting after epoch (len(entries) if none)."""
+    if isinstance(entries, ScheduleRule):
+        return entries.index_at(epoch + 1)
+    for k, entry in enumerate(entries):
+        if to_epoch(ensure_tuple(entry["startTime"])) > epoch:
+            return k
+    return len(entries)
+
+def main_loop(start_index=0, resume=None, resumed=False):
+    """Run the schedule from start_index.
+
+    resumed is set when a reboot picked up the campaign (find_resume_point).
+    Unless it continues a step midway (resume), the first entry then waits
+    for its start time: a reset between samples must not take the next
+    sample early.
+
+    A PATCH, upload or rule received meanwhile replaces the global schedule.
+    That is checked before each step and during each wait; the run then
+    continues with the first new entry after the last one executed.
+    """
     global emergency_stop
-    for i, entry in enumerate(schedule):
-        # Check for emergency stop before each step
-        if emergency_stop:
-            print("🛑 Main loop stopped - emergency stop active")
-            sp.send("🛑 Schedule stopped - emergency stop")
-            break
-        
-        print("--------------------------------------------------")
-        now_tuple = parse_time_str(manager.get_formatted_time())
-        step_start = time.ticks_ms()
+    plan = schedule
+    i = start_index
+    done_at = to_epoch(ensure_tuple(plan[i - 1]["startTime"])) if 0 < i <= len(plan) else None
+    # Resumed after a reset or deepsleep: the entry may not be due yet
+    wait_first = resumed and resume is None
+    try:
+        while True:
+            if schedule is not plan:
+                plan = schedule
+                i = next_entry_after(plan, clock.epoch() - 11 if done_at is None else done_at)
+                wait_first = True
+                print(f"🩹 Schedule changed: continuing at entry {i + 1}/{len(plan)}")
+                sp.send(f"🩹 Schedule changed: next step {i + 1}/{len(plan)}")
+            if i >= len(plan):
+                break
+            entry = plan[i]
+            # Check for emergency stop before each step
+            if emergency_stop:
+                print("🛑 Main loop stopped - emergency stop active")
+                sp.send("🛑 Schedule stopped - emergency stop")
+                break
 
-        execute_step(entry['command'])
+            if wait_first:
+                # ⏳ Delay to the scheduled start; a schedule change ends it early
+                wait_ms = get_safe_remaining_millis(clock.now(), entry['startTime'])
+                if wait_ms > 0 and not wait_with_heartbeat(wait_ms, i, plan):
+                    continue
+                wait_first = False
+        
+            print("--------------------------------------------------")
+            monitor.progress("main_loop")
+            now_tuple = clock.now()
+            step_start = time.ticks_ms()
 
-        step_duration = time.ticks_diff(time.ticks_ms(), step_start)
-        next_switch = ensure_tuple(schedule[i + 1]["startTime"]) if i < len(schedule) - 1 else now_tuple
-        remaining = get_safe_remaining_millis(manager.get_formatted_time(), next_switch)
-        percent = ((i + 1) * 100) // len(schedule)
+            if resume is None:
+                journal.begin_step(i, entry['command'], format_time(ensure_tuple(entry['startTime'])))
+            try:
+                execute_step(entry['command'], resume)
+            except EmergencyStop:
+                ledger.fail(samples.sample_for(entry['command']))
+                tracer.mark("end")
+                sp.send(f"🛑 Step {i + 1} interrupted: {entry['command']}")
+                raise
+            resume = None
+            if not emergency_stop:
+                journal.stage("done")
+            done_at = to_epoch(ensure_tuple(entry['startTime']))
+
+            step_duration = time.ticks_diff(time.ticks_ms(), step_start)
+            power.account("step", step_duration)
+            step, ran = i, plan
+            i += 1
+            next_switch = ensure_tuple(plan[i]["startTime"]) if i < len(plan) else now_tuple
+            remaining = get_safe_remaining_millis(clock.now(), next_switch)
+            percent = (i * 100) // len(plan)
+
+            # 🎯 Step Summary & Progress
+            sp.send(f"📊 Progress: {percent}%")
+            sp.send(f"⏱️ Step {step + 1} Duration: {step_duration // 1000} sec")
+            sp.send(f"✅ Step {step + 1} executed: {entry['command']}")
+            print_timing_info(step, remaining, next_switch, now_tuple, ran)
+            wait_first = True
+    except EmergencyStop:
+        print("🛑 Main loop stopped - emergency stop active")
+        sp.send("🛑 Schedule stopped - emergency stop")
+
+    # Finished or stopped on purpose: nothing to resume after a reset
+    journal.clear()
+    print("🎉 All scheduled steps completed!")
+    sp.send("All steps completed!")
 
-        # 🎯 Step Summary & Progress
-        sp.send(f"📊 Progress: {percent}%")
-        sp.send(f"⏱️ Step {i + 1} Duration: {step_duration // 1000} sec")
-        sp.send(f"✅ Step {i + 1} executed: {entry['command']}")
-        print_timing_info(i, remaining, next_switch, now_tuple)
+def find_resume_point():
+    """Match the saved checkpoint to the loaded schedule.
 
-        # ⏳ Delay to next scheduled step
-        if i < len(schedule) - 1:
-            wait_with_heartbeat(remaining, i + 1)
+    Returns (start_index, resume_state) for main_loop(), or None when there
+    is nothing to resume. main_loop() waits for start_index's time unless
+    resume_state continues a step midway.
+    """
+    state = journal.load()
+    if not state or not schedule:
+        return None
+    command = state.get("command")
+    start = state.get("start")
+    index = state.get("step", 0)
+    # Fast path: the saved index still points at the same entry
+    if not (0 <= index < len(schedule) and schedule[index]["command"] == command
+            and format_time(ensure_tuple(schedule[index]["startTime"])) == start):
+        index = -1
+        for i, entry in enumerate(schedule):
+            if entry["command"] == command and format_time(ensure_tuple(entry["startTime"])) == start:
+                index = i
+                break
+    if index < 0:
+        print("Checkpoint does not match the loaded schedule, ignoring it")
+        journal.clear()
+        return None
 
-    print("🎉 All scheduled steps completed!")
-    sp.send("All steps completed!")
+    stage = state.get("stage")
+    if stage in ("reset", "done"):
+        # Sample was pumped; carry on with the next entry
+        if index + 1 >= len(schedule):
+            journal.clear()
+            return None
+        return index + 1, None
+    if stage in ("start", "init"):
+        # Nothing reached the sample line yet; rerun the whole step
+        return index, None
+    log_command(command, clock.text(),
+                f"Interrupted ({stage}, cycle {state.get('cycle', 0)})")
+    return index, state
     
 def scheduler():
-    global startNow, emergency_stop  # Declare as global
+    global startNow, emergency_stop, schedule  # Declare as global
+    resume_point = find_resume_point()
     while True:
+        monitor.progress("scheduler")
         # Reset emergency stop flag at start of new schedule cycle
         emergency_stop = False
+        stopper.clear()
         
-        wait_for_start()  # Wait for manual BLE trigger or scheduled start
-        main_loop()       # Execute scheduled steps
+        if resume_point:
+            # Rebooted mid-campaign: skip the start wait and pick up where we stopped
+            start_index, resume = resume_point
+            resume_point = None
+            msg = f"♻️ Resuming campaign at step {start_index + 1}/{len(schedule)}"
+            print(msg)
+            sp.send(msg)
+            main_loop(start_index, resume, resumed=True)
+        else:
+            wait_for_start()  # Wait for manual BLE trigger or scheduled start
+            main_loop()       # Execute scheduled steps
         
         # After completing the schedule, wait for new schedule or manual start
         print("\n📅 Schedule completed. Waiting for new schedule or manual start...")
@@ -1666,6 +2519,11 @@ def scheduler():
         
         # Check for new schedule every 5 seconds
         while True:
+            monitor.progress("scheduler")
+            service_metrics()
+            run_uart_requests()
+            if baud_probe_pending:
+                run_baud_probe()
             # Check for manual start
             if startNow:
                 print("\nManual start detected!")
@@ -1677,8 +2535,7 @@ def scheduler():
                 new_schedule = load_schedule("schedule.txt")
                 if new_schedule:
                     print("\nNew schedule detected!")
-                    schedule.clear()
-                    schedule.extend(new_schedule)
+                    schedule = new_schedule
                     break
             except Exception as e:
                 print(f"\nError checking schedule: {e}")
@@ -1686,6 +2543,26 @@ def scheduler():
             time.sleep(5)  # Check every 5 seconds
         time.sleep(5)
 
+def boot_profile_lines():
+    """Format the boot marks as 'phase +delta ms (at ms)' lines."""
+    lines = []
+    prev = 0
+    for phase, t in _boot_marks:
+        lines.append(f"{phase} +{time.ticks_diff(t, prev)} ms (at {t} ms)")
+        prev = t
+    try:
+        lines.append(f"reset_cause {machine.reset_cause()}")
+    except Exception:
+        pass
+    return lines
+
+def save_boot_profile():
+    """Keep the latest boot profile on flash so it can be read after the next reset."""
+    try:
+        atomic_write_lines(BOOT_PROFILE_FILE, boot_profile_lines())
+    except OSError as e:
+        print(f"Failed to save boot profile: {e}")
+
 def cleanup():
     print("\n🛑 Cleaning up before exit...")
     # Turn off the relay
@@ -1693,16 +2570,26 @@ def cleanup():
     # Close any open connections
     if 'sp' in globals():
         sp.send("Script stopped by user")
+    tracer.stop()
     print("Cleanup complete. Safe to disconnect.")
 
-# Load and confirm sequence on startup
-sequence_test = load_sequence("default_sequence.txt")
-if not sequence_test:
-    print("Using default hard-coded sequence")
-    sp.send("Using default hard-coded sequence")
+def run():
+    """Entry point. main.py calls this directly; a precompiled build calls it from a stub main.py."""
+    # Load and confirm sequence on startup
+    sequence_test = load_sequence("default_sequence.txt")
+    if not sequence_test:
+        print("Using default hard-coded sequence")
+        sp.send("Using default hard-coded sequence")
+    boot_mark("sequence")
+    save_boot_profile()
+    monitor.start_watchdog()
+
+    try:
+        scheduler()
+    except KeyboardInterrupt:
+        cleanup()
+    print("\n👋 Script stopped by user")
+
+if __name__ == "__main__":
+    run()
 
-try:
-    scheduler()
-except KeyboardInterrupt:
-    cleanup()
-print("\n👋 Script stopped by user")
@@ -0,0 +1,265 @@
+"""Firmware-wide counters and latency histograms.
+
+The firmware counts BLE traffic, UART transactions and pump error codes
+into a single Metrics instance. Each latency goes into a log2 histogram,
+as in StallMonitor, so recording it allocates nothing. Nothing is
+persisted: the counters start at zero on every boot, and a Prometheus
+scrape sees that as a counter reset.
+
+When Wi-Fi is on, MetricsServer serves render() as Prometheus text on
+port 9100. Its socket is non-blocking, and the firmware's wait loops call
+poll(), so a scrape is answered within one poll interval without a thread
+(the Wi-Fi file server already uses the second core). lines() is the
+compact version sent over BLE for METRICS.
+"""
+import gc
+from time import ticks_ms, ticks_diff
+
+from checkpoint import bytes_written
+
+METRICS_PORT = 9100
+PREFIX = "mkr_"
+BUCKETS = 16           # histogram bucket b holds values < 2**b ms; the last also holds the rest
+REQUEST_TIMEOUT_S = 1  # a scraper has this long to send its request line
+MAX_REQUEST = 1024
+
+# name: help. Labelled counters get a dict of label value -> count.
+COUNTERS = (
+    ("ble_rx_packets", "BLE writes received"),
+    ("ble_rx_bytes", "Bytes in BLE writes received"),
+    ("ble_tx_notifications", "BLE notifications sent"),
+    ("ble_tx_bytes", "Bytes in BLE notifications sent"),
+    ("ble_tx_failures", "BLE notifications that failed, by reason"),
+    ("uart_transactions", "RS232 command/answer exchanges, by device"),
+    ("uart_timeouts", "RS232 exchanges with no answer, by device"),
+    ("uart_mismatches", "RS232 answers that were not a complete frame, by device"),
+    ("pump_errors", "Pump status replies with an error, by error code"),
+    ("flash_bytes", "Bytes written to flash (files written with checkpoint, logs, traces)"),
+)
+LABELS = {"ble_tx_failures": "reason", "uart_transactions": "device", "uart_timeouts": "device",
+          "uart_mismatches": "device", "pump_errors": "code"}
+HISTOGRAMS = (
+    ("uart_reply_ms", "RS232 command to complete answer frame"),
+    ("ble_command_ms", "Time to handle one BLE write"),
+)
+
+
+def _bucket(ms):
+    ms = int(ms)
+    b = 0
+    while ms and b < BUCKETS - 1:
+        ms >>= 1
+        b += 1
+    return b
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {name: ({} if name in LABELS else 0) for name, _ in COUNTERS}
+        self.hists = {name: [0] * BUCKETS for name, _ in HISTOGRAMS}
+        self.sums = {name: 0 for name, _ in HISTOGRAMS}
+        self.maxes = {name: 0 for name, _ in HISTOGRAMS}
+        self.started = ticks_ms()
+        self._flash_base = bytes_written()
+        self.heap_free = gc.mem_free() if hasattr(gc, "mem_free") else 0
+        self.heap_min = self.heap_free
+        self.scrapes = 0
+
+    def inc(self, name, n=1, label=None):
+        if label is None:
+            self.counters[name] += n
+        else:
+            counts = self.counters[name]
+            counts[label] = counts.get(label, 0) + n
+
+    def observe(self, name, ms):
+        self.hists[name][_bucket(ms)] += 1
+        self.sums[name] += ms
+        if ms > self.maxes[name]:
+            self.maxes[name] = ms
+
+    def since(self, name, start):
+        """observe() the ticks_ms elapsed since start."""
+        self.observe(name, ticks_diff(ticks_ms(), start))
+
+    def uart(self, device, start, frame, received):
+        """One RS232 exchange begun at ticks_ms start; received is the byte count read."""
+        self.inc("uart_transactions", label=device)
+        if frame is not None:
+            self.since("uart_reply_ms", start)
+        elif received:
+            self.inc("uart_mismatches", label=device)
+        else:
+            self.inc("uart_timeouts", label=device)
+
+    def heap(self):
+        """Sample free heap and keep the low-water mark."""
+        if hasattr(gc, "mem_free"):
+            self.heap_free = gc.mem_free()
+            if self.heap_free < self.heap_min:
+                self.heap_min = self.heap_free
+
+    def clear(self):
+        self.__init__()
+
+    def _sync_flash(self):
+        self.counters["flash_bytes"] = bytes_written() - self._flash_base
+
+    # --- reporting -----------------------------------------------------------
+    def _quantile(self, name, q):
+        """Upper bound (ms) of the bucket holding quantile q, or None with no data."""
+        hist = self.hists[name]
+        total = sum(hist)
+        if not total:
+            return None
+        seen = 0
+        for b, count in enumerate(hist):
+            seen += count
+            if seen >= q * total:
+                return self.maxes[name] if b == BUCKETS - 1 else 1 << b
+        return self.maxes[name]
+
+    def render(self):
+        """Prometheus text exposition format, version 0.0.4."""
+        self._sync_flash()
+        out = []
+        for name, text in COUNTERS:
+            full = PREFIX + name + "_total"
+            out.append("# HELP {} {}".format(full, text))
+            out.append("# TYPE {} counter".format(full))
+            value = self.counters[name]
+            if isinstance(value, dict):
+                for label, count in sorted(value.items()):
+                    out.append('{}{{{}="{}"}} {}'.format(full, LABELS[name], label, count))
+            else:
+                out.append("{} {}".format(full, value))
+        for name, text in HISTOGRAMS:
+            full = PREFIX + name
+            out.append("# HELP {} {}".format(full, text))
+            out.append("# TYPE {} histogram".format(full))
+            hist = self.hists[name]
+            seen = 0
+            for b in range(BUCKETS - 1):
+                seen += hist[b]
+                out.append('{}_bucket{{le="{}"}} {}'.format(full, (1 << b) - 1, seen))
+            seen += hist[-1]
+            out.append('{}_bucket{{le="+Inf"}} {}'.format(full, seen))
+            out.append("{}_sum {}".format(full, self.sums[name]))
+            out.append("{}_count {}".format(full, seen))
+        for name, text, value in (
+                ("heap_free_bytes", "Free heap at the last sample", self.heap_free),
+                ("heap_free_min_bytes", "Lowest free heap seen since boot", self.heap_min),
+                ("uptime_seconds", "Seconds since the counters started", ticks_diff(ticks_ms(), self.started) // 1000)):
+            out.append("# HELP {}{} {}".format(PREFIX, name, text))
+            out.append("# TYPE {}{} gauge".format(PREFIX, name))
+            out.append("{}{} {}".format(PREFIX, name, value))
+        out.append("")
+        return "\n".join(out)
+
+    def lines(self):
+        self._sync_flash()
+        c = self.counters
+
+        def labelled(name):
+            return ", ".join("{} {}".format(k, v) for k, v in sorted(c[name].items())) or "none"
+
+        out = [
+            "up {} s, heap free {} (min {}), flash written {} bytes".format(
+                ticks_diff(ticks_ms(), self.started) // 1000, self.heap_free, self.heap_min, c["flash_bytes"]),
+            "ble rx {} writes/{} B, tx {} notifications/{} B, failed: {}".format(
+                c["ble_rx_packets"], c["ble_rx_bytes"], c["ble_tx_notifications"], c["ble_tx_bytes"],
+                labelled("ble_tx_failures")),
+            "uart exchanges: {}; timeouts: {}; bad frames: {}".format(
+                labelled("uart_transactions"), labelled("uart_timeouts"), labelled("uart_mismatches")),
+            "pump errors by code: {}".format(labelled("pump_errors")),
+        ]
+        for name, _ in HISTOGRAMS:
+            n = sum(self.hists[name])
+            if n:
+                out.append("{}: n {}, p50 <{} p99 <{} max {}".format(
+                    name, n, self._quantile(name, 0.5), self._quantile(name, 0.99), self.maxes[name]))
+            else:
+                out.append("{}: no data".format(name))
+        if self.scrapes:
+            out.append("scrapes {}".format(self.scrapes))
+        return out
+
+
+class CountedPeripheral:
+    """BLE peripheral wrapper counting notifications, their bytes and failures."""
+
+    def __init__(self, peripheral, metrics):
+        self._sp = peripheral
+        self._m = metrics
+
+    def send(self, data):
+        m = self._m
+        if hasattr(self._sp, "is_connected") and not self._sp.is_connected():
+            m.inc("ble_tx_failures", label="disconnected")
+        try:
+            result = self._sp.send(data)
+        except Exception:
+            m.inc("ble_tx_failures", label="error")
+            raise
+        m.inc("ble_tx_notifications")
+        m.inc("ble_tx_bytes", len(data))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._sp, name)
+
+
+class MetricsServer:
+    """Non-blocking HTTP listener serving Metrics.render(); call poll() from a loop."""
+
+    def __init__(self, metrics, port=METRICS_PORT):
+        self.metrics = metrics
+        self.port = port
+        self.sock = None
+
+    def start(self):
+        import socket
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(socket.getaddrinfo("0.0.0.0", self.port)[0][-1])
+        s.listen(2)
+        s.setblocking(False)
+        self.sock = s
+
+    def stop(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def poll(self):
+        """Answer one pending scrape, if any. Returns True if one was served."""
+        if self.sock is None:
+            return False
+        try:
+            conn, _ = self.sock.accept()
+        except OSError:
+            return False  # nothing waiting (EAGAIN)
+        try:
+            conn.settimeout(REQUEST_TIMEOUT_S)
+            request = b""
+            while b"\r\n\r\n" not in request and b"\n\n" not in request and len(request) < MAX_REQUEST:
+                chunk = conn.recv(256)
+                if not chunk:
+                    break
+                request += chunk
+            parts = request.split(b" ", 2)
+            path = parts[1].split(b"?")[0] if len(parts) > 1 else b""
+            if path in (b"/", b"/metrics"):
+                self.metrics.scrapes += 1
+                body = self.metrics.render().encode()
+                head = "HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            else:
+                body = b"not found\n"
+                head = "HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\n"
+            conn.sendall("{}Content-Length: {}\r\n\r\n".format(head, len(body)).encode())
+            conn.sendall(body)
+        except OSError as e:
+            print("Metrics scrape failed: {}".format(e))
+        finally:
+            conn.close()
+        return True
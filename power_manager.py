@@ -0,0 +1,96 @@
+"""Sleep planning and battery-life projection for long gaps between samples."""
+
+MODE_OFF = "OFF"
+MODE_LIGHT = "LIGHT"
+MODE_DEEP = "DEEP"
+MODES = (MODE_OFF, MODE_LIGHT, MODE_DEEP)
+
+# Typical supply currents (mA) used when the INA219 is not available
+AWAKE_CURRENT_MA = 45.0       # Pico W with BLE advertising/connected
+SLEEP_CURRENT_MA = {MODE_LIGHT: 2.0, MODE_DEEP: 1.3}
+STEP_CURRENT_MA = 350.0       # relay on, pump and valve running
+
+# Li-ion cell behind VSYS
+BATTERY_CAPACITY_MAH = 3000
+BATTERY_EMPTY_V = 3.3
+BATTERY_FULL_V = 4.2
+
+
+def battery_fraction(vsys):
+    """Rough state of charge from VSYS (linear between empty and full)."""
+    frac = (vsys - BATTERY_EMPTY_V) / (BATTERY_FULL_V - BATTERY_EMPTY_V)
+    return min(max(frac, 0.0), 1.0)
+
+
+class PowerManager:
+    """Decides when to sleep and keeps a running energy budget.
+
+    wake_lead_ms   wake this long before the next sample to prepare
+    ble_window_ms  stay awake this long after boot/wake so commands can get in
+    min_sleep_ms   do not bother sleeping for less than this
+    max_sleep_ms   longest single sleep, so the schedule is re-checked regularly
+    """
+
+    def __init__(self, mode=MODE_OFF, wake_lead_ms=120000, ble_window_ms=20000,
+                 min_sleep_ms=60000, max_sleep_ms=600000):
+        self.mode = mode if mode in MODES else MODE_OFF
+        self.wake_lead_ms = wake_lead_ms
+        self.ble_window_ms = ble_window_ms
+        self.min_sleep_ms = min_sleep_ms
+        self.max_sleep_ms = max_sleep_ms
+        self.awake_ms = 0
+        self.sleep_ms = 0
+        self.step_ms = 0
+        self.measured_ma = None
+
+    def sleep_duration(self, remaining_ms, awake_for_ms):
+        """How long to sleep now, or 0 to stay awake.
+
+        remaining_ms is the time left until the next sample starts and
+        awake_for_ms how long we have been awake since the last wake.
+        """
+        if self.mode == MODE_OFF or awake_for_ms < self.ble_window_ms:
+            return 0
+        budget = remaining_ms - self.wake_lead_ms
+        if budget < self.min_sleep_ms:
+            return 0
+        return min(budget, self.max_sleep_ms)
+
+    def account(self, kind, ms):
+        """Add ms of 'awake', 'sleep' or 'step' time to the budget."""
+        if kind == "sleep":
+            self.sleep_ms += ms
+        elif kind == "step":
+            self.step_ms += ms
+        else:
+            self.awake_ms += ms
+
+    def average_current_ma(self):
+        total = self.awake_ms + self.sleep_ms + self.step_ms
+        awake_ma = self.measured_ma if self.measured_ma is not None else AWAKE_CURRENT_MA
+        if total == 0:
+            return awake_ma
+        sleep_ma = SLEEP_CURRENT_MA.get(self.mode, awake_ma)
+        return (self.awake_ms * awake_ma + self.sleep_ms * sleep_ma
+                + self.step_ms * STEP_CURRENT_MA) / total
+
+    def projected_hours(self, vsys):
+        """Hours of operation left at the current duty cycle."""
+        avg = self.average_current_ma()
+        if avg <= 0:
+            return None
+        return battery_fraction(vsys) * BATTERY_CAPACITY_MAH / avg
+
+    def status_lines(self, vsys):
+        total = self.awake_ms + self.sleep_ms + self.step_ms
+        asleep = (100 * self.sleep_ms // total) if total else 0
+        hours = self.projected_hours(vsys)
+        lines = [
+            f"mode {self.mode}",
+            f"asleep {asleep}% of {total // 1000} s",
+            f"avg current {self.average_current_ma():.1f} mA",
+            f"battery {battery_fraction(vsys) * 100:.0f}% ({vsys:.2f} V)",
+        ]
+        if hours is not None:
+            lines.append(f"projected life {hours:.0f} h ({hours / 24:.1f} days)")
+        return lines
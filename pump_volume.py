@@ -0,0 +1,162 @@
+"""Volume-targeted pumping with the stroke speed set by motor load.
+
+A sequence line "VOLUME <ml>" takes the place of "PUMP <n>". execute_step()
+runs cycles_for(ml) strokes, each built by PumpGovernor.command() around
+the current speed code rather than the fixed S15/S14 of PUMP strokes.
+Lower codes are faster (the pump's S0 is its top speed).
+
+The INA219 is read every SAMPLE_MS while a stroke runs. The peak current
+above the idle reading taken just before the stroke is the motor load.
+After each stroke:
+
+  load >= limit_ma                    back off BACKOFF_CODES slower
+  load < limit_ma * HEADROOM          after SPEEDUP_AFTER such strokes
+                                      in a row, one code faster
+  piston overload error (code 9)      back off twice as far; execute_step
+                                      re-initializes and repeats the stroke
+
+A filter that clogs raises the load at the same speed, so the governor
+slows down as it fills. Over the limit at SLOWEST_SPEED counts as a
+clogged filter and pumping stops. Without a current reading the speed is
+left alone. The speed is kept in GOVERNOR_FILE, so the next sample starts
+at the last safe speed.
+"""
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from checkpoint import atomic_write
+
+GOVERNOR_FILE = "pump_governor.json"
+STROKE_STEPS = 7640       # full stroke, as in /1J0S15A0A7640M2000J1M2000S14A0M2000J0R
+DWELL_MS = 2000
+DEFAULT_SPEED = 15        # the fixed stroke's aspirate speed
+FASTEST_SPEED = 8
+SLOWEST_SPEED = 22
+CURRENT_LIMIT_MA = 450    # motor load (above idle) allowed during a stroke
+HEADROOM = 0.8
+SPEEDUP_AFTER = 3
+BACKOFF_CODES = 2
+SAMPLE_MS = 100
+STROKE_TIMEOUT_S = 45     # at DEFAULT_SPEED or faster
+SLOW_TIMEOUT_S = 20       # added per code slower than DEFAULT_SPEED
+MAX_VOLUME_CYCLES = 40
+OVERLOAD_ERROR = 9
+
+
+def cycles_for(ml, ml_per_cycle):
+    """Strokes needed for at least ml (ceil), capped at MAX_VOLUME_CYCLES."""
+    n = int(-(-ml // ml_per_cycle))
+    return max(1, min(n, MAX_VOLUME_CYCLES))
+
+
+class PumpGovernor:
+    def __init__(self, path=GOVERNOR_FILE, limit_ma=CURRENT_LIMIT_MA):
+        self.path = path
+        self.limit_ma = limit_ma
+        self.speed = DEFAULT_SPEED
+        self.strokes = 0
+        self.backoffs = 0
+        self.overloads = 0
+        self.last_load_ma = None
+        self.max_load_ma = 0
+        self._clean = 0
+        self._idle = None
+        self._peak = None
+        self._load()
+
+    # --- persistence ---------------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.loads(f.read())
+            self.speed = min(max(state.get("speed", DEFAULT_SPEED), FASTEST_SPEED), SLOWEST_SPEED)
+            self.limit_ma = state.get("limit_ma", self.limit_ma)
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        try:
+            atomic_write(self.path, json.dumps({"speed": self.speed, "limit_ma": self.limit_ma}))
+        except OSError as e:
+            print("Failed to save pump speed: {}".format(e))
+
+    # --- strokes -------------------------------------------------------------
+    def command(self):
+        """Stroke at the current speed; dispense one code faster, as the fixed stroke does."""
+        dispense = max(self.speed - 1, FASTEST_SPEED)
+        return "/1J0S{}A0A{}M{}J1M{}S{}A0M{}J0R".format(
+            self.speed, STROKE_STEPS, DWELL_MS, DWELL_MS, dispense, DWELL_MS)
+
+    def timeout_s(self):
+        return STROKE_TIMEOUT_S + SLOW_TIMEOUT_S * max(0, self.speed - DEFAULT_SPEED)
+
+    def begin(self, idle_ma):
+        """A stroke is about to start; idle_ma is the current before it (None: no sensor)."""
+        self._idle = idle_ma
+        self._peak = None
+
+    def watch(self, seconds, read_ma, sleep):
+        """Sample read_ma() every SAMPLE_MS for seconds, sleeping with sleep(seconds)."""
+        remaining = int(seconds * 1000)
+        while remaining > 0:
+            ma = read_ma()
+            if ma is not None and (self._peak is None or ma > self._peak):
+                self._peak = ma
+            step = SAMPLE_MS if remaining > SAMPLE_MS else remaining
+            sleep(step / 1000)
+            remaining -= step
+
+    def end(self):
+        """Adjust the speed after a completed stroke.
+
+        Returns "faster", "slower", "same", "clogged", or None without a reading.
+        """
+        self.strokes += 1
+        if self._idle is None or self._peak is None:
+            return None
+        load = self._peak - self._idle
+        self.last_load_ma = load
+        if load > self.max_load_ma:
+            self.max_load_ma = load
+        if load >= self.limit_ma:
+            self._clean = 0
+            if self.speed >= SLOWEST_SPEED:
+                return "clogged"
+            self.speed = min(self.speed + BACKOFF_CODES, SLOWEST_SPEED)
+            self.backoffs += 1
+            self._save()
+            return "slower"
+        if load < self.limit_ma * HEADROOM:
+            self._clean += 1
+            if self._clean >= SPEEDUP_AFTER and self.speed > FASTEST_SPEED:
+                self._clean = 0
+                self.speed -= 1
+                self._save()
+                return "faster"
+        else:
+            self._clean = 0
+        return "same"
+
+    def overload(self):
+        """The pump reported a piston overload: slow down before the stroke is repeated."""
+        self.overloads += 1
+        self._clean = 0
+        self.speed = min(self.speed + 2 * BACKOFF_CODES, SLOWEST_SPEED)
+        self._save()
+
+    def set_limit(self, limit_ma):
+        self.limit_ma = limit_ma
+        self._save()
+
+    # --- reporting -----------------------------------------------------------
+    def lines(self):
+        last = "--" if self.last_load_ma is None else "{:.0f} mA".format(self.last_load_ma)
+        return [
+            "speed S{} (fastest S{}, slowest S{}), limit {} mA above idle".format(
+                self.speed, FASTEST_SPEED, SLOWEST_SPEED, self.limit_ma),
+            "stroke: " + self.command(),
+            "strokes {}, last load {}, max load {:.0f} mA".format(self.strokes, last, self.max_load_ma),
+            "back-offs {}, piston overloads {}".format(self.backoffs, self.overloads),
+        ]
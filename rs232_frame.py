@@ -0,0 +1,166 @@
+"""Incremental decoder for pump/valve answer frames.
+
+An answer looks like
+
+    [0xFF] '/' <address> <status> [data ...] ETX [CR LF]
+
+for example FF 2F 30 60 03 0D 0A: master address '0', status 0x60
+(ready, no error). Status bit 5 is ready/busy and bits 0-3 are the error
+code. Bytes are pulled from the UART with readinto() into a preallocated
+chunk and scanned into one reusable buffer. A frame can arrive split across
+any number of reads, and decoding allocates nothing. Frame.data() and
+FrameDecoder.raw() copy only when the caller asks for bytes.
+"""
+try:
+    from time import ticks_ms, ticks_diff, sleep_ms
+except ImportError:  # CPython: decoding only
+    ticks_ms = ticks_diff = sleep_ms = None
+
+START = 0x2F  # '/'
+ETX = 0x03
+LF = 0x0A
+READY_BIT = 0x20
+ERROR_MASK = 0x0F
+
+PUMP_ERRORS = {
+    0: "Error Free",
+    1: "Initialization error - check blockages",
+    2: "Invalid Command",
+    3: "Invalid Operand",
+    6: "EEPROM Failure",
+    7: "Device Not Initialized",
+    8: "Internal failure",
+    9: "Piston Overload - reinitialize required",
+    11: "Piston movement not allowed",
+    12: "Internal fault",
+    14: "A/D converter failure",
+}
+
+_WAIT_START = 0
+_ADDRESS = 1
+_STATUS = 2
+_DATA = 3
+_DONE = 4
+
+
+def error_text(code):
+    return PUMP_ERRORS.get(code, "Unknown error {}".format(code))
+
+
+class Frame:
+    """Fields of the last decoded frame. The decoder reuses one instance."""
+
+    def __init__(self, buf):
+        self._buf = buf
+        self.complete = False
+        self.address = 0
+        self.status = 0
+        self.data_start = 0
+        self.data_end = 0
+
+    @property
+    def ready(self):
+        return (self.status & READY_BIT) != 0
+
+    @property
+    def error_code(self):
+        return self.status & ERROR_MASK
+
+    @property
+    def ok(self):
+        return self.complete and self.error_code == 0
+
+    def data(self):
+        """Payload between the status byte and ETX (copied)."""
+        return bytes(self._buf[self.data_start:self.data_end])
+
+
+class FrameDecoder:
+    """Reassembles one answer frame at a time from UART reads.
+
+        dec = FrameDecoder()
+        frame = dec.read(uart, 2000)   # Frame, or None on timeout
+    """
+
+    def __init__(self, size=64, chunk=16):
+        self.buf = bytearray(size)
+        self._chunk = bytearray(chunk)
+        self.n = 0
+        self.frame = Frame(self.buf)
+        self._state = _WAIT_START
+
+    def reset(self):
+        self.n = 0
+        self._state = _WAIT_START
+        self.frame.complete = False
+
+    def feed(self, src, count):
+        """Scan count bytes of src. Returns True once a frame is complete."""
+        buf = self.buf
+        size = len(buf)
+        frame = self.frame
+        state = self._state
+        n = self.n
+        for i in range(count):
+            b = src[i]
+            if n < size:
+                buf[n] = b
+                n += 1
+            if state == _WAIT_START:
+                if b == START:
+                    state = _ADDRESS
+            elif state == _ADDRESS:
+                frame.address = b
+                state = _STATUS
+            elif state == _STATUS:
+                frame.status = b
+                frame.data_start = n
+                state = _DATA
+            elif state == _DATA:
+                if b == ETX:
+                    frame.data_end = n - 1
+                    frame.complete = True
+                    state = _DONE
+            # _DONE: keep trailing CR/LF in the raw buffer only
+        self._state = state
+        self.n = n
+        return frame.complete
+
+    def poll(self, uart):
+        """Read whatever the UART holds without waiting. Returns True once complete."""
+        if not uart.any():
+            return self.frame.complete
+        got = uart.readinto(self._chunk)
+        if got:
+            self.feed(self._chunk, got)
+        return self.frame.complete
+
+    def read(self, uart, timeout_ms=2000, settle_ms=5, abort=None):
+        """Reset, then poll until a frame completes or timeout_ms passes.
+
+        If the trailing LF has not arrived with ETX it waits up to
+        settle_ms for it, so it does not stay in the UART for the next
+        command. abort() is checked every poll; when it returns True the
+        read gives up at once. Returns the reused Frame, or None.
+        """
+        self.reset()
+        start = ticks_ms()
+        while ticks_diff(ticks_ms(), start) < timeout_ms:
+            if abort is not None and abort():
+                return None
+            if self.poll(uart):
+                settled = ticks_ms()
+                while (self.buf[self.n - 1] != LF and self.n < len(self.buf)
+                       and ticks_diff(ticks_ms(), settled) < settle_ms):
+                    sleep_ms(1)
+                    self.poll(uart)
+                return self.frame
+            sleep_ms(1)
+        return None
+
+    def raw(self):
+        """Every byte received for this frame (copied), for logging."""
+        return bytes(self.buf[:self.n])
+
+    def hex(self):
+        return " ".join("{:02X}".format(self.buf[i]) for i in range(self.n))
@@ -0,0 +1,199 @@
+"""RS232 transactions with retries, resynchronization and error rates.
+
+A transaction is one command and its answer frame. Link.transact() first
+drains whatever is waiting in the UART, so a late answer to an earlier
+command is not taken for this one's. An exchange fails when:
+
+  timeout   no byte of an answer arrives
+  garbled   bytes arrive but never make a complete frame
+  rejected  the frame reports Invalid Command or Invalid Operand (codes 2
+            and 3): the command was corrupted on the way and the device
+            did nothing
+
+A failed command is sent again after BACKOFF_MS, doubling each time, up
+to `retries` times, if sending it twice is harmless. Valve commands select
+an absolute position and pump init, query and terminate can be repeated,
+so all of them are idempotent. A pump move is not: it pumps again. When a
+move goes unanswered (and was not rejected), the link queries the pump
+status to resynchronize. A busy pump took the move and the query frame
+is returned. A ready pump without an error never started it, so the move
+is sent again. Moves run for seconds, far longer than the answer timeout,
+so "ready" cannot mean a move that has already finished. If the query
+gets no answer either, the move is not repeated.
+
+A budget_ms caps the whole transaction, resync included: a retry that
+could not finish inside it (backoff plus answer timeout) is not sent. The
+firmware keeps it below the stall monitor's STALL_MS.
+
+Each link keeps the outcome of its last WINDOW exchanges. error_rate() is
+the failed share of them. alarm() reports once when the rate reaches
+ALARM_RATE, and again only after it has dropped below half of that.
+"""
+from time import ticks_ms, ticks_diff, sleep_ms
+
+RETRIES = 3
+BACKOFF_MS = 100
+WINDOW = 64
+ALARM_RATE = 0.2
+TRANSIENT_ERRORS = (2, 3)  # Invalid Command, Invalid Operand
+IDEMPOTENT_PUMP = ("Z", "Q", "T", "?")  # init, query, terminate, report
+
+
+def is_idempotent(command):
+    """True if sending command twice does no more than sending it once."""
+    if not command.startswith("/1"):
+        return True  # valve: absolute port selection and home
+    return command[2:3] in IDEMPOTENT_PUMP
+
+
+class Link:
+    def __init__(self, uart, name, decoder, retries=RETRIES, backoff_ms=BACKOFF_MS,
+                 window=WINDOW, observe=None):
+        self.uart = uart
+        self.name = name
+        self.decoder = decoder
+        self.retries = retries
+        self.backoff_ms = backoff_ms
+        self.observe = observe  # observe(name, sent_ticks, frame, bytes_received) per exchange
+        self._ring = bytearray(window)  # 1 = failed exchange
+        self._pos = 0
+        self._filled = 0
+        self._failed = 0
+        self._alarmed = False
+        self.clear()
+
+    def clear(self):
+        for i in range(len(self._ring)):
+            self._ring[i] = 0
+        self._pos = self._filled = self._failed = 0
+        self._alarmed = False
+        self.exchanges = 0
+        self.failures = {"timeout": 0, "garbled": 0, "rejected": 0}
+        self.retried = 0     # commands sent again
+        self.recovered = 0   # commands that got through after a retry
+        self.resyncs = 0     # status queries after an unanswered move
+        self.gave_up = 0
+        self.flushed = 0     # stale bytes drained before a command
+        self.last_failure = None
+
+    # --- exchanges -----------------------------------------------------------
+    def flush(self):
+        """Drain stale input. Returns the number of bytes dropped."""
+        n = 0
+        while self.uart.any():
+            data = self.uart.read()
+            if not data:
+                break
+            n += len(data)
+        self.flushed += n
+        return n
+
+    def _record(self, failed):
+        ring = self._ring
+        if self._filled == len(ring):
+            self._failed -= ring[self._pos]
+        else:
+            self._filled += 1
+        ring[self._pos] = 1 if failed else 0
+        self._failed += ring[self._pos]
+        self._pos = (self._pos + 1) % len(ring)
+
+    def exchange(self, command, timeout_ms=2000, decoder=None, abort=None):
+        """Send once and read the answer. Returns (frame or None, failure or None)."""
+        decoder = decoder or self.decoder
+        self.flush()
+        sent = ticks_ms()
+        self.uart.write(command + "\r")
+        frame = decoder.read(self.uart, timeout_ms, abort=abort)
+        if self.observe:
+            self.observe(self.name, sent, frame, decoder.n)
+        if abort is not None and abort():
+            return frame, None  # stopped: neither a success nor a line fault
+        if frame is None:
+            failure = "garbled" if decoder.n else "timeout"
+        elif frame.error_code in TRANSIENT_ERRORS:
+            failure = "rejected"
+        else:
+            failure = None
+        self.exchanges += 1
+        self._record(failure is not None)
+        if failure:
+            self.failures[failure] += 1
+            self.last_failure = "{} after {}".format(failure, command)
+        return frame, failure
+
+    def transact(self, command, timeout_ms=2000, decoder=None, abort=None, sleep=None, retries=None,
+                 budget_ms=None):
+        """Exchange with retries and resync. Returns the answer frame, or None.
+
+        sleep(seconds) waits between attempts (default: sleep_ms); it may
+        raise to cut the retries short. retries overrides the link's count.
+        budget_ms bounds the total time spent. A rejected frame is returned
+        if the retries run out on it, so the caller sees the error code.
+        """
+        idempotent = is_idempotent(command)
+        delay = self.backoff_ms
+        frame = None
+        start = ticks_ms()
+        for attempt in range((self.retries if retries is None else retries) + 1):
+            if attempt:
+                if budget_ms is not None and ticks_diff(ticks_ms(), start) + delay + timeout_ms > budget_ms:
+                    print("RS232 {}: {} - no time left to send {} again".format(
+                        self.name, self.last_failure, command))
+                    break
+                print("RS232 {}: {} - sending {} again in {} ms".format(
+                    self.name, self.last_failure, command, delay))
+                if sleep:
+                    sleep(delay / 1000)
+                else:
+                    sleep_ms(delay)
+                delay *= 2
+                self.retried += 1
+            frame, failure = self.exchange(command, timeout_ms, decoder, abort)
+            if failure is None:
+                if attempt and frame is not None:
+                    self.recovered += 1
+                return frame
+            if not idempotent and failure != "rejected":
+                # The move may be running: ask before sending it again
+                self.resyncs += 1
+                left = None if budget_ms is None else budget_ms - ticks_diff(ticks_ms(), start)
+                if left is not None and left < 1000:
+                    print("RS232 {}: no time left to ask about an unanswered {}".format(self.name, command))
+                    self.gave_up += 1
+                    return None
+                status = self.transact("/{}QR".format(command[1]), 1000, decoder, abort, sleep, retries, left)
+                if status is None:
+                    print("RS232 {}: no status after an unanswered {}, not repeating it".format(self.name, command))
+                    self.gave_up += 1
+                    return None
+                if not status.ready or status.error_code:
+                    return status  # taken (busy), or failed with an error the caller must see
+        self.gave_up += 1
+        return frame if frame is not None and frame.complete else None
+
+    # --- error rate ----------------------------------------------------------
+    def error_rate(self):
+        return self._failed / self._filled if self._filled else 0.0
+
+    def alarm(self):
+        """True once each time the rolling error rate reaches ALARM_RATE."""
+        rate = self.error_rate()
+        if not self._alarmed and self._filled >= len(self._ring) // 4 and rate >= ALARM_RATE:
+            self._alarmed = True
+            return True
+        if self._alarmed and rate < ALARM_RATE / 2:
+            self._alarmed = False
+        return False
+
+    def lines(self):
+        f = self.failures
+        return [
+            "{}: {:.1f}% errors over the last {} exchanges ({} in total)".format(
+                self.name, 100 * self.error_rate(), self._filled, self.exchanges),
+            "{}: {} timeouts, {} garbled, {} rejected; {} resent, {} recovered, {} resyncs, {} given up".format(
+                self.name, f["timeout"], f["garbled"], f["rejected"], self.retried, self.recovered,
+                self.resyncs, self.gave_up),
+            "{}: {} stale bytes flushed{}".format(
+                self.name, self.flushed, "" if self.last_failure is None else ", last: " + self.last_failure),
+        ]
@@ -0,0 +1,157 @@
+"""Valve port to sample id mapping, and a per-sample run ledger.
+
+samples.txt (optional) configures the mapping, one "port=sample id" per line:
+
+    # port 1 is the rinse line
+    ml_per_cycle=5.0
+    2=smp 1
+    3=smp 2
+
+Without it, port p is "smp {p-1}" for ports 2..DEFAULT_LAST_PORT. Valve
+commands are accepted in both spellings, /2O05R and /205R.
+"""
+from checkpoint import atomic_write
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+SAMPLES_FILE = "samples.txt"
+LEDGER_FILE = "sample_ledger.json"
+UNKNOWN_SAMPLE = "N/A"
+DEFAULT_LAST_PORT = 16
+DEFAULT_ML_PER_CYCLE = 5.0  # one /1J0S15A0A7640... stroke, estimated
+
+
+def port_from_command(cmd):
+    """Valve port selected by a /2O<nn>R or /2<nn>R command, or None."""
+    cmd = cmd.strip()
+    if len(cmd) < 4 or not cmd.startswith("/2") or cmd[-1] != "R":
+        return None
+    body = cmd[2:-1]
+    if body[:1] in ("O", "o"):
+        body = body[1:]
+    if not body.isdigit():
+        return None
+    return int(body)
+
+
+class SampleRegistry:
+    """Loaded once at boot. sample_for() is a dict lookup after the first call per command."""
+
+    def __init__(self, ports=None, ml_per_cycle=DEFAULT_ML_PER_CYCLE):
+        if ports is None:
+            ports = {p: "smp {}".format(p - 1) for p in range(2, DEFAULT_LAST_PORT + 1)}
+        self.ports = ports
+        self.ml_per_cycle = ml_per_cycle
+        self._by_command = {}
+
+    @classmethod
+    def load(cls, path=SAMPLES_FILE):
+        try:
+            f = open(path, "r")
+        except OSError:
+            return cls()
+        ports = {}
+        ml_per_cycle = DEFAULT_ML_PER_CYCLE
+        with f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line[0] == "#":
+                    continue
+                key, sep, value = line.partition("=")
+                try:
+                    if not sep:
+                        raise ValueError("expected key=value")
+                    key = key.strip()
+                    if key == "ml_per_cycle":
+                        ml_per_cycle = float(value)
+                    else:
+                        ports[int(key)] = value.strip()
+                except ValueError as e:
+                    print("Skipping invalid line {} in {}: {} ({})".format(line_no, path, line, e))
+        return cls(ports or None, ml_per_cycle)
+
+    def sample_for(self, cmd):
+        sample = self._by_command.get(cmd)
+        if sample is None:
+            sample = self.ports.get(port_from_command(cmd), UNKNOWN_SAMPLE)
+            self._by_command[cmd] = sample
+        return sample
+
+    def port_for(self, sample):
+        for port, name in self.ports.items():
+            if name == sample:
+                return port
+        return None
+
+
+class SampleLedger:
+    """Cumulative counters per sample, persisted to LEDGER_FILE.
+
+    Each record is {"runs", "cycles", "ml", "first", "last", "fail"};
+    first/last are the timestamps of the first and latest run start.
+    """
+
+    def __init__(self, ml_per_cycle=DEFAULT_ML_PER_CYCLE, path=LEDGER_FILE):
+        self.path = path
+        self.ml_per_cycle = ml_per_cycle
+        self.records = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.records = json.loads(f.read())
+        except (OSError, ValueError):
+            self.records = {}
+        return self
+
+    def save(self):
+        try:
+            atomic_write(self.path, json.dumps(self.records))
+        except OSError as e:
+            print("Failed to save sample ledger: {}".format(e))
+
+    def _record(self, sample):
+        rec = self.records.get(sample)
+        if rec is None:
+            rec = {"runs": 0, "cycles": 0, "ml": 0.0, "first": None, "last": None, "fail": 0}
+            self.records[sample] = rec
+        return rec
+
+    def start(self, sample, timestamp):
+        rec = self._record(sample)
+        rec["runs"] += 1
+        if rec["first"] is None:
+            rec["first"] = timestamp
+        rec["last"] = timestamp
+        self.save()
+
+    def cycle(self, sample):
+        rec = self._record(sample)
+        rec["cycles"] += 1
+        rec["ml"] = round(rec["ml"] + self.ml_per_cycle, 2)
+        self.save()
+
+    def fail(self, sample):
+        self._record(sample)["fail"] += 1
+        self.save()
+
+    def clear(self):
+        self.records = {}
+        self.save()
+
+    def lines(self, registry, sample=None):
+        """One text line per sample (or just the given one), in port order."""
+        names = [sample] if sample is not None else sorted(
+            self.records, key=lambda s: (registry.port_for(s) or 0, s))
+        out = []
+        for name in names:
+            rec = self.records.get(name)
+            if rec is None:
+                continue
+            out.append("{} port {}: runs {} cycles {} ~{:.1f} ml fail {} first {} last {}".format(
+                name, registry.port_for(name), rec["runs"], rec["cycles"], rec["ml"],
+                rec["fail"], rec["first"], rec["last"]))
+        return out
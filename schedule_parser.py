@@ -0,0 +1,116 @@
+"""The one schedule line parser, shared by the BLE, file and Wi-Fi ingest paths.
+
+Lines look like "/2O05R at 2025-10-19 08:20:00". Input is consumed one line
+at a time from any iterable (an open file, a list of received BLE lines),
+and entries go straight into the scheduler's storage format:
+
+    {"command": "/2O05R", "startTime": (2025, 10, 19, 8, 20, 0)}
+"""
+
+
+def parse_line(line):
+    """Parse one schedule line into (command, (y, m, d, h, mi, s)).
+
+    Raises ValueError with a short reason for anything that is not a valid
+    entry. Seconds default to 0; stray characters in the timestamp are
+    ignored, as the console and hand-edited files sometimes add them.
+    """
+    at = line.find(" at ")
+    if at < 0:
+        raise ValueError("missing ' at '")
+    cmd = line[:at].strip()
+    if not cmd or cmd[0] != "/" or cmd[-1] != "R":
+        raise ValueError("invalid command " + repr(cmd))
+    return cmd, parse_time(line[at + 4:])
+
+
+def parse_time(ts):
+    """Parse 'YYYY-MM-DD HH:MM[:SS]' into (y, m, d, h, mi, s); ValueError if invalid."""
+    ts = ts.strip()
+    n = len(ts)
+    if ((n == 19 or n == 16) and ts[4] == "-" and ts[7] == "-" and ts[10] == " "
+            and ts[13] == ":" and (n == 16 or ts[16] == ":")):
+        # Fast path: fixed-width YYYY-MM-DD HH:MM[:SS]
+        y = int(ts[0:4])
+        m = int(ts[5:7])
+        d = int(ts[8:10])
+        h = int(ts[11:13])
+        mi = int(ts[14:16])
+        s = int(ts[17:19]) if n == 19 else 0
+    else:
+        clean = "".join(c for c in ts if c.isdigit() or c in " -:")
+        date_part, _, time_part = clean.strip().partition(" ")
+        dparts = date_part.split("-")
+        if len(dparts) < 3:
+            raise ValueError("invalid date " + repr(ts))
+        y, m, d = int(dparts[0]), int(dparts[1]), int(dparts[2])
+        tparts = time_part.strip().split(":") if time_part.strip() else ()
+        h = int(tparts[0]) if len(tparts) > 0 else 0
+        mi = int(tparts[1]) if len(tparts) > 1 else 0
+        s = int(tparts[2]) if len(tparts) > 2 else 0
+    if not (1 <= m <= 12 and 1 <= d <= 31 and 0 <= h <= 23 and 0 <= mi <= 59 and 0 <= s <= 59):
+        raise ValueError("date/time out of range " + repr(ts))
+    return (y, m, d, h, mi, s)
+
+
+class ScheduleBuilder:
+    """Accumulates parsed entries in scheduler format.
+
+    Tracks whether input arrived in time order so finish() only sorts
+    when it has to. max_entries bounds memory; add() raises ValueError
+    once it is reached, which parse_stream() reports as a reject.
+    """
+
+    def __init__(self, max_entries=None):
+        self.entries = []
+        self.max_entries = max_entries
+        self._in_order = True
+        self._last = None
+
+    def add(self, command, dt):
+        if self.max_entries is not None and len(self.entries) >= self.max_entries:
+            raise ValueError("entry limit {} reached".format(self.max_entries))
+        if self._last is not None and dt < self._last:
+            self._in_order = False
+        self._last = dt
+        self.entries.append({"command": command, "startTime": dt})
+
+    def finish(self):
+        if not self._in_order:
+            self.entries.sort(key=lambda e: e["startTime"])
+            self._in_order = True
+        return self.entries
+
+
+def parse_stream(lines, sink, on_reject=None, start=1):
+    """Parse lines one at a time and pass each entry to sink(command, dt).
+
+    Blank lines and '#' comments are skipped. A line is rejected when it
+    does not parse or sink raises ValueError; on_reject(line_no, line,
+    reason) is called for it. Line numbers count from start.
+    Returns (accepted, rejected).
+    """
+    accepted = 0
+    rejected = 0
+    line_no = start - 1
+    for raw in lines:
+        line_no += 1
+        line = raw.strip()
+        if not line or line[0] == "#":
+            continue
+        try:
+            command, dt = parse_line(line)
+            sink(command, dt)
+        except ValueError as e:
+            rejected += 1
+            if on_reject:
+                on_reject(line_no, line, str(e))
+            continue
+        accepted += 1
+    return accepted, rejected
+
+
+def format_entry(entry):
+    """Inverse of parse_line for an entry dict."""
+    y, m, d, h, mi, s = entry["startTime"]
+    return "{} at {:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(entry["command"], y, m, d, h, mi, s)
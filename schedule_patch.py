@@ -0,0 +1,253 @@
+"""Schedule patches: edit single entries without re-uploading the schedule.
+
+The stored schedule is schedule.txt plus a journal of the patches applied
+since it was last written (SCHEDULE_PATCH_FILE). A patch is appended to
+the journal instead of rewriting schedule.txt; after COMPACT_AFTER patches
+the two are merged back into schedule.txt.
+
+A schedule is identified by schedule_hash(): 32-bit FNV-1a over its
+entries in time order, each formatted with format_entry() and followed by
+"\n". The console computes the same value. Every patch names the hash it
+expects to apply to, so an edit based on a stale copy is refused instead
+of landing on the wrong entry.
+
+Patch text (after the BLE "PATCH:" prefix):
+
+    <base hash, 8 hex digits> <op>[; <op>...]
+
+    INS <command> at <YYYY-MM-DD HH:MM:SS>     add an entry
+    DEL #<index> | DEL @<YYYY-MM-DD HH:MM:SS>   remove an entry
+    REP #<index> | REP @<time>  <command> at <time>   replace an entry
+
+Indexes count from 0 in the stored schedule and refer to the schedule as
+left by the previous op. @<time> picks the first entry starting then.
+Entries are kept in time order; an entry added at a time already in use
+goes after the existing ones. Ops are applied to a copy, so a patch that
+fails part way changes nothing.
+
+Journal lines are "BASE <hash>" (the hash of schedule.txt it applies to)
+followed by "<hash after> <ops>" per patch. On load, a journal for a
+different schedule.txt is ignored, and replay stops at the first line
+whose result does not match its hash (a write cut short by a reset).
+"""
+import os
+
+from checkpoint import atomic_write_lines, count_written
+from schedule_parser import parse_line, parse_time, parse_stream, ScheduleBuilder, format_entry
+
+SCHEDULE_FILE = "schedule.txt"
+SCHEDULE_PATCH_FILE = "schedule.patch"
+COMPACT_AFTER = 20  # patches kept in the journal before schedule.txt is rewritten
+
+FNV_OFFSET = 0x811C9DC5
+FNV_PRIME = 0x01000193
+
+
+class PatchError(ValueError):
+    pass
+
+
+class HashMismatch(PatchError):
+    def __init__(self, expected, actual):
+        PatchError.__init__(self, "base hash {:08x} does not match {:08x}".format(expected, actual))
+        self.expected = expected
+        self.actual = actual
+
+
+def fnv1a(data, h=FNV_OFFSET):
+    for b in data:
+        h = ((h ^ b) * FNV_PRIME) & 0xFFFFFFFF
+    return h
+
+
+def schedule_hash(entries):
+    """FNV-1a of the entries' format_entry() lines, each ending in a newline."""
+    h = FNV_OFFSET
+    for entry in entries:
+        h = fnv1a((format_entry(entry) + "\n").encode(), h)
+    return h
+
+
+def _insert(entries, entry):
+    """Insert in time order, after entries with the same start time."""
+    t = entry["startTime"]
+    lo, hi = 0, len(entries)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if entries[mid]["startTime"] <= t:
+            lo = mid + 1
+        else:
+            hi = mid
+    entries.insert(lo, entry)
+
+
+def _target(entries, text):
+    """Resolve '#<index>' or '@<time>' to (index, rest of text)."""
+    if text.startswith("#"):
+        num, _, rest = text[1:].partition(" ")
+        try:
+            i = int(num)
+        except ValueError:
+            raise PatchError("bad index " + repr(num))
+        if not 0 <= i < len(entries):
+            raise PatchError("index {} out of range (0-{})".format(i, len(entries) - 1))
+        return i, rest.strip()
+    if text.startswith("@"):
+        try:
+            t = parse_time(text[1:20])
+        except ValueError as e:
+            raise PatchError(str(e))
+        for i, entry in enumerate(entries):
+            if entry["startTime"] == t:
+                return i, text[20:].strip()
+        raise PatchError("no entry at " + text[1:20])
+    raise PatchError("expected #<index> or @<time>, got " + repr(text))
+
+
+def _entry(text):
+    try:
+        command, dt = parse_line(text)
+    except ValueError as e:
+        raise PatchError(str(e))
+    return {"command": command, "startTime": dt}
+
+
+def apply_ops(entries, ops, max_entries=None):
+    """Return a new entry list with ops (the text after the base hash) applied."""
+    out = list(entries)
+    for op in ops.split(";"):
+        op = op.strip()
+        if not op:
+            continue
+        verb, _, arg = op.partition(" ")
+        arg = arg.strip()
+        if verb == "INS":
+            if max_entries is not None and len(out) >= max_entries:
+                raise PatchError("entry limit {} reached".format(max_entries))
+            _insert(out, _entry(arg))
+        elif verb == "DEL":
+            i, rest = _target(out, arg)
+            if rest:
+                raise PatchError("unexpected " + repr(rest))
+            out.pop(i)
+        elif verb == "REP":
+            i, rest = _target(out, arg)
+            entry = _entry(rest)
+            out.pop(i)
+            _insert(out, entry)
+        else:
+            raise PatchError("unknown op " + repr(verb))
+    return out
+
+
+class ScheduleStore:
+    """schedule.txt plus its patch journal, as the entry list they describe."""
+
+    def __init__(self, path=SCHEDULE_FILE, journal_path=SCHEDULE_PATCH_FILE,
+                 max_entries=None, compact_after=COMPACT_AFTER):
+        self.path = path
+        self.journal_path = journal_path
+        self.max_entries = max_entries
+        self.compact_after = compact_after
+        self.entries = []
+        self.hash = schedule_hash(())
+        self.patches = 0  # journal lines after BASE
+        self.exists = False  # schedule.txt is on flash
+
+    def load(self, on_reject=None):
+        """Read schedule.txt and replay the journal. Returns the entries, or None if there is no file."""
+        builder = ScheduleBuilder(self.max_entries)
+        try:
+            with open(self.path, "r") as f:
+                parse_stream(f, builder.add, on_reject)
+        except OSError:
+            self.entries = []
+            self.hash = schedule_hash(())
+            self.patches = 0
+            self.exists = False
+            return None
+        self.exists = True
+        self.entries = builder.finish()
+        self.hash = schedule_hash(self.entries)
+        self.patches = 0
+        self._replay()
+        return self.entries
+
+    def _replay(self):
+        try:
+            f = open(self.journal_path, "r")
+        except OSError:
+            return
+        with f:
+            first = f.readline().split()
+            if len(first) != 2 or first[0] != "BASE" or first[1] != "{:08x}".format(self.hash):
+                print("Ignoring {}: it belongs to another {}".format(self.journal_path, self.path))
+                return
+            complete = True
+            for line in f:
+                expected, _, ops = line.strip().partition(" ")
+                try:
+                    entries = apply_ops(self.entries, ops, self.max_entries)
+                    ok = schedule_hash(entries) == int(expected, 16)
+                except ValueError:
+                    ok = False
+                if not ok:
+                    print("Stopped replaying {} at an incomplete patch".format(self.journal_path))
+                    complete = False
+                    break
+                self.entries = entries
+                self.hash = int(expected, 16)
+                self.patches += 1
+        if not complete:
+            # Later patches must not be appended after the broken line
+            self._compact()
+
+    def copy(self):
+        """The entries as a list the scheduler may pop from and edit."""
+        return [dict(entry) for entry in self.entries]
+
+    def replace(self, entries):
+        """Persist a whole new entry list (an upload): rewrite schedule.txt, drop the journal."""
+        self.entries = entries
+        self.hash = schedule_hash(entries)
+        self._compact()
+
+    def _compact(self):
+        """Write the current entries to schedule.txt and start with an empty journal."""
+        atomic_write_lines(self.path, [format_entry(entry) for entry in self.entries])
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+        self.patches = 0
+        self.exists = True
+
+    def patch(self, text):
+        """Apply 'PATCH:' text. Returns the new entries; raises PatchError or HashMismatch."""
+        base, _, ops = text.strip().partition(" ")
+        try:
+            expected = int(base, 16)
+        except ValueError:
+            raise PatchError("bad base hash " + repr(base))
+        if expected != self.hash:
+            raise HashMismatch(expected, self.hash)
+        ops = ops.strip()
+        if not ops:
+            raise PatchError("no ops")
+        entries = apply_ops(self.entries, ops, self.max_entries)
+        new_hash = schedule_hash(entries)
+        if not self.exists or self.patches + 1 >= self.compact_after:
+            self.entries = entries
+            self.hash = new_hash
+            self._compact()
+            return entries
+        if self.patches == 0:
+            atomic_write_lines(self.journal_path, ["BASE {:08x}".format(self.hash)])
+        line = "{:08x} {}\n".format(new_hash, ops)
+        with open(self.journal_path, "a") as f:
+            f.write(line)
+        count_written(len(line))
+        self.patches += 1
+        self.entries = entries
+        self.hash = new_hash
+        return entries
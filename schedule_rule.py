@@ -0,0 +1,149 @@
+"""Compact recurrence rule that stands in for an explicit schedule list.
+
+A rule is start time, interval, an ordered list of valve ports and a
+repeat count. Entries are computed on demand, so a campaign of any length
+costs the same few bytes of RAM as a single entry.
+
+Text form (BLE RULE: command and schedule_rule.txt):
+
+    YYYYMMDDHHMMSS,<interval seconds>,<ports>,<repeat>
+
+ports is a ';' separated list of ports or ranges, e.g. "2-16" or "2;5;9-12".
+"""
+from timeutil import to_epoch, from_epoch, parse_compact, format_compact
+
+RULE_FILE = "schedule_rule.txt"
+MAX_PORT = 16
+
+
+def port_command(port):
+    """Valve command for a port, in the /2Onn R form the console generates."""
+    return "/2O{:02d}R".format(port)
+
+
+def parse_ports(text):
+    ports = []
+    for part in text.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            lo, hi = int(lo), int(hi)
+            step = 1 if hi >= lo else -1
+            ports.extend(range(lo, hi + step, step))
+        else:
+            ports.append(int(part))
+    if not ports:
+        raise ValueError("empty port list")
+    for p in ports:
+        if not 1 <= p <= MAX_PORT:
+            raise ValueError("port {} out of range".format(p))
+    return ports
+
+
+def format_ports(ports):
+    """Inverse of parse_ports, collapsing ascending runs into ranges."""
+    out = []
+    i = 0
+    while i < len(ports):
+        j = i
+        while j + 1 < len(ports) and ports[j + 1] == ports[j] + 1:
+            j += 1
+        out.append(str(ports[i]) if i == j else "{}-{}".format(ports[i], ports[j]))
+        i = j + 1
+    return ";".join(out)
+
+
+class ScheduleRule:
+    """Sequence-like view of the entries a rule expands to.
+
+    Supports len(), indexing (including negative), iteration and pop(0),
+    which is what the scheduler does with a plain list of entries.
+    Entries are dicts with "command" and "startTime" like load_schedule().
+    """
+
+    def __init__(self, start, interval_s, ports, repeat):
+        if interval_s <= 0:
+            raise ValueError("interval must be positive")
+        if repeat <= 0:
+            raise ValueError("repeat must be positive")
+        self.start = tuple(start)
+        self.start_epoch = to_epoch(start)
+        self.interval_s = int(interval_s)
+        self.ports = list(ports)
+        self.repeat = int(repeat)
+        self.total = len(self.ports) * self.repeat
+        self.first = 0  # entries before this have been consumed (pop(0))
+
+    @classmethod
+    def parse(cls, text):
+        fields = text.strip().split(",")
+        if len(fields) != 4:
+            raise ValueError("expected start,interval,ports,repeat")
+        return cls(parse_compact(fields[0]), int(fields[1]), parse_ports(fields[2]), int(fields[3]))
+
+    def to_text(self):
+        return "{},{},{},{}".format(format_compact(self.start), self.interval_s,
+                                    format_ports(self.ports), self.repeat)
+
+    def entry(self, k):
+        """Entry k of the whole campaign (ignores pops)."""
+        return {
+            "command": port_command(self.ports[k % len(self.ports)]),
+            "startTime": from_epoch(self.start_epoch + k * self.interval_s),
+        }
+
+    def entries(self, start=0, count=None):
+        """Generate entries from position start of the remaining schedule."""
+        k = self.first + start
+        end = self.total if count is None else min(self.total, k + count)
+        while k < end:
+            yield self.entry(k)
+            k += 1
+
+    def index_at(self, epoch):
+        """Position (in the remaining schedule) of the first entry starting at or after epoch."""
+        if epoch <= self.start_epoch:
+            k = 0
+        else:
+            k = (epoch - self.start_epoch + self.interval_s - 1) // self.interval_s
+        return max(0, min(k, self.total) - self.first)
+
+    def __len__(self):
+        return self.total - self.first
+
+    def __bool__(self):
+        return self.total > self.first
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("schedule index out of range")
+        return self.entry(self.first + i)
+
+    def __iter__(self):
+        return self.entries()
+
+    def pop(self, i=-1):
+        if i != 0:
+            raise ValueError("only pop(0) is supported on a rule schedule")
+        entry = self[0]
+        self.first += 1
+        return entry
+
+
+def load_rule(path=RULE_FILE):
+    """Return the saved ScheduleRule, or None if there is none (or it is invalid)."""
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+    except OSError:
+        return None
+    try:
+        return ScheduleRule.parse(text)
+    except (ValueError, IndexError) as e:
+        print("Ignoring invalid schedule rule: {}".format(e))
+        return None
@@ -0,0 +1,267 @@
+"""Append-only text logs stored as size-capped segments.
+
+A log named "ME" lives in LOG_DIR as
+
+    ME-<base>-<start>.log
+
+where base is the byte offset of the segment's first line in the log as a
+whole and start is the epoch second (timeutil) of its first line. Offsets
+keep counting across segments, so a reader's position (the GETLOG cursor)
+stays valid when old segments are dropped. A segment ends where the next
+one starts, so a time range only opens the segments that overlap it.
+
+append() only ever opens the newest segment. Once it reaches
+segment_bytes, the next line starts a new segment. At that point the
+retention policy runs: the oldest segments go while the log is over
+max_bytes in total, or while a segment ended more than max_age_days ago.
+A segment is compacted before it is deleted. Its lines are counted per
+day, and per key(line) if a key function is given, into DAYS_SUFFIX
+(JSON, at most MAX_DAYS days). Lines are expected to start with
+"YYYY-MM-DD HH:MM:SS".
+"""
+import os
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from checkpoint import atomic_write, count_written
+from timeutil import to_epoch
+
+LOG_DIR = "logs"
+DAYS_SUFFIX = "-days.json"
+SEGMENT_BYTES = 16 * 1024
+MAX_BYTES = 128 * 1024
+MAX_AGE_DAYS = 180
+MAX_DAYS = 730
+
+
+def line_epoch(text):
+    """Epoch seconds of a line's leading 'YYYY-MM-DD HH:MM:SS', or None."""
+    try:
+        return to_epoch((text[0:4], text[5:7], text[8:10], text[11:13], text[14:16], text[17:19]))
+    except (ValueError, IndexError):
+        return None
+
+
+class SegmentLog:
+    def __init__(self, name, now, key=None, directory=LOG_DIR, segment_bytes=SEGMENT_BYTES,
+                 max_bytes=MAX_BYTES, max_age_days=MAX_AGE_DAYS):
+        self.name = name
+        self.now = now  # returns epoch seconds
+        self.key = key
+        self.dir = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_days * 86400
+        self.segments = []  # [base, start, size], oldest first
+        self.compacted = 0  # segments folded into day summaries since boot
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass  # already there
+        self._scan()
+
+    # --- files ---------------------------------------------------------------
+    def _path(self, seg):
+        return "{}/{}-{:010d}-{:010d}.log".format(self.dir, self.name, seg[0], seg[1])
+
+    def _days_path(self):
+        return "{}/{}{}".format(self.dir, self.name, DAYS_SUFFIX)
+
+    def _scan(self):
+        prefix = self.name + "-"
+        segments = []
+        for fname in os.listdir(self.dir):
+            if not fname.startswith(prefix) or not fname.endswith(".log"):
+                continue
+            parts = fname[len(prefix):-4].split("-")
+            try:
+                base, start = int(parts[0]), int(parts[1])
+            except (ValueError, IndexError):
+                continue
+            size = os.stat("{}/{}".format(self.dir, fname))[6]
+            segments.append([base, start, size])
+        segments.sort()
+        self.segments = segments
+
+    def adopt(self, path):
+        """Turn an unsegmented log file into this log's first segment (once, when it has none)."""
+        if self.segments:
+            return False
+        try:
+            size = os.stat(path)[6]
+            with open(path, "r") as f:
+                start = line_epoch(f.readline())
+        except OSError:
+            return False
+        seg = [0, self.now() if start is None else start, size]
+        os.rename(path, self._path(seg))
+        self.segments.append(seg)
+        return True
+
+    # --- writing -------------------------------------------------------------
+    def append(self, line):
+        """Append one line (a newline is added if missing)."""
+        if not line.endswith("\n"):
+            line += "\n"
+        if not self.segments or self.segments[-1][2] >= self.segment_bytes:
+            self._rotate(line)
+        seg = self.segments[-1]
+        with open(self._path(seg), "a") as f:
+            f.write(line)
+        n = len(line.encode())
+        seg[2] += n
+        count_written(n)
+
+    def _rotate(self, line):
+        last = self.segments[-1] if self.segments else None
+        start = line_epoch(line)
+        seg = [last[0] + last[2] if last else 0, self.now() if start is None else start, 0]
+        if last and seg[1] < last[1]:
+            seg[1] = last[1]  # keep start times in order if the clock was set back
+        self.segments.append(seg)
+        self._retain()
+
+    def _retain(self):
+        """Drop (after compacting) the oldest closed segments that break the policy."""
+        now = self.now()
+        while len(self.segments) > 1:
+            total = sum(seg[2] for seg in self.segments)
+            oldest = self.segments[0]
+            ended = self.segments[1][1]
+            if total <= self.max_bytes and now - ended <= self.max_age_s:
+                break
+            self._compact(oldest)
+            try:
+                os.remove(self._path(oldest))
+            except OSError:
+                pass
+            self.segments.pop(0)
+            self.compacted += 1
+
+    def _compact(self, seg):
+        days = self.days()
+        try:
+            f = open(self._path(seg), "r")
+        except OSError:
+            return
+        with f:
+            for line in f:
+                day = line[:10]
+                if line_epoch(line) is None:
+                    continue
+                rec = days.get(day)
+                if rec is None:
+                    rec = days[day] = {"n": 0, "first": line[11:19], "last": line[11:19], "keys": {}}
+                rec["n"] += 1
+                rec["first"] = min(rec["first"], line[11:19])
+                rec["last"] = max(rec["last"], line[11:19])
+                if self.key:
+                    k = self.key(line)
+                    if k:
+                        rec["keys"][k] = rec["keys"].get(k, 0) + 1
+        for day in sorted(days)[:-MAX_DAYS]:
+            del days[day]
+        try:
+            atomic_write(self._days_path(), json.dumps(days))
+        except OSError as e:
+            print("Failed to save log summary: {}".format(e))
+
+    def clear(self):
+        """Delete every segment and the day summaries; offsets start again at 0."""
+        for seg in self.segments:
+            try:
+                os.remove(self._path(seg))
+            except OSError:
+                pass
+        self.segments = []
+        try:
+            os.remove(self._days_path())
+        except OSError:
+            pass
+
+    # --- reading -------------------------------------------------------------
+    def start_offset(self):
+        return self.segments[0][0] if self.segments else 0
+
+    def end_offset(self):
+        return self.segments[-1][0] + self.segments[-1][2] if self.segments else 0
+
+    def size(self):
+        return sum(seg[2] for seg in self.segments)
+
+    def is_line_start(self, offset):
+        """True if offset is where a line of a segment still on flash begins."""
+        for seg in self.segments:
+            if offset == seg[0] or offset == seg[0] + seg[2]:
+                return True
+            if seg[0] < offset < seg[0] + seg[2]:
+                with open(self._path(seg), "rb") as f:
+                    f.seek(offset - seg[0] - 1)
+                    return f.read(1) == b"\n"
+        return False
+
+    def read_from(self, offset):
+        """Yield (line bytes, offset after it) for every complete line from offset on."""
+        for seg in self.segments:
+            end = seg[0] + seg[2]
+            if end <= offset:
+                continue
+            try:
+                f = open(self._path(seg), "rb")
+            except OSError:
+                continue
+            with f:
+                pos = max(offset, seg[0])
+                f.seek(pos - seg[0])
+                while True:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    pos += len(line)
+                    yield line, pos
+
+    def lines_between(self, since=None, until=None):
+        """Yield lines (str) whose time is in [since, until) epoch seconds.
+
+        Segments that end before since or start at or after until are not opened.
+        """
+        for i, seg in enumerate(self.segments):
+            if until is not None and seg[1] >= until:
+                break
+            if since is not None and i + 1 < len(self.segments) and self.segments[i + 1][1] < since:
+                continue
+            try:
+                f = open(self._path(seg), "r")
+            except OSError:
+                continue
+            with f:
+                for line in f:
+                    t = line_epoch(line)
+                    if t is None or (since is not None and t < since) or (until is not None and t >= until):
+                        continue
+                    yield line.rstrip("\n")
+
+    def days(self):
+        """Per-day summaries of compacted segments: {day: {n, first, last, keys}}."""
+        try:
+            with open(self._days_path(), "r") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def lines(self):
+        """Status report."""
+        if not self.segments:
+            return ["{}: empty".format(self.name)]
+        days = self.days()
+        return [
+            "{}: {} segments, {} bytes (cap {}), offsets {}-{}".format(
+                self.name, len(self.segments), self.size(), self.max_bytes,
+                self.start_offset(), self.end_offset()),
+            "{}: segments of {} bytes, kept up to {} days; {} days summarized{}".format(
+                self.name, self.segment_bytes, self.max_age_s // 86400, len(days),
+                ", from " + min(days) if days else ""),
+        ]
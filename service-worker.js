@@ -4,7 +4,8 @@ self.addEventListener('install', event => {
     caches.open('mkr1010-cache').then(cache => {
       return cache.addAll([
         'index.html',
-        'manifest.json',
+        'manifest.json',
+        'ble-worker.js',
         // Add any other essential assets here
       ]);
     })
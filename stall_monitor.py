@@ -0,0 +1,189 @@
+"""Watchdog-backed progress monitor.
+
+Long-running loops call progress(where). Each call feeds machine.WDT and
+writes the location id to a watchdog scratch register. Those registers
+survive a watchdog reset, so after a hang the next boot knows where the
+firmware stopped without writing flash on every report. Gaps between
+reports go into a log2 histogram, which gives the max and a p99 bound
+without allocating. Gaps of stall_ms or more, callbacks that block that
+long, and watchdog resets are kept in STALL_FILE.
+"""
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+import machine
+from time import ticks_ms, ticks_diff
+
+from checkpoint import atomic_write
+
+STALL_FILE = "stalls.json"
+WDT_TIMEOUT_MS = 8000   # RP2040 maximum is 8388 ms
+STALL_MS = 6000         # longest legitimate gap is a 5 s poll sleep
+MAX_EVENTS = 10
+BUCKETS = 18            # gap histogram: bucket b holds gaps < 2**b ms
+
+# RP2040 watchdog scratch registers 0-3 are free for the application
+_SCRATCH = 0x40058000 + 0x0C
+_MAGIC = 0x57A1
+
+
+def _bucket(ms):
+    b = 0
+    while ms and b < BUCKETS - 1:
+        ms >>= 1
+        b += 1
+    return b
+
+
+class StallMonitor:
+    def __init__(self, locations, now_text=None, path=STALL_FILE,
+                 stall_ms=STALL_MS, wdt_timeout_ms=WDT_TIMEOUT_MS):
+        self.locations = ("other",) + tuple(locations)
+        self._ids = {name: i for i, name in enumerate(self.locations)}
+        self.now_text = now_text
+        self.path = path
+        self.stall_ms = stall_ms
+        self.wdt_timeout_ms = wdt_timeout_ms
+        self.wdt = None
+        self.where = "boot"
+        self.last = ticks_ms()
+        self.hist = [0] * BUCKETS
+        self.reports = 0
+        self.max_gap = 0
+        self.max_where = None
+        self.events = []
+        self.watchdog_resets = 0
+        self._load()
+
+    # --- persistence ---------------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.loads(f.read())
+            self.events = state.get("events", [])
+            self.watchdog_resets = state.get("resets", 0)
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        try:
+            atomic_write(self.path, json.dumps({"events": self.events, "resets": self.watchdog_resets}))
+        except OSError as e:
+            print("Failed to save stall history: {}".format(e))
+
+    def _event(self, kind, where, gap_ms):
+        when = self.now_text() if self.now_text else ""
+        self.events.append([when, kind, where, gap_ms])
+        if len(self.events) > MAX_EVENTS:
+            self.events.pop(0)
+        self._save()
+
+    # --- watchdog ------------------------------------------------------------
+    def _scratch(self, i, value=None):
+        try:
+            if value is None:
+                return machine.mem32[_SCRATCH + 4 * i]
+            machine.mem32[_SCRATCH + 4 * i] = value
+        except (AttributeError, TypeError):
+            return 0
+
+    def check_reset(self):
+        """Call once at boot: log a watchdog reset with the location it hit."""
+        word = self._scratch(0) & 0xFFFFFFFF
+        wdt_reset = machine.reset_cause() == machine.WDT_RESET
+        if wdt_reset and word >> 16 == _MAGIC:
+            loc = word & 0xFFFF
+            where = self.locations[loc] if loc < len(self.locations) else "other"
+            self.watchdog_resets += 1
+            self._event("watchdog reset", where, self._scratch(1))
+            print("⚠️ Watchdog reset while in {} (uptime {} s)".format(where, self._scratch(1) // 1000))
+        self._scratch(0, 0)
+
+    def expect_reset(self):
+        """Call right before an intentional machine.reset() or deepsleep().
+
+        On rp2 both reboot through the watchdog, so reset_cause() reads
+        WDT_RESET; clearing the location keeps check_reset() from logging it.
+        """
+        self._scratch(0, 0)
+
+    def start_watchdog(self):
+        if self.wdt is None:
+            self.wdt = machine.WDT(timeout=self.wdt_timeout_ms)
+        self.progress(self.where)
+
+    @property
+    def max_sleep_ms(self):
+        """Longest single sleep that cannot starve the watchdog."""
+        return self.wdt_timeout_ms - 1500 if self.wdt else None
+
+    # --- progress ------------------------------------------------------------
+    def progress(self, where):
+        now = ticks_ms()
+        if self.last is not None:
+            gap = ticks_diff(now, self.last)
+            self.hist[_bucket(gap)] += 1
+            self.reports += 1
+            if gap > self.max_gap:
+                self.max_gap = gap
+                self.max_where = self.where + ">" + where
+            if gap >= self.stall_ms:
+                self._event("gap", self.where + ">" + where, gap)
+        self.last = now
+        self.mark(where)
+
+    def mark(self, where):
+        """Record the current location and feed the watchdog, without timing a gap."""
+        self.where = where
+        self._scratch(0, (_MAGIC << 16) | self._ids.get(where, 0))
+        self._scratch(1, ticks_ms())
+        if self.wdt:
+            self.wdt.feed()
+
+    def suspend(self):
+        """The next gap is an intentional sleep; do not count it."""
+        self.last = None
+
+    def timed(self, where, start):
+        """A callback that began at start (ticks_ms) has returned."""
+        took = ticks_diff(ticks_ms(), start)
+        if took >= self.stall_ms:
+            self._event("blocked", where, took)
+        return took
+
+    # --- reporting -----------------------------------------------------------
+    def p99_bound(self):
+        """Upper bound (ms) of the 99th percentile gap."""
+        if not self.reports:
+            return 0
+        need = self.reports - self.reports // 100
+        seen = 0
+        for b, count in enumerate(self.hist):
+            seen += count
+            if seen >= need:
+                return min(1 << b, self.max_gap)
+        return self.max_gap
+
+    def clear(self):
+        self.hist = [0] * BUCKETS
+        self.reports = 0
+        self.max_gap = 0
+        self.max_where = None
+        self.events = []
+        self.watchdog_resets = 0
+        self._save()
+
+    def lines(self):
+        out = ["now in {}, watchdog {}".format(
+            self.where, "{} ms".format(self.wdt_timeout_ms) if self.wdt else "off")]
+        out.append("gaps: max {} ms ({}), p99 <= {} ms over {} reports".format(
+            self.max_gap, self.max_where, self.p99_bound(), self.reports))
+        out.append("watchdog resets: {}".format(self.watchdog_resets))
+        for when, kind, where, ms in reversed(self.events):
+            if kind == "watchdog reset":
+                out.append("{} watchdog reset in {} (last report {} s after boot)".format(when, where, ms // 1000))
+            else:
+                out.append("{} {} in {} ({} ms)".format(when, kind, where, ms))
+        return out
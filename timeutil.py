@@ -0,0 +1,64 @@
+"""Calendar-correct conversions between (y, m, d, h, mi, s) tuples and epoch seconds.
+
+Pure integer arithmetic, so results are identical on MicroPython and
+CPython. The epoch is 2000-01-01 00:00:00 (the MicroPython epoch on the
+RP2040) and times are local, as kept in the RTC.
+"""
+
+_DAYS_TO_2000 = 10957  # days from 1970-01-01 to 2000-01-01
+
+
+def _days_from_civil(y, m, d):
+    # Howard Hinnant's algorithm (days since 1970-01-01, proleptic Gregorian)
+    y -= m <= 2
+    era = (y if y >= 0 else y - 399) // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _civil_from_days(z):
+    z += 719468
+    era = (z if z >= 0 else z - 146096) // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    y = yoe + era * 400
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + (3 if mp < 10 else -9)
+    return y + (m <= 2), m, d
+
+
+def to_epoch(dt):
+    """(y, m, d, h, mi, s) -> seconds since 2000-01-01 00:00:00."""
+    y, m, d, h, mi, s = dt[:6]
+    days = _days_from_civil(int(y), int(m), int(d)) - _DAYS_TO_2000
+    return days * 86400 + int(h) * 3600 + int(mi) * 60 + int(s)
+
+
+def from_epoch(sec):
+    """Seconds since 2000-01-01 -> (y, m, d, h, mi, s)."""
+    sec = int(sec)
+    days, rem = divmod(sec, 86400)
+    y, m, d = _civil_from_days(days + _DAYS_TO_2000)
+    h, rem = divmod(rem, 3600)
+    mi, s = divmod(rem, 60)
+    return (y, m, d, h, mi, s)
+
+
+def parse_compact(text):
+    """'YYYYMMDDHHMMSS' -> (y, m, d, h, mi, s); raises ValueError on bad input."""
+    text = text.strip()
+    if len(text) != 14 or not text.isdigit():
+        raise ValueError("expected YYYYMMDDHHMMSS")
+    dt = (int(text[0:4]), int(text[4:6]), int(text[6:8]),
+          int(text[8:10]), int(text[10:12]), int(text[12:14]))
+    if not (1 <= dt[1] <= 12 and 1 <= dt[2] <= 31 and dt[3] <= 23 and dt[4] <= 59 and dt[5] <= 59):
+        raise ValueError("date/time out of range")
+    return dt
+
+
+def format_compact(dt):
+    return "{:04d}{:02d}{:02d}{:02d}{:02d}{:02d}".format(*dt[:6])
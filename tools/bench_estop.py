@@ -0,0 +1,145 @@
+"""Measure emergency-stop latency in every phase of a step (CPython, host side).
+
+    python tools/bench_estop.py [--stride 700] [--command /2O05R]
+
+Runs execute_step() on the simulated pump and valve (tools/hwsim.py) once
+to find its length. It then runs the step again and again, each time
+delivering EMERGENCY_STOP over BLE at a later point, stride ms apart. For
+each stop it records, in firmware time:
+
+  pump     until the pump stops moving (terminate sent or stroke finished)
+  valve    until the valve reset /2wR is sent
+  relay    until relay pin 13 goes high (off)
+  return   until execute_step() returns or raises
+  strokes  pump move commands sent after the stop (must be 0)
+
+Results are grouped by what the firmware was doing when the stop arrived
+(checkpoint stage / stall-monitor location). Times are upper bounds set by
+the simulated UART poll cost and reply delays.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hwsim import Hardware  # noqa: E402
+
+RELAY_PIN = 13
+SETTLE_MS = 8000  # firmware time allowed after the step for timers to fire
+METRICS = ("pump", "valve", "relay", "return")
+
+
+def first_after(events, t, match):
+    for when, data in events:
+        if when >= t and match(data):
+            return when
+    return None
+
+
+def run_step(hw, fw, command, inject_at=None):
+    """Run one step, optionally injecting EMERGENCY_STOP inject_at ms in."""
+    stop_error = getattr(fw, "EmergencyStop", None)
+    fw.emergency_stop = False
+    if hasattr(fw, "stopper"):
+        fw.stopper.clear()
+    for uart in hw.uarts.values():
+        uart.tx.clear()
+        uart._rx.clear()
+    hw.pump.busy_until = hw.clock.ms
+    del hw.pin_log[:]
+    fw.journal.begin_step(0, command, "bench")
+    start = hw.clock.ms
+    seen = {}
+
+    def inject():
+        state = fw.journal.state or {}
+        seen["phase"] = "{}/{}".format(state.get("stage", "-"), fw.monitor.where)
+        seen["at"] = hw.clock.ms
+        seen["pump_busy_until"] = hw.pump.busy_until
+        hw.peripheral.write(b"EMERGENCY_STOP")
+
+    if inject_at is not None:
+        hw.clock.at(start + inject_at, inject)
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            fw.execute_step(command)
+        except Exception as e:
+            if stop_error is None or not isinstance(e, stop_error):
+                raise
+        returned = hw.clock.ms
+        hw.clock.advance(SETTLE_MS)
+    if inject_at is None:
+        return returned - start
+    if "at" not in seen:
+        return None
+
+    t = seen["at"]
+    tx0 = hw.uarts[0].tx
+    tx1 = hw.uarts[1].tx
+    terminate = first_after(tx0, t, lambda d: d.startswith(b"/1T"))
+    moving_until = max(t, seen["pump_busy_until"])
+    if terminate is not None:
+        moving_until = min(moving_until, terminate)
+    valve = first_after(tx1, t, lambda d: d.startswith(b"/2wR"))
+    relay = next((ms for ms, pin, v in hw.pin_log if ms >= t and pin == RELAY_PIN and v == 1), None)
+    return {
+        "phase": seen["phase"],
+        "pump": moving_until - t,
+        "valve": None if valve is None else valve - t,
+        "relay": None if relay is None else relay - t,
+        "return": returned - t,
+        "strokes": sum(1 for ms, d in tx0 if ms > t and (d.startswith(b"/1J") or d.startswith(b"/1Z"))),
+    }
+
+
+def fmt(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return "{:>17}".format("never")
+    return "{:>8.0f} {:>8.0f}".format(statistics.median(values), max(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emergency stop latency per step phase.")
+    parser.add_argument("--command", default="/2O05R", help="valve command for the step")
+    parser.add_argument("--stride", type=int, default=700, help="ms between injection points")
+    args = parser.parse_args()
+
+    hw = Hardware()
+    workdir = tempfile.mkdtemp(prefix="mkr_estop_")
+    with contextlib.redirect_stdout(io.StringIO()):
+        fw = hw.load_firmware(workdir)
+        hw.attach_models()
+    length = run_step(hw, fw, args.command)
+    print("Step {} takes {:.1f} s of firmware time; stopping it every {} ms".format(
+        args.command, length / 1000, args.stride))
+
+    results = []
+    for offset in range(args.stride // 2, int(length), args.stride):
+        r = run_step(hw, fw, args.command, offset)
+        if r:
+            results.append(r)
+
+    phases = {}
+    for r in results:
+        phases.setdefault(r["phase"], []).append(r)
+    header = "{:<28} {:>4}".format("phase", "n") + "".join(
+        " {:>17}".format(m + " med/max ms") for m in METRICS) + " strokes"
+    print(header)
+    print("-" * len(header))
+    for phase, rs in sorted(phases.items(), key=lambda kv: -max(r["return"] for r in kv[1])):
+        print("{:<28} {:>4}".format(phase, len(rs)) + "".join(
+            " " + fmt([r[m] for r in rs]) for m in METRICS) + " {:>7}".format(sum(r["strokes"] for r in rs)))
+    print("-" * len(header))
+    print("{:<28} {:>4}".format("all", len(results)) + "".join(
+        " " + fmt([r[m] for r in results]) for m in METRICS) + " {:>7}".format(sum(r["strokes"] for r in results)))
+    return 1 if any(r["strokes"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""Benchmark the firmware's hot paths against stored baselines (CPython, host side).
+
+    python tools/bench_firmware.py [--only log] [--repeat 5] [--tolerance 0.3] [--update]
+
+Imports main.py on the simulated hardware (tools/hwsim.py) and times:
+
+  ble_dispatch            on_ble_rx() for a mix of status commands
+  parse_schedule_line_N   parse_schedule_line() on N schedule lines
+  load_schedule_N         load_schedule() of an N-line schedule.txt
+  time_conversion         to_epoch/from_epoch, format_time, datetime_to_seconds
+  log_command             log_command() appends, segment rotation included
+  heartbeat               one wait_with_heartbeat() tick that sends a heartbeat
+  wait_for_start          one wait_for_start() polling iteration
+
+Each case runs once to warm up, then --repeat times, and keeps the fastest
+run. Cases on small inputs repeat the work up to MIN_OPS operations per run. Host speed varies,
+so a result is stored as a score: its time per operation divided by the
+time of a fixed pure-Python calibration loop timed in the same run.
+Baselines live in bench_baseline.json next to this script. A case fails when
+its score is more than tolerance (per case, or --tolerance) above the
+baseline. The exit status is 1 if any case failed. --update writes the
+scores of the cases run as the new baselines.
+
+Firmware output (print) is discarded, but its formatting cost is measured.
+Sleeps run on the virtual clock, so they cost nothing.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hwsim import Hardware  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+TOLERANCE = 0.3
+SIZES = (100, 1000, 10000)
+BLE_MIX = (b"RELAY:STATUS", b"CLOCK", b"LINK", b"PUMPGOV", b"STALLS", b"SAMPLES")
+CALIBRATION_LOOPS = 10000
+MIN_OPS = 10000  # small inputs are run several times over so one run is not a few ms of noise
+
+
+class _Discard:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def calibrate():
+    """Seconds per iteration of a fixed mix of formatting, dict and integer work."""
+    best = None
+    for _ in range(3):
+        t0 = time.perf_counter()
+        d = {}
+        for i in range(CALIBRATION_LOOPS):
+            s = "{:04d}-{:02d}-{:02d} {}".format(2025, i % 12 + 1, i % 28 + 1, i)
+            d[s[:7]] = d.get(s[:7], 0) + (i * 7 >> 2)
+        elapsed = (time.perf_counter() - t0) / CALIBRATION_LOOPS
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def schedule_lines(n, start=(2025, 10, 19, 9, 0, 0)):
+    """n schedule lines, 20 minutes apart, as sent by the page."""
+    from timeutil import from_epoch, to_epoch
+    t = to_epoch(start)
+    out = []
+    for i in range(n):
+        y, m, d, h, mi, s = from_epoch(t + i * 1200)
+        out.append("/2O{:02d}R at {:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
+            2 + i % 15, y, m, d, h, mi, s))
+    return out
+
+
+# --- cases -------------------------------------------------------------------
+# Each case(hw, fw) prepares and returns run(), which does the work once and
+# returns the number of operations done.
+
+def case_ble_dispatch(hw, fw):
+    def run():
+        for _ in range(50):
+            for msg in BLE_MIX:
+                fw.on_ble_rx(msg)
+        hw.notifications.clear()
+        return 50 * len(BLE_MIX)
+    return run
+
+
+def case_parse_schedule_line(n):
+    def case(hw, fw):
+        lines = schedule_lines(n)
+        passes = max(1, MIN_OPS // n)
+
+        def run():
+            for _ in range(passes):
+                for line in lines:
+                    fw.parse_schedule_line(line)
+            return n * passes
+        return run
+    return case
+
+
+def case_load_schedule(n):
+    def case(hw, fw):
+        with open("schedule.txt", "w") as f:
+            f.write("\n".join(schedule_lines(n)) + "\n")
+        # Lift the entry cap so every line is loaded, not rejected past it
+        fw.MAX_SCHEDULE_ENTRIES = max(fw.MAX_SCHEDULE_ENTRIES, n)
+        fw.schedule_store.max_entries = max(fw.schedule_store.max_entries, n)
+        passes = max(1, MIN_OPS // n)
+
+        def run():
+            for _ in range(passes):
+                fw.load_schedule("schedule.txt")
+                assert len(fw.schedule) == n, "loaded {} of {} entries".format(len(fw.schedule), n)
+            fw.schedule = []
+            return n * passes
+        return run
+    return case
+
+
+def case_time_conversion(hw, fw):
+    from timeutil import from_epoch, to_epoch
+    start = to_epoch((2025, 10, 19, 8, 0, 0))
+    times = [start + i * 3607 for i in range(1000)]
+
+    def run():
+        for t in times:
+            dt = from_epoch(t)
+            to_epoch(dt)
+            fw.format_time(dt)
+            fw.datetime_to_seconds(dt)
+        return len(times)
+    return run
+
+
+def case_log_command(hw, fw):
+    def run():
+        fw.sample_log.clear()
+        for i in range(500):
+            fw.log_command("/2O{:02d}R".format(2 + i % 15), (2025, 10, 19, 8, i // 60, i % 60),
+                           "Start" if i % 2 == 0 else "End")
+        return 500
+    return run
+
+
+def case_heartbeat(hw, fw):
+    fw.schedule = [{"command": "/2O05R", "startTime": (2030, 1, 1, 0, 0, 0)}]
+    fw.apply_voltage_policy()
+
+    def run():
+        saved = fw.heartbeat_interval_ms
+        fw.heartbeat_interval_ms = 0  # a heartbeat on every 100 ms tick
+        try:
+            fw.wait_with_heartbeat(20000, 0)
+        finally:
+            fw.heartbeat_interval_ms = saved
+        hw.notifications.clear()
+        return 200
+    return run
+
+
+def case_wait_for_start(hw, fw):
+    from timeutil import from_epoch
+    iterations = 200
+
+    def run():
+        # Start due just after `iterations` 5 s polls
+        start = from_epoch(fw.clock.epoch() + 5 * iterations + 2)
+        fw.schedule = [{"command": "/2O05R", "startTime": start},
+                       {"command": "/2O06R", "startTime": from_epoch(fw.clock.epoch() + 86400)}]
+        fw.startNow = False
+        fw.wait_for_start()
+        hw.notifications.clear()
+        return iterations
+    return run
+
+
+CASES = [("ble_dispatch", case_ble_dispatch)]
+CASES += [("parse_schedule_line_{}".format(n), case_parse_schedule_line(n)) for n in SIZES]
+CASES += [("load_schedule_{}".format(n), case_load_schedule(n)) for n in SIZES]
+CASES += [
+    ("time_conversion", case_time_conversion),
+    ("log_command", case_log_command),
+    ("heartbeat", case_heartbeat),
+    ("wait_for_start", case_wait_for_start),
+]
+
+
+def measure(case, repeat):
+    """(fastest seconds per operation over repeat runs, calibration) on fresh firmware.
+
+    The calibration loop runs between the case's runs, so both see the
+    same machine load and clock speed.
+    """
+    hw = Hardware()
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    cwd = os.getcwd()
+    best = unit = None
+    try:
+        with contextlib.redirect_stdout(_Discard()):
+            fw = hw.load_firmware(workdir)
+            hw.attach_models()
+            run = case(hw, fw)
+            run()  # warm-up: first-call imports, caches, file system
+            for _ in range(repeat):
+                gc.collect()
+                t0 = time.perf_counter()
+                ops = run()
+                elapsed = (time.perf_counter() - t0) / ops
+                best = elapsed if best is None else min(best, elapsed)
+                calibration = calibrate()
+                unit = calibration if unit is None else min(unit, calibration)
+    finally:
+        os.chdir(cwd)
+    return best, unit
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"cases": {}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--only", default="", help="run only cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="allowed slowdown over the baseline (default: per case, else {})".format(TOLERANCE))
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update", action="store_true", help="store the scores as the new baselines")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    print("{:<26} {:>10} {:>9} {:>9} {:>8}  {}".format("case", "us/op", "score", "baseline", "change", "result"))
+    failed = []
+    units = []
+    for name, case in CASES:
+        if args.only not in name:
+            continue
+        per_op, unit = measure(case, args.repeat)
+        units.append(unit)
+        score = per_op / unit
+        stored = baseline["cases"].get(name)
+        if stored is None:
+            change, verdict = "", "new"
+        else:
+            tolerance = args.tolerance if args.tolerance is not None else stored.get("tolerance", TOLERANCE)
+            ratio = score / stored["score"] - 1
+            change = "{:+.0%}".format(ratio)
+            verdict = "ok" if ratio <= tolerance else "FAIL (> +{:.0%})".format(tolerance)
+            if ratio > tolerance:
+                failed.append(name)
+        print("{:<26} {:>10.2f} {:>9.2f} {:>9} {:>8}  {}".format(
+            name, per_op * 1e6, score, "--" if stored is None else "{:.2f}".format(stored["score"]),
+            change, verdict))
+        if args.update:
+            entry = baseline["cases"].setdefault(name, {})
+            entry["score"] = round(score, 3)
+
+    if units:
+        print("calibration {:.3f} us/loop".format(min(units) * 1e6))
+    if args.update:
+        baseline["calibration_us"] = round(min(units) * 1e6, 4) if units else None
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("baseline written to {}".format(os.path.relpath(args.baseline)))
+    elif failed:
+        print("{} case(s) slower than their baseline: {}".format(len(failed), ", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
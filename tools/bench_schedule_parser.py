@@ -0,0 +1,79 @@
+"""Benchmark the shared schedule parser on large inputs (CPython, host side).
+
+    python tools/bench_schedule_parser.py [--lines 10000]
+
+Reports throughput and peak allocation for
+  - streaming only (entries counted, not stored): memory must stay flat
+  - building the scheduler list (what load_schedule() does, without the cap)
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from schedule_parser import ScheduleBuilder, parse_stream  # noqa: E402
+from timeutil import from_epoch, to_epoch  # noqa: E402
+
+
+def make_input(n, bad_every=50):
+    """n schedule lines, 20 minutes apart, with an occasional malformed one."""
+    start = to_epoch((2025, 10, 19, 8, 0, 0))
+    out = io.StringIO()
+    for i in range(n):
+        if bad_every and i % bad_every == bad_every - 1:
+            out.write("garbage line {}\n".format(i))
+            continue
+        y, m, d, h, mi, s = from_epoch(start + i * 1200)
+        out.write("/2O{:02d}R at {:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}\n".format(
+            2 + i % 15, y, m, d, h, mi, s))
+    return out.getvalue()
+
+
+def run(path, build):
+    count = [0]
+
+    def counting_sink(command, dt):
+        count[0] += 1
+
+    builder = ScheduleBuilder() if build else None
+    sink = builder.add if build else counting_sink
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    with open(path) as f:
+        accepted, rejected = parse_stream(f, sink)
+    if build:
+        builder.finish()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return accepted, rejected, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--lines", type=int, nargs="*", default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    print("{:>7} {:>10} {:>9} {:>9} {:>12} {:>12}".format(
+        "lines", "mode", "accepted", "rejected", "us/line", "peak KiB"))
+    for n in args.lines:
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write(make_input(n))
+        try:
+            results = [(build, run(f.name, build)) for build in (False, True)]
+        finally:
+            os.remove(f.name)
+        for build, (accepted, rejected, elapsed, peak) in results:
+            print("{:>7} {:>10} {:>9} {:>9} {:>12.2f} {:>12.1f}".format(
+                n, "build" if build else "stream", accepted, rejected,
+                elapsed * 1e6 / n, peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Precompile the firmware into .mpy files for faster boot on the Pico W.
+
+Compiling main.py on the device is the largest single cost between reset
+and the first BLE advertisement. This script runs mpy-cross on the host:
+
+    pip install mpy-cross
+    python tools/build_mpy.py            # helper modules only
+    python tools/build_mpy.py --app      # also main.py -> mkr_app.mpy + stub main.py
+
+Copy the contents of build/ to the device (e.g. with mpremote cp -r).
+For a frozen firmware image use tools/manifest.py instead.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STUB_MAIN = """import mkr_app
+mkr_app.run()
+"""
+
+
+def helper_modules():
+    """Root-level .py files that are imported by main.py."""
+    return sorted(
+        name for name in os.listdir(ROOT)
+        if name.endswith(".py") and name != "main.py"
+    )
+
+
+def mpy_cross(src, dst, march):
+    cmd = [sys.executable, "-m", "mpy_cross", "-o", dst]
+    if march:
+        cmd.append("-march=" + march)
+    cmd.append(src)
+    subprocess.run(cmd, check=True, cwd=ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--out", default=os.path.join(ROOT, "build"))
+    parser.add_argument("--app", action="store_true",
+                        help="compile main.py as mkr_app.mpy and write a stub main.py")
+    parser.add_argument("--march", default="armv6m",
+                        help="target architecture (armv6m for RP2040, empty for portable bytecode)")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for name in helper_modules():
+        dst = os.path.join(args.out, name[:-3] + ".mpy")
+        mpy_cross(name, dst, args.march)
+        print("compiled", name, "->", os.path.relpath(dst, ROOT))
+
+    if args.app:
+        mpy_cross("main.py", os.path.join(args.out, "mkr_app.mpy"), args.march)
+        with open(os.path.join(args.out, "main.py"), "w") as f:
+            f.write(STUB_MAIN)
+        print("compiled main.py -> mkr_app.mpy (stub main.py written)")
+    else:
+        shutil.copy(os.path.join(ROOT, "main.py"), os.path.join(args.out, "main.py"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""Asyncio gateway that drives many MKR units over the BLE text protocol.
+
+index.html talks to one unit at a time. This runs the same commands
+against a whole fleet from one host:
+
+    pip install bleak
+    python tools/fleet_gateway.py --address AA:BB:CC:DD:EE:01 --address ... harvest --out logs/
+    python tools/fleet_gateway.py --sim 40 harvest --out /tmp/logs   # no radios needed
+
+Each unit answers one message at a time and replies with one notification
+per line, so requests to a unit can be pipelined: several are written
+without waiting, and replies are matched in order using the prefix and end
+marker of each command (for example [LOG]... then LOG_END). Other lines,
+such as heartbeats, go to DeviceClient.events. Connections are pooled. Up
+to --max-connections stay open and are reused, and the least recently used
+idle link is closed when another unit needs a slot.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import os
+import sys
+import time
+
+UART_SERVICE_UUID = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"
+UART_RX_UUID = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"  # write
+UART_TX_UUID = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"  # notify
+
+DEFAULT_MAX_CONNECTIONS = 5  # typical limit of one host BLE adapter
+DEFAULT_PIPELINE_DEPTH = 4
+DEFAULT_TIMEOUT_S = 30.0
+CONNECT_ATTEMPTS = 3
+TSYNC_EXCHANGES = 8
+EPOCH_2000 = datetime.datetime(2000, 1, 1)
+
+
+def host_ms():
+    """This host's local time in ms since 2000-01-01, the device clock's scale."""
+    return (datetime.datetime.now() - EPOCH_2000).total_seconds() * 1000
+
+
+class Expect:
+    """How to recognise the reply to one command.
+
+    Lines starting with collect are kept as the reply body; the first line
+    starting with one of end finishes it. With collect=None the end line
+    alone is the reply.
+    """
+
+    def __init__(self, end, collect=None, timeout_s=DEFAULT_TIMEOUT_S):
+        self.end = tuple(end)
+        self.collect = collect
+        self.timeout_s = timeout_s
+
+
+GETLOG = Expect(("LOG_END",), "[LOG]", timeout_s=300.0)
+CLEARLOG = Expect(("LOG_CLEARED", "[LOG]Failed"), "[LOG]")
+SET_TIME = Expect(("🕒 RTC time set", "❌ Failed"))
+TSYNC = Expect(("TSYNC:",), timeout_s=5.0)
+TSET = Expect(("TSYNC_END",), "[TSYNC]")
+# The unit queues the command and sends it between steps; "✅ Sent command"
+# comes later, among the unsolicited events
+SEND_CMD = Expect(("📥 Command queued", "❌ Empty command", "❌ Error:"))  # the handler's own failures only
+READ_WINDOW = Expect(("SCHEDULE_WINDOW", "❌ Use READ_SCHEDULE"), "[FILE]", timeout_s=60.0)
+BOOT_PROFILE = Expect(("BOOT_END",), "[BOOT]")
+POWER_STATUS = Expect(("POWER_END", "❌ Use POWER:"), "[POWER]")
+SAMPLES = Expect(("SAMPLES_END",), "[SAMPLE]")
+STALLS = Expect(("STALLS_END",), "[STALL]")
+
+
+class Reply:
+    def __init__(self, command, lines, end, sent_ms=None, received_ms=None):
+        self.command = command
+        self.lines = lines
+        self.end = end
+        self.sent_ms = sent_ms          # host_ms() just before the write
+        self.received_ms = received_ms  # host_ms() when the end line arrived
+
+    @property
+    def ok(self):
+        return not self.end.startswith("❌") and "Failed" not in self.end
+
+
+class _Pending:
+    def __init__(self, command, expect, future):
+        self.command = command
+        self.expect = expect
+        self.future = future
+        self.lines = []
+        self.sent_ms = None
+
+
+class BleakTransport:
+    """Real radio link via bleak (optional dependency)."""
+
+    def __init__(self, address):
+        self.address = address
+        self._client = None
+
+    async def connect(self, on_line):
+        try:
+            from bleak import BleakClient
+        except ImportError:
+            raise RuntimeError("bleak is required for real devices: pip install bleak")
+        self._client = BleakClient(self.address)
+        await self._client.connect()
+
+        def handler(_sender, data):
+            on_line(bytes(data).decode("utf-8", "ignore").strip())
+
+        await self._client.start_notify(UART_TX_UUID, handler)
+
+    async def write(self, data):
+        await self._client.write_gatt_char(UART_RX_UUID, data, response=True)
+
+    async def disconnect(self):
+        if self._client is not None:
+            try:
+                await self._client.disconnect()
+            finally:
+                self._client = None
+
+
+class DeviceClient:
+    """One connected unit with ordered, pipelined request/reply matching."""
+
+    def __init__(self, transport, pipeline_depth=DEFAULT_PIPELINE_DEPTH):
+        self.transport = transport
+        self.address = transport.address
+        self.events = collections.deque(maxlen=200)  # unsolicited lines
+        self.connected = False
+        self._pending = collections.deque()
+        self._slots = asyncio.Semaphore(pipeline_depth)
+        self._write_lock = asyncio.Lock()
+
+    async def connect(self):
+        await self.transport.connect(self._on_line)
+        self.connected = True
+
+    async def close(self):
+        self.connected = False
+        while self._pending:
+            p = self._pending.popleft()
+            if not p.future.done():
+                p.future.set_exception(ConnectionError("{} disconnected".format(self.address)))
+        await self.transport.disconnect()
+
+    def _on_line(self, line):
+        received = host_ms()
+        if not line:
+            return
+        head = self._pending[0] if self._pending else None
+        if head is not None:
+            if line.startswith(head.expect.end):
+                self._pending.popleft()
+                if not head.future.done():
+                    head.future.set_result(Reply(head.command, head.lines, line, head.sent_ms, received))
+                return
+            if head.expect.collect and line.startswith(head.expect.collect):
+                head.lines.append(line[len(head.expect.collect):])
+                return
+        self.events.append(line)
+
+    async def request(self, command, expect):
+        """Write command and wait for its reply. Safe to call concurrently."""
+        if not self.connected:
+            raise ConnectionError("{} is not connected".format(self.address))
+        async with self._slots:
+            future = asyncio.get_running_loop().create_future()
+            pending = _Pending(command, expect, future)
+            async with self._write_lock:
+                # Queue before writing so a fast reply cannot beat us
+                self._pending.append(pending)
+                pending.sent_ms = host_ms()
+                try:
+                    await self.transport.write(command.encode("utf-8"))
+                except Exception:
+                    self._pending.remove(pending)
+                    raise
+            try:
+                return await asyncio.wait_for(future, expect.timeout_s)
+            except asyncio.TimeoutError:
+                # Replies after this one would be misattributed; drop the link
+                await self.close()
+                raise TimeoutError("{}: no reply to {!r}".format(self.address, command))
+
+    async def get_log(self):
+        return (await self.request("GETLOG", GETLOG)).lines
+
+    async def clear_log(self):
+        return (await self.request("CLEARLOG", CLEARLOG)).ok
+
+    async def set_time(self, when=None):
+        when = when or datetime.datetime.now()
+        return await self.request("T:" + when.strftime("%Y%m%d%H%M%S"), SET_TIME)
+
+    async def sync_time(self, exchanges=TSYNC_EXCHANGES):
+        """NTP-style sync to this host's clock. Returns (TSET reply, offset ms, round trip ms).
+
+        Each TSYNC:<n> is answered with the device clock when it arrived
+        (t2) and when the answer left (t3). The exchange with the shortest
+        round trip gives the offset; the device applies it only if it beats
+        its current error.
+        """
+        best = None
+        for n in range(exchanges):
+            reply = await self.request("TSYNC:{}".format(n), TSYNC)
+            t1, t4 = reply.sent_ms, reply.received_ms
+            t2, t3 = (int(v) for v in reply.end.split(":")[2:4])
+            offset = ((t2 - t1) + (t3 - t4)) / 2
+            delay = (t4 - t1) - (t3 - t2)
+            if best is None or delay < best[1]:
+                best = (offset, delay)
+        offset, delay = round(best[0]), max(0, round(best[1]))
+        reply = await self.request("TSET:{}:{}".format(offset, delay), TSET)
+        return reply, offset, delay
+
+    async def send_cmd(self, cmd):
+        return await self.request("SEND_CMD:" + cmd, SEND_CMD)
+
+    async def samples(self):
+        return (await self.request("SAMPLES", SAMPLES)).lines
+
+    async def stalls(self):
+        return (await self.request("STALLS", STALLS)).lines
+
+    async def read_schedule(self, window=50):
+        """All schedule entries, fetched as pipelined READ_SCHEDULE windows."""
+        first = await self.request("READ_SCHEDULE 0 {}".format(window), READ_WINDOW)
+        total = _window_total(first.end)
+        entries = list(first.lines)
+        if total > window:
+            replies = await asyncio.gather(*(
+                self.request("READ_SCHEDULE {} {}".format(start, window), READ_WINDOW)
+                for start in range(window, total, window)))
+            for reply in replies:
+                entries.extend(reply.lines)
+        return entries
+
+
+def _window_total(end_line):
+    # "SCHEDULE_WINDOW 0-19 of 120"
+    try:
+        return int(end_line.rsplit(" of ", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+class FleetGateway:
+    """Connection pool plus fleet-wide operations."""
+
+    def __init__(self, transports, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 pipeline_depth=DEFAULT_PIPELINE_DEPTH):
+        self.transports = {t.address: t for t in transports}
+        self.max_connections = max_connections
+        self.pipeline_depth = pipeline_depth
+        self._idle = collections.OrderedDict()  # address -> DeviceClient, LRU first
+        self._busy = set()
+        self._open = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def addresses(self):
+        return list(self.transports)
+
+    async def _acquire(self, address):
+        while True:
+            victim = None
+            async with self._cond:
+                if address in self._busy:
+                    # One link per unit; queue behind the job using it
+                    await self._cond.wait()
+                    continue
+                dev = self._idle.pop(address, None)
+                if dev is not None and dev.connected:
+                    self._busy.add(address)
+                    return dev
+                if dev is not None:
+                    self._open -= 1  # went away while idle
+                if self._open < self.max_connections:
+                    self._open += 1
+                    self._busy.add(address)
+                    break
+                if self._idle:
+                    _, victim = self._idle.popitem(last=False)
+                    self._open -= 1
+                else:
+                    await self._cond.wait()
+                    continue
+            await victim.close()
+        dev = DeviceClient(self.transports[address], self.pipeline_depth)
+        try:
+            await _connect_with_retry(dev)
+        except Exception:
+            await self._release(address, None)
+            raise
+        return dev
+
+    async def _release(self, address, dev):
+        async with self._cond:
+            self._busy.discard(address)
+            if dev is not None and dev.connected:
+                self._idle[address] = dev
+            else:
+                self._open -= 1
+            self._cond.notify_all()
+
+    async def run(self, address, job):
+        """Run job(DeviceClient) on a pooled connection to address."""
+        dev = await self._acquire(address)
+        try:
+            return await job(dev)
+        finally:
+            await self._release(address, dev)
+
+    async def run_all(self, job, addresses=None):
+        """Run job on every unit. Returns {address: result or exception}."""
+        addresses = addresses or self.addresses
+        results = await asyncio.gather(*(self.run(a, job) for a in addresses),
+                                       return_exceptions=True)
+        return dict(zip(addresses, results))
+
+    async def close(self):
+        async with self._cond:
+            idle = list(self._idle.values())
+            self._idle.clear()
+            self._open -= len(idle)
+        for dev in idle:
+            await dev.close()
+
+    async def harvest_logs(self, out_dir, clear=False, addresses=None):
+        """GETLOG every unit concurrently into out_dir/<address>.log."""
+        os.makedirs(out_dir, exist_ok=True)
+
+        async def job(dev):
+            lines = await dev.get_log()
+            path = os.path.join(out_dir, _safe_name(dev.address) + ".log")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(path + ".tmp", path)
+            if clear:
+                await dev.clear_log()
+            return len(lines)
+
+        return await self.run_all(job, addresses)
+
+
+async def _connect_with_retry(dev):
+    delay = 0.5
+    for attempt in range(1, CONNECT_ATTEMPTS + 1):
+        try:
+            await dev.connect()
+            return
+        except Exception:
+            if attempt == CONNECT_ATTEMPTS:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+def _safe_name(address):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in address)
+
+
+def build_transports(args):
+    if args.sim:
+        from sim_peripheral import SimulatedPeripheral, SimTransport
+        return [SimTransport(SimulatedPeripheral("SIM-{:02d}".format(i), log_lines=args.sim_log_lines,
+                                                 schedule_entries=args.sim_schedule_entries))
+                for i in range(args.sim)]
+    if not args.address:
+        sys.exit("Give --address for each unit, or --sim N")
+    return [BleakTransport(a) for a in args.address]
+
+
+def report(results, describe):
+    failed = 0
+    for address, result in results.items():
+        if isinstance(result, BaseException):
+            failed += 1
+            print("❌ {}: {}".format(address, result))
+        else:
+            print("✅ {}: {}".format(address, describe(result)))
+    return failed
+
+
+async def main_async(args):
+    gateway = FleetGateway(build_transports(args), args.max_connections, args.pipeline)
+    t0 = time.monotonic()
+    try:
+        if args.op == "harvest":
+            results = await gateway.harvest_logs(args.out, clear=args.clear)
+            failed = report(results, lambda n: "{} log lines".format(n))
+        elif args.op == "time" and args.coarse:
+            results = await gateway.run_all(lambda dev: dev.set_time())
+            failed = report(results, lambda r: r.end)
+        elif args.op == "time":
+            results = await gateway.run_all(lambda dev: dev.sync_time())
+            failed = report(results, lambda r: "offset {:+d} ms, round trip {} ms\n    {}".format(
+                r[1], r[2], "\n    ".join(r[0].lines)))
+        elif args.op == "schedule":
+            results = await gateway.run_all(lambda dev: dev.read_schedule())
+            failed = report(results, lambda entries: "{} entries".format(len(entries)))
+        elif args.op == "samples":
+            results = await gateway.run_all(lambda dev: dev.samples())
+            failed = report(results, lambda lines: "\n    " + "\n    ".join(lines))
+        else:
+            results = await gateway.run_all(lambda dev: dev.send_cmd(args.command))
+            failed = report(results, lambda r: r.end)
+    finally:
+        await gateway.close()
+    print("⏱️ {} units in {:.1f} s ({} failed)".format(len(results), time.monotonic() - t0, failed))
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive many MKR units over BLE at once.")
+    parser.add_argument("--address", action="append", help="BLE address of a unit (repeatable)")
+    parser.add_argument("--sim", type=int, default=0, help="use N simulated units instead of radios")
+    parser.add_argument("--sim-log-lines", type=int, default=2000)
+    parser.add_argument("--sim-schedule-entries", type=int, default=100)
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--pipeline", type=int, default=DEFAULT_PIPELINE_DEPTH,
+                        help="requests in flight per unit")
+    sub = parser.add_subparsers(dest="op", required=True)
+    harvest = sub.add_parser("harvest", help="download every unit's log")
+    harvest.add_argument("--out", default="logs")
+    harvest.add_argument("--clear", action="store_true", help="CLEARLOG after a successful download")
+    time_op = sub.add_parser("time", help="sync every unit's clock to this host (TSYNC handshake)")
+    time_op.add_argument("--coarse", action="store_true", help="set whole seconds with T: (older firmware)")
+    sub.add_parser("schedule", help="read every unit's schedule")
+    sub.add_parser("samples", help="read every unit's sample ledger")
+    send = sub.add_parser("send", help="SEND_CMD: to every unit")
+    send.add_argument("command")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
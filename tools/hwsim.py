@@ -0,0 +1,471 @@
+"""Simulated Pico W hardware so main.py can be imported and driven under CPython.
+
+Provides stand-ins for machine, bluetooth, ble_simple_peripheral,
+comm_manager, ina219 and wifi_toggle, plus a `time` module whose clock is
+virtual: sleeps advance it instantly, so hours of firmware time run in
+seconds. Used by tools/replay_trace.py and the benchmark tools.
+
+    hw = Hardware(start=datetime.datetime(2025, 10, 19, 8, 0, 0))
+    main = hw.load_firmware(workdir)      # imports main.py with run() not called
+    hw.uarts[0].responder = my_pump_model
+    main.execute_step("/2O05R")
+"""
+import datetime
+import heapq
+import importlib
+import os
+import sys
+import time as _real_time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+POLL_COST_MS = 1  # virtual time an empty uart.any() poll costs
+
+
+class DeepSleepReset(Exception):
+    """machine.deepsleep()/reset() on the device: execution stops here."""
+
+
+class VirtualClock:
+    """Millisecond clock that only moves when the firmware sleeps or polls."""
+
+    def __init__(self, start):
+        self.start = start
+        self.ms = 0.0
+        self._events = []  # heap of (due_ms, seq, callback)
+        self._seq = 0
+        self.sleeps = 0
+
+    def at(self, due_ms, callback):
+        """Call callback() once the clock reaches due_ms."""
+        heapq.heappush(self._events, (due_ms, self._seq, callback))
+        self._seq += 1
+
+    def advance(self, ms):
+        target = self.ms + ms
+        while self._events and self._events[0][0] <= target:
+            due, _, callback = heapq.heappop(self._events)
+            self.ms = max(self.ms, due)
+            callback()
+        self.ms = max(self.ms, target)
+
+    def now(self):
+        return self.start + datetime.timedelta(milliseconds=self.ms)
+
+
+class SimUART:
+    """UART with scripted receive data. responder(uart, data) is called on every write.
+
+    The attached device only hears writes made at device_baud; at any other
+    rate the responder is not called, as a real device sees framing errors.
+    With wire_time set, replies also take their 8N1 transmission time.
+    """
+
+    def __init__(self, hw, uart_id, baudrate=9600):
+        self.hw = hw
+        self.id = uart_id
+        self.tx = []          # (ms, bytes) written by the firmware
+        self._rx = bytearray()
+        self.responder = None
+        self.baudrate = baudrate
+        self.device_baud = 9600
+        self.wire_time = False
+
+    def feed(self, data, delay_ms=0):
+        """Make data readable delay_ms from now."""
+        if self.wire_time:
+            delay_ms += len(data) * 10000 / self.baudrate
+        if delay_ms <= 0:
+            self._rx.extend(data)
+        else:
+            self.hw.clock.at(self.hw.clock.ms + delay_ms, lambda: self._rx.extend(data))
+
+    def write(self, buf):
+        data = buf.encode() if isinstance(buf, str) else bytes(buf)
+        self.tx.append((self.hw.clock.ms, data))
+        if self.responder and self.baudrate == self.device_baud:
+            self.responder(self, data)
+        return len(data)
+
+    def any(self):
+        if not self._rx:
+            self.hw.clock.advance(POLL_COST_MS)
+        return len(self._rx)
+
+    def read(self, n=None):
+        if not self._rx:
+            return None
+        n = len(self._rx) if n is None else min(n, len(self._rx))
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data
+
+    def readinto(self, buf, n=None):
+        data = self.read(len(buf) if n is None else n)
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def init(self, *args, **kwargs):
+        self.baudrate = kwargs.get("baudrate", self.baudrate)
+
+    def deinit(self):
+        pass
+
+
+ACK_READY = bytes([0xFF, 0x2F, 0x30, 0x60, 0x03, 0x0D, 0x0A])  # /0` ready, no error
+ACK_BUSY = bytes([0xFF, 0x2F, 0x30, 0x40, 0x03, 0x0D, 0x0A])   # /0@ busy
+
+
+class PumpModel:
+    """Syringe pump on uart0: /1QR reports busy until the last move finishes.
+
+    Timings are typical of the field units (an init move, then one
+    /1J0S15A0A7640... stroke including its M2000 dwells).
+    """
+
+    def __init__(self, clock, init_ms=4000, stroke_ms=20000, reply_ms=15, error_code=0):
+        self.clock = clock
+        self.init_ms = init_ms
+        self.stroke_ms = stroke_ms
+        self.reply_ms = reply_ms
+        self.error_code = error_code
+        self.busy_until = 0.0
+        self.strokes = 0
+
+    def __call__(self, uart, data):
+        cmd = data.strip().decode("utf-8", "ignore")
+        if cmd == "/1QR":
+            ready = self.clock.ms >= self.busy_until
+            status = (0x60 if ready else 0x40) | (self.error_code & 0x0F)
+            uart.feed(bytes([0xFF, 0x2F, 0x30, status, 0x03, 0x0D, 0x0A]), self.reply_ms)
+            return
+        if cmd.startswith("/1Z"):
+            self.busy_until = self.clock.ms + self.init_ms
+        elif cmd.startswith("/1J") or cmd.startswith("/1A"):
+            self.busy_until = self.clock.ms + self.stroke_ms
+            self.strokes += 1
+        elif cmd.startswith("/1T"):
+            self.busy_until = self.clock.ms  # terminate: stop at once
+        uart.feed(ACK_BUSY if self.clock.ms < self.busy_until else ACK_READY, self.reply_ms)
+
+
+class ValveModel:
+    """Selector valve on uart1: acknowledges every command."""
+
+    def __init__(self, reply_ms=15):
+        self.reply_ms = reply_ms
+        self.port = None
+
+    def __call__(self, uart, data):
+        cmd = data.strip().decode("utf-8", "ignore")
+        if cmd.startswith("/2O") or cmd.startswith("/20"):
+            self.port = cmd[3:-1]
+        uart.feed(ACK_READY, self.reply_ms)
+
+
+class SimPeripheral:
+    """BLESimplePeripheral stand-in: notifications are collected in hw.notifications."""
+
+    def __init__(self, hw):
+        self.hw = hw
+        self.callback = None
+
+    def send(self, data):
+        self.hw.notifications.append((self.hw.clock.ms, data))
+
+    def on_write(self, callback):
+        self.callback = callback
+        self.hw.peripheral = self
+
+    def is_connected(self):
+        return self.hw.ble_connected
+
+    def write(self, data):
+        """Deliver a write from the phone, as the BLE IRQ would."""
+        if self.callback:
+            self.callback(data if isinstance(data, bytes) else data.encode())
+
+
+class Hardware:
+    def __init__(self, start=None, vsys_v=4.1):
+        self.clock = VirtualClock(start or datetime.datetime(2025, 10, 19, 8, 0, 0))
+        self.uarts = {}
+        self.pins = {}
+        self.pin_values = {}  # pin id -> level, shared by every Pin object on that id
+        self.pin_log = []     # (ms, pin id, level) on every change
+        self.notifications = []
+        self.peripheral = None
+        self.ble_connected = True
+        self.vsys_v = vsys_v
+        self.current_ma = 40.0
+        self.resets = 0
+        self.rtc_reads = 0
+        self.rtc_ppm = 0.0      # RTC rate error relative to true (virtual) time
+        self.crystal_ppm = 0.0  # ticks_ms rate error relative to true time
+
+    # --- module factories -------------------------------------------------
+    def _time_module(self):
+        hw = self
+        clock = self.clock
+        mod = types.ModuleType("time")
+        for name in dir(_real_time):
+            if not name.startswith("__"):
+                setattr(mod, name, getattr(_real_time, name))
+
+        def sleep(s):
+            clock.sleeps += 1
+            clock.advance(s * 1000)
+
+        def localtime(secs=None):
+            t = clock.now() if secs is None else datetime.datetime(2000, 1, 1) + datetime.timedelta(seconds=secs)
+            return (t.year, t.month, t.day, t.hour, t.minute, t.second, t.weekday(), t.timetuple().tm_yday)
+
+        mod.sleep = sleep
+        mod.sleep_ms = lambda ms: sleep(ms / 1000)
+        mod.sleep_us = lambda us: sleep(us / 1000000)
+        mod.ticks_ms = lambda: int(clock.ms * (1 + hw.crystal_ppm / 1e6)) & 0x3FFFFFFF
+        mod.ticks_us = lambda: int(clock.ms * 1000 * (1 + hw.crystal_ppm / 1e6)) & 0x3FFFFFFF
+        mod.ticks_add = lambda t, d: (t + d) & 0x3FFFFFFF
+        mod.ticks_diff = lambda a, b: ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+        mod.localtime = localtime
+        mod.time = lambda: int((clock.now() - datetime.datetime(2000, 1, 1)).total_seconds())
+        return mod
+
+    def _machine_module(self):
+        hw = self
+        mod = types.ModuleType("machine")
+
+        class Pin:
+            OUT = 1
+            IN = 0
+            PULL_UP = 1
+
+            def __init__(self, pin_id, mode=None, value=None, pull=None):
+                self.id = pin_id
+                hw.pins[pin_id] = self
+                if value is not None:
+                    self.value(value)
+
+            def value(self, v=None):
+                if v is None:
+                    return hw.pin_values.get(self.id, 0)
+                v = 1 if v else 0
+                if hw.pin_values.get(self.id) != v:
+                    hw.pin_log.append((hw.clock.ms, self.id, v))
+                hw.pin_values[self.id] = v
+
+            def on(self):
+                self.value(1)
+
+            def off(self):
+                self.value(0)
+
+        class ADC:
+            def __init__(self, channel):
+                self.channel = channel
+
+            def read_u16(self):
+                return min(65535, int(hw.vsys_v / (3 * 3.3 / 65535)))
+
+        class I2C:
+            def __init__(self, *args, **kwargs):
+                pass
+
+        class WDT:
+            def __init__(self, id=0, timeout=5000):
+                self.timeout = timeout
+                self.fed = hw.clock.ms
+
+            def feed(self):
+                self.fed = hw.clock.ms
+
+        class Timer:
+            ONE_SHOT = 0
+            PERIODIC = 1
+
+            def __init__(self, id=-1, mode=PERIODIC, period=-1, callback=None, **kwargs):
+                self._live = False
+                if callback is not None:
+                    self.init(mode=mode, period=period, callback=callback)
+
+            def init(self, mode=PERIODIC, period=-1, callback=None, **kwargs):
+                self._live = True
+                self._schedule(mode, period, callback)
+
+            def _schedule(self, mode, period, callback):
+                def fire():
+                    if not self._live:
+                        return
+                    if mode == Timer.ONE_SHOT:
+                        self._live = False
+                    else:
+                        self._schedule(mode, period, callback)
+                    callback(self)
+                hw.clock.at(hw.clock.ms + period, fire)
+
+            def deinit(self):
+                self._live = False
+
+        class RTC:
+            def datetime(self, value=None):
+                t = hw.clock.now()
+                return (t.year, t.month, t.day, t.weekday(), t.hour, t.minute, t.second, 0)
+
+        def lightsleep(ms=0):
+            hw.clock.advance(ms)
+
+        def deepsleep(ms=0):
+            hw.clock.advance(ms)
+            hw.resets += 1
+            raise DeepSleepReset("deepsleep")
+
+        def reset():
+            hw.resets += 1
+            raise DeepSleepReset("reset")
+
+        class Mem32(dict):
+            def __missing__(self, addr):
+                return 0
+
+        mod.Pin = Pin
+        mod.mem32 = Mem32()
+        def UART(uart_id, *args, **kwargs):
+            uart = hw.uarts.setdefault(uart_id, SimUART(hw, uart_id))
+            uart.init(**kwargs)
+            return uart
+
+        mod.UART = UART
+        mod.ADC = ADC
+        mod.I2C = I2C
+        mod.WDT = WDT
+        mod.Timer = Timer
+        mod.RTC = RTC
+        mod.lightsleep = lightsleep
+        mod.deepsleep = deepsleep
+        mod.reset = reset
+        mod.soft_reset = reset
+        mod.PWRON_RESET = 1
+        mod.WDT_RESET = 3
+        mod.DEEPSLEEP_RESET = 4
+        mod.HARD_RESET = 2
+        mod.SOFT_RESET = 5
+        mod.reset_cause = lambda: mod.PWRON_RESET
+        mod.freq = lambda *args: 125000000
+        mod.unique_id = lambda: b"\x00SIMPICO"
+        mod.disable_irq = lambda: 0
+        mod.enable_irq = lambda state: None
+        return mod
+
+    def _bluetooth_module(self):
+        mod = types.ModuleType("bluetooth")
+
+        class BLE:
+            def active(self, *args):
+                return True
+
+            def config(self, *args, **kwargs):
+                return None
+
+            def irq(self, handler):
+                pass
+
+        mod.BLE = BLE
+        return mod
+
+    def _peripheral_module(self):
+        hw = self
+        mod = types.ModuleType("ble_simple_peripheral")
+        mod.BLESimplePeripheral = lambda ble, *args, **kwargs: SimPeripheral(hw)
+        return mod
+
+    def _comm_manager_module(self):
+        hw = self
+        mod = types.ModuleType("comm_manager")
+
+        class CommManager:
+            def get_formatted_time(self):
+                hw.rtc_reads += 1
+                t = hw.clock.now() + datetime.timedelta(milliseconds=hw.clock.ms * hw.rtc_ppm / 1e6)
+                return t.strftime("%Y-%m-%d %H:%M:%S")
+
+            def set_rtc_time(self, dt):
+                y, m, d, _wd, h, mi, s = dt[:7]
+                wanted = datetime.datetime(y, m, d, h, mi, s)
+                hw.clock.start += wanted - hw.clock.now()
+
+        mod.CommManager = CommManager
+        return mod
+
+    def _ina219_module(self):
+        hw = self
+        mod = types.ModuleType("ina219")
+
+        class INA219:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def getCurrent_mA(self):
+                return hw.current_ma
+
+            def getBusVoltage_V(self):
+                return hw.vsys_v
+
+            def getShuntVoltage_mV(self):
+                return hw.current_ma * 0.1
+
+            def getPower_W(self):
+                return hw.current_ma * hw.vsys_v / 1000
+
+        mod.INA219 = INA219
+        return mod
+
+    def _wifi_module(self):
+        mod = types.ModuleType("wifi_toggle")
+
+        class PicoPiFileServer:
+            def __init__(self, *args, **kwargs):
+                raise OSError("Wi-Fi is not simulated")
+
+        mod.PicoPiFileServer = PicoPiFileServer
+        return mod
+
+    def modules(self):
+        return {
+            "time": self._time_module(),
+            "machine": self._machine_module(),
+            "bluetooth": self._bluetooth_module(),
+            "ble_simple_peripheral": self._peripheral_module(),
+            "comm_manager": self._comm_manager_module(),
+            "ina219": self._ina219_module(),
+            "wifi_toggle": self._wifi_module(),
+        }
+
+    def attach_models(self):
+        """Answer uart0/uart1 with the default pump and valve models."""
+        self.pump = PumpModel(self.clock)
+        self.valve = ValveModel()
+        self.uarts[0].responder = self.pump
+        self.uarts[1].responder = self.valve
+
+    def load_firmware(self, workdir, module="main"):
+        """Import main.py (and its helpers) against this hardware, with workdir as flash.
+
+        The simulated `time` is only visible to the firmware modules; the real
+        one is restored in sys.modules afterwards.
+        """
+        os.makedirs(workdir, exist_ok=True)
+        os.chdir(workdir)
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        firmware = [name for name in os.listdir(ROOT) if name.endswith(".py")]
+        for name in firmware:
+            sys.modules.pop(name[:-3], None)
+        saved_time = sys.modules["time"]
+        sys.modules.update(self.modules())
+        try:
+            return importlib.import_module(module)
+        finally:
+            sys.modules["time"] = saved_time
@@ -0,0 +1,29 @@
+# Freeze manifest for a custom Pico W firmware with the sampler helpers built in.
+#
+#   make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST=/path/to/MKR-read/tools/manifest.py
+#
+# Frozen modules are executed from flash without being loaded into RAM,
+# which shortens boot and leaves more heap for schedules. main.py stays on
+# the filesystem so it can still be updated over Wi-Fi.
+include("$(PORT_DIR)/boards/RPI_PICO_W/manifest.py")
+
+# Paths are relative to this file; keep in step with the helper modules in the repo root.
+module("checkpoint.py", base_path="..")
+module("power_manager.py", base_path="..")
+module("vsys_monitor.py", base_path="..")
+module("timeutil.py", base_path="..")
+module("schedule_rule.py", base_path="..")
+module("feasibility.py", base_path="..")
+module("schedule_parser.py", base_path="..")
+module("sample_registry.py", base_path="..")
+module("trace_recorder.py", base_path="..")
+module("rs232_frame.py", base_path="..")
+module("stall_monitor.py", base_path="..")
+module("estop.py", base_path="..")
+module("clock_service.py", base_path="..")
+module("schedule_patch.py", base_path="..")
+module("pump_volume.py", base_path="..")
+module("metrics.py", base_path="..")
+module("rs232_link.py", base_path="..")
+module("baud_rates.py", base_path="..")
+module("segment_log.py", base_path="..")
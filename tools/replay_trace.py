@@ -0,0 +1,231 @@
+"""Replay a TRACE:ON recording against main.py in accelerated time (CPython).
+
+    python tools/replay_trace.py trace.bin            # replay every recorded step
+    python tools/replay_trace.py trace.bin --dump     # list the records
+    python tools/replay_trace.py --synth out.bin      # record a step against the simulated pump
+
+Fetch trace.bin from the unit with the Wi-Fi file server. Each step
+recorded by execute_step() is run again on the simulated hardware in
+tools/hwsim.py. The firmware's UART writes are answered with the bytes
+the real pump and valve sent, in the same order and with the same delay
+after each write. BLE writes from the phone are delivered at their
+recorded times. The report compares the step duration and the UART
+conversation with the recording. Run it before and after a change to see
+how the change behaves against real pump timing.
+
+RX timestamps are when the firmware read the bytes, not when they arrived
+on the wire, so replayed delays are upper bounds.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hwsim import Hardware, DeepSleepReset  # noqa: E402
+from trace_recorder import (  # noqa: E402
+    read_trace, KIND_NAMES, KIND_MARK, KIND_BLE_RX, KIND_BLE_TX,
+    KIND_U0_TX, KIND_U0_RX, KIND_U1_TX, KIND_U1_RX,
+)
+
+TX_KINDS = {KIND_U0_TX: 0, KIND_U1_TX: 1}
+RX_KINDS = {KIND_U0_RX: 0, KIND_U1_RX: 1}
+
+
+class Step:
+    """One execute_step() call cut out of a trace."""
+
+    def __init__(self, command, t_start):
+        self.command = command
+        self.t_start = t_start
+        self.t_end = None
+        self.sequence = None
+        self.exchanges = {0: [], 1: []}  # uart -> [[tx, t_tx, [(delay_ms, rx), ...]], ...]
+        self.ble_rx = []                 # (offset_ms, data)
+        self.ble_tx = 0
+
+    @property
+    def duration_ms(self):
+        return (self.t_end or self.t_start) - self.t_start
+
+
+def split_steps(records):
+    steps = []
+    step = None
+    for t, kind, data in records:
+        if kind == KIND_MARK:
+            text = data.decode("utf-8", "ignore")
+            if text.startswith("step "):
+                step = Step(text[5:], t)
+                steps.append(step)
+            elif step is not None and text.startswith("sequence "):
+                step.sequence = text[9:].split("|")
+            elif text in ("end", "reset") or text.startswith("deepsleep"):
+                if step is not None:
+                    step.t_end = t
+                step = None
+            continue
+        if step is None:
+            continue
+        step.t_end = t
+        if kind in TX_KINDS:
+            step.exchanges[TX_KINDS[kind]].append([data, t, []])
+        elif kind in RX_KINDS:
+            ex = step.exchanges[RX_KINDS[kind]]
+            if ex:
+                ex[-1][2].append((t - ex[-1][1], data))
+        elif kind == KIND_BLE_RX:
+            step.ble_rx.append((t - step.t_start, data))
+        elif kind == KIND_BLE_TX:
+            step.ble_tx += 1
+    return steps
+
+
+class ScriptedDevice:
+    """UART responder that plays back the recorded replies in order."""
+
+    def __init__(self, exchanges):
+        self.exchanges = list(exchanges)
+        self.next = 0
+        self.matched = 0
+        self.mismatches = []
+        self.extra = 0
+
+    def __call__(self, uart, data):
+        if self.next >= len(self.exchanges):
+            self.extra += 1
+            return
+        tx, _, replies = self.exchanges[self.next]
+        self.next += 1
+        if tx.strip() == data.strip():
+            self.matched += 1
+        elif len(self.mismatches) < 5:
+            self.mismatches.append((tx.strip(), data.strip()))
+        for delay_ms, rx in replies:
+            uart.feed(rx, delay_ms)
+
+    @property
+    def unused(self):
+        return len(self.exchanges) - self.next
+
+
+def replay(steps, verbose=False):
+    hw = Hardware()
+    workdir = tempfile.mkdtemp(prefix="mkr_replay_")
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        fw = hw.load_firmware(workdir)
+    results = []
+    for step in steps:
+        if step.sequence:
+            with open(os.path.join(workdir, "default_sequence.txt"), "w") as f:
+                f.write("\n".join(step.sequence) + "\n")
+        devices = {i: ScriptedDevice(step.exchanges[i]) for i in (0, 1)}
+        for i, dev in devices.items():
+            hw.uarts[i].responder = dev
+        start_ms = hw.clock.ms
+        for offset, data in step.ble_rx:
+            hw.clock.at(start_ms + offset, lambda d=data: hw.peripheral.write(d))
+        sent_before = len(hw.notifications)
+        fw.emergency_stop = False
+        t0 = time.perf_counter()
+        quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            try:
+                fw.execute_step(step.command)
+            except DeepSleepReset as e:
+                print("  (firmware called {})".format(e))
+        wall = time.perf_counter() - t0
+        results.append({
+            "step": step,
+            "replayed_ms": hw.clock.ms - start_ms,
+            "wall_s": wall,
+            "devices": devices,
+            "ble_tx": len(hw.notifications) - sent_before,
+        })
+    return results
+
+
+def print_report(results):
+    total_virtual = 0.0
+    total_wall = 0.0
+    diverged = 0
+    for i, r in enumerate(results, 1):
+        step = r["step"]
+        total_virtual += r["replayed_ms"]
+        total_wall += r["wall_s"]
+        delta = (r["replayed_ms"] - step.duration_ms) / 1000
+        print("Step {} {}: recorded {:.1f} s, replayed {:.1f} s ({:+.1f} s), {} notifications (recorded {})".format(
+            i, step.command, step.duration_ms / 1000, r["replayed_ms"] / 1000, delta,
+            r["ble_tx"], step.ble_tx))
+        for uart_id, dev in sorted(r["devices"].items()):
+            ok = not dev.mismatches and not dev.extra and not dev.unused
+            if not ok:
+                diverged += 1
+            print("  uart{}: {} writes matched, {} differ, {} extra, {} recorded writes unused{}".format(
+                uart_id, dev.matched, len(dev.mismatches), dev.extra, dev.unused, "" if ok else "  <-- diverged"))
+            for recorded, replayed in dev.mismatches:
+                print("    recorded {!r} replayed {!r}".format(recorded, replayed))
+    if results:
+        print("Replayed {:.0f} s of firmware time in {:.2f} s ({:.0f}x), {} diverging UART streams".format(
+            total_virtual / 1000, total_wall, total_virtual / 1000 / max(total_wall, 1e-6), diverged))
+    return diverged
+
+
+def dump(records):
+    for t, kind, data in records:
+        try:
+            text = data.decode("utf-8")
+            shown = repr(text) if text.isprintable() else data.hex(" ")
+        except UnicodeError:
+            shown = data.hex(" ")
+        print("{:>10.3f} {:<5} {}".format(t / 1000, KIND_NAMES.get(kind, kind), shown))
+
+
+def synthesize(path, command):
+    """Record one step of the firmware against the hwsim pump/valve models."""
+    path = os.path.abspath(path)
+    hw = Hardware()
+    workdir = tempfile.mkdtemp(prefix="mkr_synth_")
+    with contextlib.redirect_stdout(io.StringIO()):
+        fw = hw.load_firmware(workdir)
+        hw.attach_models()
+        fw.tracer.path = path
+        fw.tracer.start()
+        fw.execute_step(command)
+        fw.tracer.stop()
+    print("Wrote {} ({} bytes, {:.0f} s of firmware time)".format(path, os.path.getsize(path), hw.clock.ms / 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a firmware UART/BLE trace in accelerated time.")
+    parser.add_argument("trace", help="trace.bin from the device (or output path with --synth)")
+    parser.add_argument("--dump", action="store_true", help="print the records instead of replaying")
+    parser.add_argument("--synth", action="store_true",
+                        help="write a trace of one step against the simulated pump")
+    parser.add_argument("--command", default="/2O05R", help="valve command for --synth")
+    parser.add_argument("--verbose", action="store_true", help="show firmware output during replay")
+    args = parser.parse_args()
+
+    if args.synth:
+        synthesize(args.trace, args.command)
+        return 0
+    with open(args.trace, "rb") as f:
+        records = list(read_trace(f.read()))
+    if args.dump:
+        dump(records)
+        return 0
+    steps = split_steps(records)
+    if not steps:
+        print("No execute_step() recorded in {}".format(args.trace))
+        return 1
+    return 1 if print_report(replay(steps, args.verbose)) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
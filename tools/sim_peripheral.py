@@ -0,0 +1,178 @@
+"""In-process stand-in for a MKR unit's BLE text protocol (host side, asyncio).
+
+Answers the commands the fleet gateway uses with the same reply lines as
+on_ble_rx() in main.py, one notification per line, paced like a BLE
+connection interval. Nothing here touches a radio:
+
+    peripheral = SimulatedPeripheral("SIM-00", log_lines=500)
+    transport = SimTransport(peripheral)
+"""
+import asyncio
+import datetime
+
+DEFAULT_NOTIFY_INTERVAL_S = 0.0075  # shortest BLE connection interval
+DEFAULT_LINK_LATENCY_S = 0.02       # one write-with-response round trip
+DEFAULT_CONNECT_S = 0.5
+
+SAMPLE_PORTS = list(range(2, 17))
+
+
+def make_log(count, start=datetime.datetime(2025, 10, 1, 8, 0, 0)):
+    """log_ME.txt style lines, as written by log_command()."""
+    lines = []
+    for i in range(count // 2):
+        port = SAMPLE_PORTS[i % len(SAMPLE_PORTS)]
+        cmd = "/2O{:02d}R".format(port)
+        sample = "smp {}".format(port - 1)
+        t = start + datetime.timedelta(minutes=20 * i)
+        for status, offset in (("START", 0), ("END", 314)):
+            ts = (t + datetime.timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S")
+            lines.append("{} | Command: {} | Sample: {} | Status: {}".format(ts, cmd, sample, status))
+    return lines
+
+
+class SimulatedPeripheral:
+    """Protocol-level model of one unit: log file, schedule, RTC and UART echo."""
+
+    def __init__(self, name, log_lines=200, schedule_entries=20,
+                 notify_interval_s=DEFAULT_NOTIFY_INTERVAL_S,
+                 link_latency_s=DEFAULT_LINK_LATENCY_S,
+                 connect_s=DEFAULT_CONNECT_S, heartbeat_s=None):
+        self.name = name
+        self.log = make_log(log_lines)
+        self.log_gen = 0
+        start = datetime.datetime(2025, 10, 19, 8, 0, 0)
+        self.schedule = [
+            "/2O{:02d}R at {}".format(SAMPLE_PORTS[i % len(SAMPLE_PORTS)],
+                                      (start + datetime.timedelta(minutes=20 * i)).strftime("%Y-%m-%d %H:%M:%S"))
+            for i in range(schedule_entries)
+        ]
+        self.rtc = None
+        self.clock_offset_ms = 0.0  # device clock minus host clock, as TSYNC sees it
+        self.sent_commands = []
+        self.notify_interval_s = notify_interval_s
+        self.link_latency_s = link_latency_s
+        self.connect_s = connect_s
+        self.heartbeat_s = heartbeat_s
+        self.connected = False
+
+    def clock_ms(self):
+        """Device clock, ms since 2000-01-01 local time."""
+        now = datetime.datetime.now() - datetime.datetime(2000, 1, 1)
+        return now.total_seconds() * 1000 + self.clock_offset_ms
+
+    def _log_from(self, offset, gen=None):
+        """Incremental GETLOG reply, as send_log_from() in main.py."""
+        starts = [0]
+        for line in self.log:
+            starts.append(starts[-1] + len(line.encode()) + 1)
+        if gen != self.log_gen or offset not in starts:
+            offset = 0
+        first = starts.index(offset)
+        return (["LOG_FROM:{}:{}".format(offset, self.log_gen)]
+                + ["[LOG]" + line.strip() for line in self.log[first:]]
+                + ["LOG_END:{}".format(starts[-1])])
+
+    def handle(self, msg):
+        """Reply lines for one received message (mirrors on_ble_rx)."""
+        if msg == "GETLOG":
+            lines = self.log or ["No log entries found or log file not created yet."]
+            return ["[LOG]" + line.strip() for line in lines] + ["LOG_END"]
+        if msg.startswith("GETLOG:"):
+            return self._log_from(*(int(v) for v in msg[7:].split(":")))
+        if msg == "CLEARLOG":
+            self.log = []
+            self.log_gen += 1
+            return ["[LOG]Log cleared on device", "LOG_CLEARED"]
+        if msg.startswith("T:"):
+            text = msg[2:].strip()
+            try:
+                self.rtc = datetime.datetime.strptime(text, "%Y%m%d%H%M%S")
+            except ValueError as e:
+                return ["❌ Failed to parse compact time: {}".format(e)]
+            return ["🕒 RTC time set to: " + self.rtc.strftime("%Y-%m-%d %H:%M:%S")]
+        if msg.startswith("TSYNC:"):
+            now = self.clock_ms()
+            return ["TSYNC:{}:{}:{}".format(msg[6:], int(now), int(now))]
+        if msg.startswith("TSET:"):
+            try:
+                offset, delay = (int(v) for v in msg[5:].split(":"))
+            except ValueError:
+                return ["❌ Use TSET:<offset_ms>:<delay_ms>", "TSYNC_END"]
+            self.clock_offset_ms -= offset
+            return ["[TSYNC]🕒 Clock corrected by {:+d} ms (+/- {} ms)".format(-offset, delay // 2 + 1),
+                    "TSYNC_END"]
+        if msg.startswith("READ_SCHEDULE "):
+            args = msg.split()
+            try:
+                start = int(args[1])
+                count = int(args[2]) if len(args) > 2 else 20
+            except (ValueError, IndexError):
+                return ["❌ Use READ_SCHEDULE <start> [count]"]
+            end = min(len(self.schedule), start + count)
+            out = ["📅 Schedule Window:"]
+            out += ["[FILE]" + line for line in self.schedule[start:end]]
+            out.append("SCHEDULE_WINDOW {}-{} of {}".format(start, end - 1, len(self.schedule)))
+            return out
+        if msg.startswith("SEND_CMD:"):
+            cmd = msg[9:].strip()
+            if not cmd:
+                return ["❌ Empty command"]
+            self.sent_commands.append(cmd)
+            return ["📥 Command queued: " + cmd, "✅ Sent command: " + cmd]
+        if msg == "BOOT_PROFILE":
+            return ["[BOOT]imports 310 ms", "[BOOT]ble_advertising 1240 ms", "BOOT_END"]
+        if msg == "SAMPLES":
+            return ["[SAMPLE]smp {} port {}: runs 4 cycles 48 ~240.0 ml fail 0 first 2025-10-01 08:00:00 last 2025-10-19 08:00:00".format(p - 1, p)
+                    for p in SAMPLE_PORTS[:3]] + ["SAMPLES_END"]
+        if msg == "POWER:STATUS":
+            return ["[POWER]mode light", "[POWER]avg 12.4 mA", "POWER_END"]
+        return ["❌ Unknown command: " + msg]
+
+
+class SimTransport:
+    """Transport for FleetGateway backed by a SimulatedPeripheral."""
+
+    def __init__(self, peripheral):
+        self.peripheral = peripheral
+        self.address = peripheral.name
+        self._on_line = None
+        self._inbox = None
+        self._tasks = []
+
+    async def connect(self, on_line):
+        await asyncio.sleep(self.peripheral.connect_s)
+        self._on_line = on_line
+        self._inbox = asyncio.Queue()
+        self.peripheral.connected = True
+        self._tasks = [asyncio.ensure_future(self._serve())]
+        if self.peripheral.heartbeat_s:
+            self._tasks.append(asyncio.ensure_future(self._heartbeat()))
+
+    async def write(self, data):
+        if not self.peripheral.connected:
+            raise ConnectionError("{} is not connected".format(self.address))
+        await asyncio.sleep(self.peripheral.link_latency_s)
+        self._inbox.put_nowait(data.decode("utf-8").strip())
+
+    async def disconnect(self):
+        self.peripheral.connected = False
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _notify(self, line):
+        await asyncio.sleep(self.peripheral.notify_interval_s)
+        self._on_line(line)
+
+    async def _serve(self):
+        # Messages are handled one at a time, like on_ble_rx under ble_lock
+        while True:
+            msg = await self._inbox.get()
+            for line in self.peripheral.handle(msg):
+                await self._notify(line)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.peripheral.heartbeat_s)
+            await self._notify("🔄 Waiting for start command or schedule...")
@@ -0,0 +1,312 @@
+"""Compact binary trace of UART and BLE traffic, for record and replay.
+
+File layout: MAGIC, then one record per burst of traffic:
+
+    kind    1 byte   KIND_* below
+    delta   varint   ms since the previous record started
+    length  varint
+    data    length bytes
+
+Bytes read one at a time by the polling loops are merged into a single
+record while they keep arriving within MERGE_MS of each other, so a pump
+reply costs a few bytes of header rather than one record per byte.
+
+BLE writes arrive in the BLE callback, which can run in the middle of
+the main loop building a UART record. They are written by record_event()
+as whole records that leave the merge state alone. Their delta counts
+from the last UART or marker record, and they do not move that time base
+(version 2 of the format), so a burst still being merged keeps its own
+start time. tools/replay_trace.py reads this format with read_trace().
+"""
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # CPython, when only read_trace() is used
+    ticks_ms = ticks_diff = None
+
+from checkpoint import count_written
+
+TRACE_FILE = "trace.bin"
+TRACE_FLAG_FILE = "trace_on"  # present = keep recording across resets
+MAGIC = b"MKRT\x02"
+MAGIC_V1 = b"MKRT\x01"  # BLE records moved the time base like any other
+
+KIND_U0_TX = 1   # bytes written to uart0 (pump)
+KIND_U0_RX = 2   # bytes read from uart0
+KIND_U1_TX = 3   # uart1 (valve)
+KIND_U1_RX = 4
+KIND_BLE_RX = 5  # BLE write received from the phone
+KIND_BLE_TX = 6  # BLE notification sent
+KIND_MARK = 7    # text marker from the firmware ("step /2O05R", "boot", ...)
+EVENT_KINDS = (KIND_BLE_RX, KIND_BLE_TX)  # written by record_event()
+
+KIND_NAMES = {
+    KIND_U0_TX: "U0>", KIND_U0_RX: "U0<", KIND_U1_TX: "U1>", KIND_U1_RX: "U1<",
+    KIND_BLE_RX: "BLE<", KIND_BLE_TX: "BLE>", KIND_MARK: "MARK",
+}
+
+MERGE_MS = 5
+DEFAULT_MAX_BYTES = 256 * 1024
+
+
+def uart_kind(uart_id, rx):
+    return KIND_U0_TX + 2 * uart_id + (1 if rx else 0)
+
+
+def encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varint(buf, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _as_bytes(data):
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return bytes(data)
+
+
+class TraceRecorder:
+    """Buffers records in RAM and appends them to TRACE_FILE in chunks."""
+
+    def __init__(self, path=TRACE_FILE, max_bytes=DEFAULT_MAX_BYTES, flush_bytes=512):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_bytes = flush_bytes
+        self.active = False
+        self.size = 0
+        self.records = 0
+        self._file = None
+        self._buf = bytearray()
+        self._last_t = 0
+        self._pending_kind = 0
+        self._pending_t = 0
+        self._pending_last = 0
+        self._pending = bytearray()
+
+    def start(self, append=False):
+        """Begin recording. append=True continues an existing trace after a reset."""
+        self.stop()
+        if append:
+            try:
+                with open(self.path, "rb") as f:
+                    append = f.read(len(MAGIC)) == MAGIC  # older format: start over
+            except OSError:
+                pass
+        try:
+            self._file = open(self.path, "ab" if append else "wb")
+            self.size = self._file.seek(0, 2) if append else 0
+            if self.size == 0:
+                self._file.write(MAGIC)
+                self.size = len(MAGIC)
+        except OSError as e:
+            print("Trace start failed: {}".format(e))
+            self._file = None
+            return False
+        self.records = 0
+        self._last_t = ticks_ms()
+        self.active = True
+        self.mark("boot" if append else "start")
+        return True
+
+    def stop(self):
+        if not self.active:
+            return
+        self._close_pending()
+        self.flush()
+        self.active = False
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+
+    def record(self, kind, data):
+        if not self.active or not data:
+            return
+        now = ticks_ms()
+        if (kind == self._pending_kind and kind != KIND_MARK
+                and ticks_diff(now, self._pending_last) <= MERGE_MS):
+            self._pending.extend(data)
+            self._pending_last = now
+            return
+        self._close_pending()
+        self._pending_kind = kind
+        self._pending_t = now
+        self._pending_last = now
+        self._pending.extend(data)
+
+    def record_event(self, kind, data):
+        """Write one complete BLE record (EVENT_KINDS); safe from the BLE callback.
+
+        Appends with a single extend and never touches the record being
+        merged, so it cannot cut a UART burst short. Written to flash by
+        the next flush() from the main loop (poll(), mark(), ...).
+        """
+        if not self.active or not data:
+            return
+        rec = bytearray()
+        rec.append(kind)
+        encode_varint(max(0, ticks_diff(ticks_ms(), self._last_t)), rec)
+        encode_varint(len(data), rec)
+        rec.extend(data)
+        self._buf.extend(rec)
+        self.records += 1
+
+    def poll(self):
+        """Main loop: write out buffered records once flush_bytes have built up."""
+        if self.active and len(self._buf) >= self.flush_bytes:
+            self.flush()
+
+    def mark(self, text):
+        """Record a marker and flush, so the trace is on flash up to this point."""
+        if not self.active:
+            return
+        self.record(KIND_MARK, _as_bytes(text))
+        self._close_pending()
+        self.flush()
+
+    def _close_pending(self):
+        if not self._pending_kind:
+            return
+        rec = bytearray()  # built aside, so a record_event() cannot land inside it
+        rec.append(self._pending_kind)
+        encode_varint(max(0, ticks_diff(self._pending_t, self._last_t)), rec)
+        encode_varint(len(self._pending), rec)
+        rec.extend(self._pending)
+        self._buf.extend(rec)
+        self._last_t = self._pending_t
+        self._pending_kind = 0
+        self._pending = bytearray()
+        self.records += 1
+        if len(self._buf) >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._buf or self._file is None:
+            return
+        buf = self._buf
+        self._buf = bytearray()  # record_event() appends to the new buffer from here on
+        if self.size + len(buf) > self.max_bytes:
+            print("Trace full ({} bytes), recording stopped".format(self.size))
+            self.active = False
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+            return
+        try:
+            self._file.write(buf)
+            self._file.flush()
+            self.size += len(buf)
+            count_written(len(buf))
+        except OSError as e:
+            print("Trace write failed: {}".format(e))
+
+    def status_line(self):
+        state = "recording" if self.active else "stopped"
+        return "{} {}: {} bytes, {} records (limit {})".format(
+            self.path, state, self.size + len(self._buf), self.records, self.max_bytes)
+
+
+class TracedUART:
+    """UART wrapper that records traffic while the recorder is active."""
+
+    def __init__(self, uart, uart_id, recorder):
+        self._uart = uart
+        self._tx = uart_kind(uart_id, False)
+        self._rx = uart_kind(uart_id, True)
+        self._rec = recorder
+
+    def write(self, buf):
+        if self._rec.active:
+            self._rec.record(self._tx, _as_bytes(buf))
+        return self._uart.write(buf)
+
+    def read(self, *args):
+        data = self._uart.read(*args)
+        if data and self._rec.active:
+            self._rec.record(self._rx, data)
+        return data
+
+    def readinto(self, buf, *args):
+        n = self._uart.readinto(buf, *args)
+        if n and self._rec.active:
+            self._rec.record(self._rx, bytes(buf[:n]))
+        return n
+
+    def any(self):
+        return self._uart.any()
+
+    def __getattr__(self, name):
+        return getattr(self._uart, name)
+
+
+class TracedPeripheral:
+    """BLE peripheral wrapper recording notifications and received writes."""
+
+    def __init__(self, peripheral, recorder):
+        self._sp = peripheral
+        self._rec = recorder
+
+    def send(self, data):
+        if self._rec.active:
+            self._rec.record_event(KIND_BLE_TX, _as_bytes(data))
+        return self._sp.send(data)
+
+    def on_write(self, callback):
+        rec = self._rec
+
+        def traced(data):
+            if rec.active:
+                rec.record_event(KIND_BLE_RX, _as_bytes(data))
+            callback(data)
+
+        return self._sp.on_write(traced)
+
+    def __getattr__(self, name):
+        return getattr(self._sp, name)
+
+
+def read_trace(data):
+    """Decode a whole trace (bytes). Yields (t_ms, kind, payload) with t from the start.
+
+    In a version 2 trace a BLE record can come before a UART burst that
+    started earlier but was still being merged when it was written.
+    """
+    if data[:len(MAGIC)] == MAGIC:
+        events = EVENT_KINDS
+    elif data[:len(MAGIC_V1)] == MAGIC_V1:
+        events = ()
+    else:
+        raise ValueError("not a trace file")
+    pos = len(MAGIC)
+    t = 0
+    n = len(data)
+    while pos < n:
+        kind = data[pos]
+        try:
+            delta, pos = decode_varint(data, pos + 1)
+            length, pos = decode_varint(data, pos)
+        except IndexError:
+            return  # truncated by a reset mid-write
+        if pos + length > n:
+            return
+        if kind in events:
+            yield t + delta, kind, bytes(data[pos:pos + length])
+        else:
+            t += delta
+            yield t, kind, bytes(data[pos:pos + length])
+        pos += length
@@ -0,0 +1,85 @@
+"""Filtered VSYS estimate with trend and load-sag prediction."""
+import time
+
+# (min volts, level name, BLE tx power dBm, heartbeat interval ms)
+LEVELS = (
+    (3.90, "NORMAL", 8, 5000),
+    (3.75, "REDUCED", 4, 15000),
+    (3.60, "LOW", 0, 30000),
+    (0.00, "CRITICAL", -4, 60000),
+)
+
+LEVEL_HYSTERESIS_V = 0.03  # a level is only re-entered this far above its threshold
+BROWNOUT_V = 3.25          # RP2040 + relay coil drop out below this under load
+DEFAULT_PUMP_SAG_V = 0.15  # used until a sag has been observed during a pump cycle
+
+
+class VsysMonitor:
+    """Oversampled, exponentially smoothed VSYS with a V/hour trend.
+
+    read_raw is a function returning one VSYS reading in volts.
+    """
+
+    def __init__(self, read_raw, oversample=8, alpha=0.2, trend_alpha=0.1):
+        self.read_raw = read_raw
+        self.oversample = oversample
+        self.alpha = alpha
+        self.trend_alpha = trend_alpha
+        self.volts = None
+        self.trend_v_per_h = 0.0
+        self.pump_sag_v = DEFAULT_PUMP_SAG_V
+        self._last_ms = None
+        self._level = None  # index into LEVELS last returned by level()
+
+    def sample(self):
+        """Take an averaged reading, update the filter and return the estimate."""
+        total = 0.0
+        for _ in range(self.oversample):
+            total += self.read_raw()
+        reading = total / self.oversample
+        now = time.ticks_ms()
+        if self.volts is None:
+            self.volts = reading
+        else:
+            prev = self.volts
+            self.volts += self.alpha * (reading - self.volts)
+            dt_ms = time.ticks_diff(now, self._last_ms)
+            if dt_ms > 0:
+                slope = (self.volts - prev) * 3600000 / dt_ms
+                self.trend_v_per_h += self.trend_alpha * (slope - self.trend_v_per_h)
+        self._last_ms = now
+        return self.volts
+
+    def estimate(self):
+        return self.volts if self.volts is not None else self.sample()
+
+    def level(self):
+        """Return (name, tx_power_dbm, heartbeat_ms) for the current estimate.
+
+        A level is left as soon as VSYS drops below its threshold, but a
+        higher one is only taken again LEVEL_HYSTERESIS_V above its own, so
+        a voltage sitting on a threshold does not flip the level every sample.
+        """
+        v = self.estimate()
+        for i, (min_v, name, dbm, heartbeat_ms) in enumerate(LEVELS):
+            if self._level is not None and i < self._level:
+                min_v += LEVEL_HYSTERESIS_V
+            if v >= min_v:
+                break
+        self._level = i
+        return LEVELS[i][1:]
+
+    def record_sag(self, idle_v, loaded_v):
+        """Learn the drop seen while the pump was running (keeps the worst recent one)."""
+        sag = idle_v - loaded_v
+        if sag > 0:
+            # Decay slowly so one bad cycle does not block pumping forever
+            self.pump_sag_v = max(sag, self.pump_sag_v * 0.9)
+
+    def predict_loaded(self, duration_ms):
+        """Predicted VSYS at the end of a pump cycle lasting duration_ms."""
+        drift = self.trend_v_per_h * duration_ms / 3600000
+        return self.estimate() + min(drift, 0.0) - self.pump_sag_v
+
+    def brownout_predicted(self, duration_ms):
+        return self.predict_loaded(duration_ms) < BROWNOUT_V